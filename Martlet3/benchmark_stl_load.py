@@ -0,0 +1,48 @@
+"""
+Script to compare the time taken to load the Martlet3 STLs with firefish and with numpy-stl.
+
+Only the fins and boat tail are ASCII exports. The other parts are binary, so
+an ASCII copy of each of those is written to a temporary directory and timed
+as well.
+"""
+import os, shutil, tempfile, timeit
+
+import stl
+import stl.mesh as mesh
+
+from firefish.geometry import stl_load
+
+STL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'STLS')
+repeats = 20
+
+def best_time(func):
+	"""The best time in seconds over a number of runs of func"""
+	return min(timeit.repeat(func, number=1, repeat=repeats))
+
+def benchmark(path):
+	"""Prints load times for one STL file"""
+	numpy_stl = best_time(lambda: mesh.Mesh.from_file(path))
+	firefish = best_time(lambda: stl_load(path))
+	print('{:<42} {:>8} {:>12.2f} {:>12.2f} {:>8.1f}x'.format(
+		os.path.basename(path), len(stl_load(path)), 1e3*numpy_stl,
+		1e3*firefish, numpy_stl/firefish))
+
+def main():
+	print('{:<42} {:>8} {:>12} {:>12} {:>9}'.format(
+		'file', 'facets', 'numpy-stl/ms', 'firefish/ms', 'speedup'))
+	tmp_dir = tempfile.mkdtemp()
+	try:
+		for name in sorted(os.listdir(STL_DIR)):
+			path = os.path.join(STL_DIR, name)
+			benchmark(path)
+			with open(path, 'rb') as f:
+				is_ascii = f.read(5) == b'solid'
+			if not is_ascii:
+				ascii_path = os.path.join(tmp_dir, name.replace('.stl', '_ascii.stl'))
+				mesh.Mesh.from_file(path).save(ascii_path, mode=stl.Mode.ASCII)
+				benchmark(ascii_path)
+	finally:
+		shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+	main()
@@ -14,15 +14,36 @@ OpenFOAM files are mapped into Python objects using the following conventions:
 import contextlib
 import datetime
 import enum
+import gzip
+import io
+import json
 import os
+import shlex
+import shutil
 import subprocess
+import tarfile
 import tempfile
+import threading
+import zlib
+from multiprocessing.pool import ThreadPool
 
 import PyFoam.Basics.DataStructures as PFDataStructs
 from PyFoam.RunDictionary.ParsedParameterFile import (
-    ParsedParameterFile, WriteParameterFile
+    FoamFileParser, ParsedParameterFile, WriteParameterFile
 )
 
+# Optional compression modules. lzma is not available on Python 2 and
+# zstandard is a third-party package.
+try:
+    import lzma
+except ImportError: # pragma: no cover
+    lzma = None
+
+try:
+    import zstandard
+except ImportError: # pragma: no cover
+    zstandard = None
+
 ## EXCEPTIONS
 
 class CaseException(Exception):
@@ -37,6 +58,9 @@ class CaseToolRunFailed(CaseException):
 class CaseAlreadyExists(CaseException):
     """Some resource already existed."""
 
+class CaseArchiveError(CaseException):
+    """A case archive could not be written or read."""
+
 ## ENUMERATIONS
 
 def _sys_path(p):
@@ -280,13 +304,24 @@ class Case(object):
         """
         return read_data_file(self._get_rel_path(_to_dict_path(path)))
 
-    def run_tool(self, tool_name, flags=""):
+    def run_tool(self, tool_name, flags="", n_procs=1, line_callback=None):
         """Run an OpenFOAM tool on the case.
 
         It is assumed that the tool accepts the standard "-case" argument.
+        The tool's output is written to a log file in the case directory.
 
         Args:
             tool_name (str): name of tool to run (e.g. "icoFoam")
+            flags (str): additional command line flags for the tool. These
+                are split into separate arguments as a shell would.
+            n_procs (int): if greater than one, run the tool with the
+                "-parallel" flag over this many MPI processes via mpirun. The
+                case must already have been decomposed.
+            line_callback (callable): if not None, called with each line of
+                output as a string as soon as the tool writes it
+
+        Returns:
+            The path to the log file.
 
         Raises:
             CaseToolRunFailed: if the tool exits with an error
@@ -302,17 +337,33 @@ class Case(object):
         # We assume that the tool can take a -case argument
         args = [tool_name, '-case', self.root_dir_path]
 
+        if n_procs > 1:
+            args = ['mpirun', '-np', str(n_procs)] + args + ['-parallel']
+
         if flags:
-            args.append(flags)
+            args.extend(shlex.split(flags))
 
         # Run the command
-        try:
-            with tf as log_file_obj:
-                subprocess.check_call(
+        with tf as log_file_obj:
+            if line_callback is None:
+                returncode = subprocess.call(
                     args, stdout=log_file_obj, stderr=subprocess.STDOUT
                 )
-        except subprocess.CalledProcessError as e:
-            raise CaseToolRunFailed(*e.args)
+            else:
+                proc = subprocess.Popen(
+                    args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+                )
+                for line in iter(proc.stdout.readline, b''):
+                    log_file_obj.write(line)
+                    log_file_obj.flush()
+                    line_callback(line.decode('utf-8', 'replace'))
+                proc.stdout.close()
+                returncode = proc.wait()
+
+        if returncode != 0:
+            raise CaseToolRunFailed(returncode, args)
+
+        return tf.name
 
     def add_tri_surface(self, name, geom, clobber_existing=False):
         """Add a triangulated surface to the case.
@@ -330,7 +381,8 @@ class Case(object):
 
         Args:
             name (str): name to save surface as
-            geom (stl.mesh.Mesh): geometry representing surface
+            geom (stl.mesh.Mesh or firefish.geometry.Geometry): geometry
+                representing surface
             clobber_existing (bool): if False, do not overwrite an existing file
 
         Raises:
@@ -338,6 +390,9 @@ class Case(object):
                 and *clobber_existing* was not True.
 
         """
+        # firefish.geometry imports this module so cannot be imported above
+        from firefish.geometry import stl_save
+
         stl_path = os.path.join(
             self.root_dir_path, 'constant', 'triSurface', '{}.stl'.format(name)
         )
@@ -350,12 +405,513 @@ class Case(object):
 
         if not os.path.isdir(os.path.dirname(stl_path)):
             os.makedirs(os.path.dirname(stl_path))
-        geom.save(stl_path)
+        if hasattr(geom, 'geom'):
+            geom = geom.geom
+        stl_save(geom, stl_path, name=name)
+
+    def add_tri_surfaces(self, surfaces, clobber_existing=False,
+                         processes=None):
+        """Add several triangulated surfaces to the case concurrently.
+
+        Each surface is added as if by :py:meth:`add_tri_surface` with the
+        files written from a pool of threads.
+
+        Args:
+            surfaces: sequence of (name, geom) pairs
+            clobber_existing (bool): if False, do not overwrite existing files
+            processes (int): number of threads to use. If None, one per
+                surface.
+
+        Raises:
+            CaseAlreadyExists: if a surface with one of the given names already
+                exists and *clobber_existing* was not True. No surfaces are
+                written in this case.
+
+        """
+        surfaces = list(surfaces)
+        if len(surfaces) == 0:
+            return
+        surface_dir = os.path.join(self.root_dir_path, 'constant', 'triSurface')
+        if not clobber_existing:
+            for name, _ in surfaces:
+                stl_path = os.path.join(surface_dir, '{}.stl'.format(name))
+                if os.path.exists(stl_path):
+                    raise CaseAlreadyExists(
+                        'triSurface {} already exists'.format(stl_path)
+                    )
+        if not os.path.isdir(surface_dir):
+            os.makedirs(surface_dir)
+
+        pool = ThreadPool(processes or len(surfaces))
+        try:
+            pool.map(lambda s: self.add_tri_surface(s[0], s[1], True),
+                     surfaces)
+        finally:
+            pool.close()
+            pool.join()
+
+    def time_directories(self):
+        """The times for which the case has a time directory.
+
+        Time directories are those directly under the case root whose name
+        parses as a number, e.g. ``0``, ``0.001`` or ``1e-05``.
+
+        >>> case = getfixture('tmpcase')
+        >>> for t in ['0', '0.002', '0.001', 'constant']:
+        ...     os.makedirs(os.path.join(case.root_dir_path, t))
+        >>> case.time_directories()
+        [0.0, 0.001, 0.002]
+
+        Returns:
+            A sorted list of times as floats.
+
+        """
+        return [t for t, _ in _time_directories(self.root_dir_path)]
+
+    def retention(self, keep_latest=2, checkpoints=None, compress=False,
+                  interval=10.0):
+        """Create a retention policy for the case's time directories.
+
+        See :py:class:`TimeDirectoryRetention` for the meaning of the
+        arguments. The returned object may be used as a context manager
+        around a solver run in which case old time directories are purged in
+        the background while the solver runs::
+
+            with case.retention(keep_latest=3, checkpoints=[0.05]) as r:
+                case.run_tool('rhoCentralFoam')
+            print(r.bytes_reclaimed)
+
+        Returns:
+            A new :py:class:`TimeDirectoryRetention` instance.
+
+        """
+        return TimeDirectoryRetention(
+            self, keep_latest=keep_latest, checkpoints=checkpoints,
+            compress=compress, interval=interval
+        )
+
+    def archive(self, path, times=None,
+                include=('system', 'constant', 'postProcessing'),
+                compression='xz', chunk_size=8*1024*1024, processes=None):
+        """Pack the case into a single compressed tar archive.
+
+        Files are grouped into chunks of roughly *chunk_size* uncompressed
+        bytes. Each chunk is read, serialised and compressed as an independent
+        stream on a thread pool and the streams are concatenated. The result is
+        an ordinary compressed tarball which standard tools can extract (e.g.
+        ``tar xJf case.tar.xz``).
+
+        An index giving the location of each member is written alongside the
+        archive as ``<path>.index``. :py:meth:`open_archive` uses it to read
+        individual members by decompressing only the chunk containing them.
+
+        >>> case = getfixture('tmpcase')
+        >>> with case.mutable_data_file(FileName.CONTROL) as d:
+        ...     d['application'] = 'icoFoam'
+        >>> archive_path = os.path.join(case.root_dir_path, '..', 'case.tar.gz')
+        >>> case.archive(archive_path, compression='gz')
+        >>> with Case.open_archive(archive_path) as a:
+        ...     a.read_data_file(FileName.CONTROL)['application']
+        'icoFoam'
+
+        Args:
+            path (str): path of the archive to write
+            times (list of float): times whose directories are archived. If
+                None, all time directories are archived.
+            include (sequence of str): other case-relative directories to
+                archive if they exist. The default includes the mesh in
+                ``constant/polyMesh`` and function object output in
+                ``postProcessing``.
+            compression (str): one of "xz", "gz" or "zstd". "zstd" requires
+                the zstandard package.
+            chunk_size (int): approximate uncompressed size of each chunk
+            processes (int): number of compression threads. If None, the
+                number of CPUs is used.
+
+        Raises:
+            CaseArchiveError: if the compression method is not available
+
+        """
+        compress, _ = _archive_codec(compression)
+
+        dir_names = [d for d in include
+                     if os.path.isdir(self._get_rel_path(d))]
+        for time, time_path in _time_directories(self.root_dir_path):
+            if times is None or any(_times_match(time, t) for t in times):
+                dir_names.append(os.path.basename(time_path))
+
+        chunks, current, current_size = [], [], 0
+        for dir_name in dir_names:
+            for dir_path, sub_dirs, file_names in os.walk(
+                    self._get_rel_path(dir_name)):
+                sub_dirs.sort()
+                for file_name in sorted(file_names):
+                    file_path = os.path.join(dir_path, file_name)
+                    arc_name = os.path.relpath(file_path, self.root_dir_path)
+                    current.append((file_path, arc_name.replace(os.sep, '/')))
+                    current_size += os.path.getsize(file_path)
+                    if current_size >= chunk_size:
+                        chunks.append(current)
+                        current, current_size = [], 0
+        if current:
+            chunks.append(current)
+
+        def pack(chunk):
+            data, members = _tar_chunk(chunk)
+            return compress(data), members
+
+        index = {'compression': compression, 'chunks': [], 'members': {}}
+        pool = ThreadPool(processes)
+        try:
+            with open(path, 'wb') as archive_file:
+                for compressed, members in pool.imap(pack, chunks):
+                    for name, offset, size in members:
+                        index['members'][name] = [
+                            len(index['chunks']), offset, size
+                        ]
+                    index['chunks'].append(
+                        [archive_file.tell(), len(compressed)]
+                    )
+                    archive_file.write(compressed)
+                # Two zero blocks mark the end of a tar archive.
+                archive_file.write(compress(b'\0' * 2 * tarfile.BLOCKSIZE))
+        finally:
+            pool.close()
+            pool.join()
+
+        with open(path + '.index', 'w') as index_file:
+            json.dump(index, index_file)
+
+    @staticmethod
+    def open_archive(path):
+        """Open an archive written by :py:meth:`archive` for reading.
+
+        Members are read lazily; the archive is never extracted in full unless
+        :py:meth:`CaseArchive.extract` is called.
+
+        Args:
+            path (str): path to the archive
+
+        Returns:
+            A :py:class:`CaseArchive` instance.
+
+        """
+        return CaseArchive(path)
 
     def _get_rel_path(self, path):
         """Return path relative to root directory."""
         return os.path.join(self.root_dir_path, path)
 
+class TimeDirectoryRetention(object):
+    """A retention policy which bounds the disk usage of a case's output.
+
+    Solvers writing at a short ``writeInterval`` with ``purgeWrite 0`` can
+    fill a disk with time directories. This object keeps the latest
+    *keep_latest* time directories, any time directory matching one of
+    *checkpoints* and the earliest time directory (which holds the initial
+    conditions). Every other time directory is either deleted or, if
+    *compress* is True, has its files gzip-compressed in place. OpenFOAM reads
+    gzipped field files transparently so compressed times may still be used
+    for post-processing or restarts.
+
+    Time directories under ``processor*`` directories of a decomposed case
+    are treated in the same way.
+
+    Purging may be performed synchronously via :py:meth:`purge` or on a
+    background thread via :py:meth:`start` and :py:meth:`stop` so that the
+    deletion does not compete with the solver for I/O on the calling thread.
+
+    >>> case = getfixture('tmpcase')
+    >>> for t in ['0', '0.001', '0.002', '0.003', '0.004']:
+    ...     os.makedirs(os.path.join(case.root_dir_path, t))
+    ...     with open(os.path.join(case.root_dir_path, t, 'p'), 'w') as f:
+    ...         _ = f.write('x' * 100)
+    >>> retention = TimeDirectoryRetention(case, keep_latest=1,
+    ...                                    checkpoints=[0.002])
+    >>> retention.purge()
+    200
+    >>> case.time_directories()
+    [0.0, 0.002, 0.004]
+
+    Attributes:
+        case (firefish.case.Case): the case being managed
+        keep_latest (int): number of most recent time directories to keep
+        checkpoints (list): times whose directories are always kept
+        compress (bool): compress rather than delete unwanted directories
+        interval (float): seconds between purges on the background thread
+        bytes_reclaimed (int): total number of bytes freed so far
+
+    """
+
+    def __init__(self, case, keep_latest=2, checkpoints=None, compress=False,
+                 interval=10.0):
+        """Initialises the retention policy.
+
+        Args:
+            case (firefish.case.Case): the case to manage
+            keep_latest (int): number of most recent time directories to keep.
+                This must be at least one since the latest directory may be
+                being written by a running solver.
+            checkpoints (list of float): times whose directories are kept
+            compress (bool): gzip unwanted directories instead of deleting
+            interval (float): seconds between background purges
+
+        Raises:
+            ValueError: if keep_latest is less than one
+
+        """
+        if keep_latest < 1:
+            raise ValueError('keep_latest must be at least one')
+        self.case = case
+        self.keep_latest = keep_latest
+        self.checkpoints = list(checkpoints) if checkpoints is not None else []
+        self.compress = compress
+        self.interval = interval
+        self.bytes_reclaimed = 0
+
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._error = None
+
+    def is_retained(self, time, times):
+        """Return True if the directory for *time* should be kept.
+
+        Args:
+            time (float): the time to test
+            times (list of float): all times present, sorted ascending
+
+        """
+        if time == times[0] or time in times[-self.keep_latest:]:
+            return True
+        return any(_times_match(time, c) for c in self.checkpoints)
+
+    def purge(self):
+        """Perform a single purge of the case's time directories.
+
+        Returns:
+            The number of bytes reclaimed by this purge.
+
+        """
+        reclaimed = 0
+        for dir_path in self._time_roots():
+            time_dirs = _time_directories(dir_path)
+            times = [t for t, _ in time_dirs]
+            for time, path in time_dirs:
+                if self.is_retained(time, times):
+                    continue
+                if self.compress:
+                    reclaimed += _gzip_tree(path)
+                else:
+                    reclaimed += _tree_size(path)
+                    shutil.rmtree(path)
+
+        with self._lock:
+            self.bytes_reclaimed += reclaimed
+        return reclaimed
+
+    def start(self):
+        """Start purging periodically on a background thread."""
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._error = None
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread after performing a final purge.
+
+        Raises:
+            OSError: if the background thread failed to purge a directory
+
+        """
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _run(self):
+        try:
+            while not self._stop_event.wait(self.interval):
+                self.purge()
+            self.purge()
+        except (OSError, IOError) as e:
+            self._error = e
+
+    def _time_roots(self):
+        """Directories which may contain time directories."""
+        root = self.case.root_dir_path
+        roots = [root]
+        for entry in sorted(os.listdir(root)):
+            path = os.path.join(root, entry)
+            if entry.startswith('processor') and os.path.isdir(path):
+                roots.append(path)
+        return roots
+
+class CaseArchive(object):
+    """Read-only, lazy access to a case archive.
+
+    Instances are usually created via :py:meth:`Case.open_archive`. If the
+    index written by :py:meth:`Case.archive` is present, reading a member
+    decompresses only the chunk which contains it. Otherwise the archive is
+    read as an ordinary compressed tarball.
+
+    Field files which have been compressed by a
+    :py:class:`TimeDirectoryRetention` policy are transparently decompressed,
+    i.e. ``0.001/U`` may be read even if the archive contains ``0.001/U.gz``.
+
+    Attributes:
+        path (str): path to the archive
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._index = None
+        self._tar = None
+        self._file = None
+        self._cached_chunk = (None, None)
+
+        index_path = path + '.index'
+        if os.path.isfile(index_path):
+            with open(index_path) as index_file:
+                self._index = json.load(index_file)
+            _, self._decompress = _archive_codec(self._index['compression'])
+            self._file = open(path, 'rb')
+        else:
+            try:
+                self._tar = tarfile.open(path, 'r:*')
+            except tarfile.TarError as e:
+                raise CaseArchiveError(
+                    'Cannot read archive {}: {}'.format(path, e)
+                )
+
+    def names(self):
+        """A sorted list of the case-relative paths of the archived files."""
+        if self._index is not None:
+            return sorted(self._index['members'])
+        return sorted(m.name for m in self._tar.getmembers() if m.isfile())
+
+    def time_directories(self):
+        """The sorted times of the archived time directories."""
+        times = set()
+        for name in self.names():
+            try:
+                times.add(float(name.split('/')[0]))
+            except ValueError:
+                continue
+        return sorted(times)
+
+    def read_member(self, path):
+        """Read the raw contents of an archived file.
+
+        Args:
+            path (str or FileName): case-relative path to the file
+
+        Returns:
+            The file contents as bytes.
+
+        Raises:
+            KeyError: if the file is not in the archive
+
+        """
+        name = _to_dict_path(path).replace(os.sep, '/')
+        names = self._member_names()
+        if name not in names and name + '.gz' in names:
+            return gzip.GzipFile(
+                fileobj=io.BytesIO(self._read_raw(name + '.gz'))
+            ).read()
+        return self._read_raw(name)
+
+    def open(self, path):
+        """Open an archived file as a binary file-like object.
+
+        Args:
+            path (str or FileName): case-relative path to the file
+
+        """
+        return io.BytesIO(self.read_member(path))
+
+    def read_data_file(self, path):
+        """Read and parse an archived OpenFOAM dict.
+
+        Args:
+            path (str or FileName): case-relative path to the dict
+
+        Returns:
+            A dict representing a Python transliteration of the dict.
+
+        """
+        content = self.read_member(path).decode('utf-8')
+        return FoamFileParser(content, fName=_to_dict_path(path)).getData()
+
+    def extract(self, root_dir_path, names=None):
+        """Restore archived files to a new case directory.
+
+        Args:
+            root_dir_path (str): path to the case directory to create
+            names (list of str): case-relative paths to restore. If None, all
+                files are restored.
+
+        Returns:
+            A :py:class:`Case` for the restored directory.
+
+        """
+        case = Case(root_dir_path)
+        for name in (names if names is not None else self.names()):
+            dest = os.path.join(root_dir_path, *name.split('/'))
+            if not os.path.isdir(os.path.dirname(dest)):
+                os.makedirs(os.path.dirname(dest))
+            with open(dest, 'wb') as dest_file:
+                dest_file.write(self._read_raw(name))
+        return case
+
+    def close(self):
+        """Close the underlying archive file."""
+        if self._file is not None:
+            self._file.close()
+        if self._tar is not None:
+            self._tar.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _member_names(self):
+        if self._index is not None:
+            return self._index['members']
+        return set(self._tar.getnames())
+
+    def _read_raw(self, name):
+        if self._index is None:
+            try:
+                return self._tar.extractfile(name).read()
+            except (KeyError, AttributeError):
+                raise KeyError('Not in archive: {}'.format(name))
+
+        chunk_idx, offset, size = self._index['members'][name]
+        cached_idx, chunk = self._cached_chunk
+        if cached_idx != chunk_idx:
+            chunk_offset, chunk_length = self._index['chunks'][chunk_idx]
+            self._file.seek(chunk_offset)
+            chunk = self._decompress(self._file.read(chunk_length))
+            self._cached_chunk = (chunk_idx, chunk)
+        return chunk[offset:offset+size]
+
 class StandardFluid(enum.Enum):
     """An enumeration of commonly used fluids
 
@@ -449,6 +1005,97 @@ def _mutable_data_file_manager(path, create_class=FileClass.DICTIONARY,
     yield foam_file.content
     foam_file.writeFile()
 
+def _time_directories(dir_path):
+    """Return a sorted list of (time, path) pairs for time directories."""
+    time_dirs = []
+    for entry in os.listdir(dir_path):
+        path = os.path.join(dir_path, entry)
+        if not os.path.isdir(path):
+            continue
+        try:
+            time_dirs.append((float(entry), path))
+        except ValueError:
+            continue
+    return sorted(time_dirs)
+
+def _times_match(a, b):
+    """Compare times allowing for the rounding of time directory names."""
+    return abs(a - b) <= 1e-12 + 1e-6 * abs(b)
+
+def _tree_size(path):
+    """Total size in bytes of the files under *path*."""
+    total = 0
+    for dir_path, _, file_names in os.walk(path):
+        for file_name in file_names:
+            total += os.path.getsize(os.path.join(dir_path, file_name))
+    return total
+
+def _gzip_tree(path):
+    """Gzip every uncompressed file under *path* in place.
+
+    Returns:
+        The number of bytes reclaimed.
+
+    """
+    reclaimed = 0
+    for dir_path, _, file_names in os.walk(path):
+        for file_name in file_names:
+            if file_name.endswith('.gz'):
+                continue
+            src = os.path.join(dir_path, file_name)
+            with open(src, 'rb') as f_in:
+                with gzip.open(src + '.gz', 'wb') as f_out:
+                    shutil.copyfileobj(f_in, f_out)
+            reclaimed += os.path.getsize(src) - os.path.getsize(src + '.gz')
+            os.remove(src)
+    return reclaimed
+
+def _archive_codec(compression):
+    """Return a (compress, decompress) pair of functions for *compression*."""
+    if compression == 'xz' and lzma is not None:
+        return lzma.compress, lzma.decompress
+    elif compression == 'gz':
+        # A gzip stream is a zlib deflate stream with gzip framing.
+        def compress(data):
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            return compressor.compress(data) + compressor.flush()
+        return compress, lambda data: zlib.decompress(data, 16 + zlib.MAX_WBITS)
+    elif compression == 'zstd' and zstandard is not None:
+        return (zstandard.ZstdCompressor().compress,
+                zstandard.ZstdDecompressor().decompress)
+    raise CaseArchiveError(
+        'Compression method not available: {}'.format(compression)
+    )
+
+def _tar_chunk(files):
+    """Serialise files into tar blocks without an end-of-archive marker.
+
+    Args:
+        files (list): (file path, archive name) pairs
+
+    Returns:
+        A pair giving the tar data as bytes and a list of (archive name, data
+        offset, size) triples.
+
+    """
+    buf = io.BytesIO()
+    members = []
+    for file_path, arc_name in files:
+        with open(file_path, 'rb') as f:
+            data = f.read()
+        info = tarfile.TarInfo(arc_name)
+        stat = os.stat(file_path)
+        info.size = len(data)
+        info.mtime = stat.st_mtime
+        info.mode = stat.st_mode & 0o777
+        buf.write(info.tobuf(tarfile.PAX_FORMAT))
+        members.append((arc_name, buf.tell(), len(data)))
+        buf.write(data)
+        remainder = len(data) % tarfile.BLOCKSIZE
+        if remainder:
+            buf.write(b'\0' * (tarfile.BLOCKSIZE - remainder))
+    return buf.getvalue(), members
+
 def _to_dict_path(path_or_dict_name):
     try:
         return path_or_dict_name.value
@@ -7,17 +7,101 @@ See the `numpy-stl documentation`_ for more information.
 .. _numpy-stl documentation: http://numpy-stl.readthedocs.org/en/latest/stl.html#module-stl.mesh
 
 """
+import collections
+import multiprocessing
+import os
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
 import numpy as np
 import stl.mesh as mesh
 import enum
 
 from firefish.case import FileName
-from subprocess import call
+
+#: A triangulated surface whose faces share vertices. *vertices* is a (V, 3)
+#: float64 array of distinct vertices and *faces* a (F, 3) int32 array of
+#: indices into it. Faces are in the same order as the triangles of the
+#: :py:class:`stl.mesh.Mesh` they were built from.
+IndexedMesh = collections.namedtuple('IndexedMesh', ['vertices', 'faces'])
+
+# Offsets to half of the 26 cells neighbouring a cell. Checking these from
+# every cell checks every neighbouring pair once.
+_HALF_NEIGHBOURS = np.array([
+    (dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)
+    if (dx, dy, dz) > (0, 0, 0)
+], dtype=np.int64)
+
+_CELL_DTYPE = np.dtype([('x', '<i8'), ('y', '<i8'), ('z', '<i8')])
+
+class SurfaceCheck(collections.namedtuple('SurfaceCheck', [
+        'open_edges', 'non_manifold_edges', 'inconsistent_edges',
+        'degenerate_faces'])):
+    """The result of checking a surface with :py:func:`stl_check`.
+
+    *open_edges*, *non_manifold_edges* and *inconsistent_edges* are (N, 2)
+    arrays of pairs of vertex indices into the checked
+    :py:class:`IndexedMesh`. *degenerate_faces* is a 1-d array of face
+    indices.
+
+    """
+    __slots__ = ()
+
+    @property
+    def closed(self):
+        """True if the surface is closed and manifold with consistent winding,
+        i.e. fit to be meshed."""
+        return (len(self.open_edges) == 0 and
+                len(self.non_manifold_edges) == 0 and
+                len(self.inconsistent_edges) == 0)
+
+    def summary(self):
+        """A one-line description of the problems found"""
+        return ('{} open edges, {} non-manifold edges, {} inconsistently '
+                'wound edges, {} degenerate faces').format(
+                    len(self.open_edges), len(self.non_manifold_edges),
+                    len(self.inconsistent_edges), len(self.degenerate_faces))
+
+class MassProperties(collections.namedtuple('MassProperties', [
+        'mass', 'volume', 'centre_of_mass', 'inertia'])):
+    """The mass properties of a solid computed by
+    :py:func:`stl_mass_properties` or :py:func:`mass_properties`.
+
+    *centre_of_mass* is a 3-vector and *inertia* the 3x3 inertia tensor about
+    the centre of mass in the geometry's axes. Units follow from those of the
+    geometry and density, e.g. kg m^2 for a geometry in metres and a density
+    in kg/m^3.
+
+    """
+    __slots__ = ()
+
+    def principal(self):
+        """Computes the principal moments and axes of inertia
+
+        Returns:
+            A pair giving the principal moments in ascending order and a 3x3
+            array whose columns are the corresponding principal axes.
+        """
+        return np.linalg.eigh(self.inertia)
+
+#: Reference values for force coefficients. *wetted_area* is the area of the
+#: surface exposed to the flow, *frontal_area* the area of the geometry
+#: projected along the flight axis and *length* the length along that axis.
+ReferenceValues = collections.namedtuple(
+    'ReferenceValues', ['wetted_area', 'frontal_area', 'length']
+)
 
 class GeometryFormat(enum.Enum):
     """An enumeration of different geometry formats"""
     STL = 1
 
+class NoseShape(enum.Enum):
+    """An enumeration of the nose cone profiles made by :py:func:`rocket_surface`"""
+    CONIC = 'conic'
+    OGIVE = 'ogive'
+    VON_KARMAN = 'von_karman'
+
 class MeshQualitySettings(object):
     """Controls the mesh quality settings associated with the gometry"""
     # pylint: disable-all
@@ -62,10 +146,19 @@ class MeshQualitySettings(object):
 
 
 class Geometry(object):
-    """This class encapsulates the geometry functionality"""
+    """This class encapsulates the geometry functionality
+
+    Transformations applied by :py:meth:`translate`, :py:meth:`scale`,
+    :py:meth:`rotate` and :py:meth:`recentre` are not applied to the geometry
+    straight away. Instead they are composed into a single pending 4x4 affine
+    transformation which is applied to the loaded geometry in one pass the
+    next time :py:attr:`geom` is used. Assigning to :py:attr:`geom` replaces
+    the loaded geometry and clears the pending transformation.
+
+    """
 
     # pylint: disable-all
-    def __init__(self, geomType, path, name, case):
+    def __init__(self, geomType, path, name, case, geom=None):
         """Initialises settings and loads the geometry into memory
 
         Args:
@@ -73,25 +166,179 @@ class Geometry(object):
             path: path to the geometry file
             name: The name of the geometry (NOT the filename)
             case (firefish.case.Case): The case to place the geometry in
+            geom: the already loaded geometry. If None, it is loaded from path.
         """
         self.geomType = geomType
         self.geomPath = path
         self.saved = False    #Flag to check whether this has been written or not
         self.case = case
         self.name = name
+        self.surfaceName = None    #Set if written as a region of a shared surface
+        self.loadTimings = collections.OrderedDict()    #Seconds taken by each loading stage
+
+        self._source = None
+        self._transform = np.eye(4)
+        self._version = 0
+        self._transformed = (None, None)    # (version, transformed mesh)
+        self._sourceBounds = None
+        self._bounds = (None, None)         # (version, (min, max))
+        self._indexed = (None, None, None)  # (version, tolerance, IndexedMesh)
 
         if geomType == GeometryFormat.STL:
             self.filename = '{}.stl'.format(self.name)
-            self.geom = stl_load(path)
+            self.geom = stl_load(path) if geom is None else geom
 
         self.meshSettings = MeshQualitySettings() # we create a default set of mesh quality settings
 
-    def save(self, path):
-        """copies the stl from source directory into path
+    @property
+    def geom(self):
+        """The geometry with any pending transformation applied"""
+        if self._source is None or np.all(self._transform == np.eye(4)):
+            return self._source
+        version, transformed = self._transformed
+        if version != self._version:
+            transformed = stl_transform(self._source, self._transform)
+            self._transformed = (self._version, transformed)
+        return transformed
+
+    @geom.setter
+    def geom(self, geom):
+        self._source = geom
+        self._transform = np.eye(4)
+        self._sourceBounds = None
+        self._changed()
+
+    @property
+    def transform(self):
+        """A copy of the pending 4x4 affine transformation matrix"""
+        return self._transform.copy()
+
+    def save(self, path, ascii=False):
+        """Writes the transformed geometry to path as an STL file
+
+            Args:
+                path: the path to write the stl file to
+                ascii: write an ASCII rather than a binary STL file
+        """
+        stl_save(self.geom, path, ascii=ascii, name=self.name)
+
+    def bounds(self):
+        """Computes the bounding box of the transformed geometry
+
+            The bounds are cached until the geometry next changes. While the
+            pending transformation only translates and scales along the axes
+            they are found from the bounds of the loaded geometry without
+            applying it.
+
+            Returns:
+                A pair of arrays giving the minimum and maximum X, Y and Z
+                co-ordinates.
+        """
+        version, bounds = self._bounds
+        if version == self._version:
+            return bounds
+
+        linear = self._transform[:3, :3]
+        if np.all(linear == np.diag(np.diag(linear))):
+            if self._sourceBounds is None:
+                self._sourceBounds = tuple(
+                    np.asarray(b, dtype=np.float64)
+                    for b in stl_bounds(self._source))
+            corners = [np.diag(linear) * b + self._transform[:3, 3]
+                       for b in self._sourceBounds]
+            bounds = np.minimum(*corners), np.maximum(*corners)
+        else:
+            bounds = tuple(np.asarray(b, dtype=np.float64)
+                           for b in stl_bounds(self.geom))
+        self._bounds = (self._version, bounds)
+        return bounds
+
+    def indexed(self, tolerance=0):
+        """Returns the transformed geometry as an :py:class:`IndexedMesh`
+
+            The result of :py:func:`stl_weld` is cached until the geometry
+            next changes so that repeated topological queries share one weld.
+
+            Args:
+                tolerance: distance within which vertices are merged
+        """
+        version, cached_tolerance, indexed = self._indexed
+        if version != self._version or cached_tolerance != tolerance:
+            indexed = stl_weld(self.geom, tolerance)
+            self._indexed = (self._version, tolerance, indexed)
+        return indexed
+
+    def check(self, tolerance=0):
+        """Checks that the geometry is a closed manifold surface
+
+            See :py:func:`stl_check`. The edges reported index the vertices
+            of :py:meth:`indexed` with the same tolerance.
+
+            Args:
+                tolerance: distance within which vertices are merged
+
+            Returns:
+                A :py:class:`SurfaceCheck`.
+        """
+        return stl_check(self.indexed(tolerance))
+
+    def mass_properties(self, density=1.0):
+        """Computes the mass properties of the solid enclosed by the geometry
+
+            See :py:func:`stl_mass_properties`.
+
+            Args:
+                density: density of the solid
+
+            Returns:
+                A :py:class:`MassProperties`.
+        """
+        return stl_mass_properties(self.geom, density)
+
+    def reference_values(self, axis=(1, 0, 0), resolution=1024):
+        """Computes reference values for force coefficients
+
+            See :py:func:`reference_values`.
+
+            Args:
+                axis: flight axis
+                resolution: pixels across the raster of the frontal area
 
-            Args: path: the path to copy the stl file into
+            Returns:
+                A :py:class:`ReferenceValues`.
         """
-        call (["cp", self.geomPath, path]) 
+        return reference_values([self], axis, resolution)
+
+    def decimate(self, target_faces=None, tolerance=None):
+        """Creates a copy of the geometry with fewer faces
+
+            See :py:func:`stl_decimate`. This geometry is not changed.
+
+            Args:
+                target_faces: number of faces to stop at
+                tolerance: greatest quadric error of a collapse
+
+            Returns:
+                A tuple of the new :py:class:`Geometry` and the deviation of
+                its surface from this one's.
+        """
+        decimated, deviation = stl_decimate(self.geom, target_faces, tolerance)
+        geometry = Geometry(self.geomType, self.geomPath, self.name,
+                            self.case, geom=decimated)
+        geometry.surfaceName = self.surfaceName
+        return geometry, deviation
+
+    def apply_transform(self, matrix):
+        """Composes a 4x4 affine transformation with the pending one
+
+            Args:
+                matrix: 4x4 matrix acting on homogeneous co-ordinates
+        """
+        matrix = np.asarray(matrix, dtype=np.float64)
+        if matrix.shape != (4, 4):
+            raise ValueError('Transformation must be a 4x4 matrix')
+        self._transform = matrix.dot(self._transform)
+        self._changed()
 
     def translate(self, delta):
         """Translates geometry by delta
@@ -99,89 +346,1132 @@ class Geometry(object):
             Args:
                 delta: The vector to translate the geometry by
         """
-        if self.geomType == GeometryFormat.STL:
-            self.geom = stl_translate(self.geom, delta)
+        matrix = np.eye(4)
+        matrix[:3, 3] = delta
+        self.apply_transform(matrix)
 
     def recentre(self):
         """Recentres the geometry"""
-
-        if self.geomType == GeometryFormat.STL:
-            self.geom = stl_recentre(self.geom)
+        min_, max_ = self.bounds()
+        self.translate(-0.5 * (min_ + max_))
         
     def scale(self, factor):
         """Scales geometry by factor
 
             Args:
-                factor: The factor to scale the gometry by
+                factor: The factor to scale the gometry by. A 3-vector scales
+                    each axis separately.
+        """
+        factor = np.ones(3) * factor
+        self.apply_transform(np.diag(np.append(factor, 1)))
+
+    def rotate(self, axis, theta, point=None):
+        """Rotates geometry about an axis
+
+            The rotation is anticlockwise when looking back along the axis.
+
+            Args:
+                axis: 3-vector giving the direction of the axis of rotation
+                theta: angle of rotation in radians
+                point: a point on the axis of rotation. Defaults to the origin.
         """
-        if self.geomType == GeometryFormat.STL:
-            self.geom = stl_scale(self.geom, factor)
+        axis = np.asarray(axis, dtype=np.float64)
+        axis = axis / np.linalg.norm(axis)
+        cross = np.array([[0, -axis[2], axis[1]],
+                          [axis[2], 0, -axis[0]],
+                          [-axis[1], axis[0], 0]])
+        rotation = np.eye(3) + np.sin(theta) * cross + \
+            (1 - np.cos(theta)) * cross.dot(cross)
+
+        matrix = np.eye(4)
+        matrix[:3, :3] = rotation
+        if point is not None:
+            point = np.asarray(point, dtype=np.float64)
+            matrix[:3, 3] = point - rotation.dot(point)
+        self.apply_transform(matrix)
+
+    def _changed(self):
+        """Invalidates everything derived from the transformed geometry"""
+        self._version += 1
+
+    def extract_features(self, included_angle=180, use_openfoam=False):
+        """Extracts surface features from geometry and writes them to an eMesh file
+
+            The features are extracted in-process by
+            :py:func:`stl_feature_edges` and written to
+            ``constant/triSurface/<name>.eMesh``. A surfaceFeatureExtractDict
+            recording the settings is also written so that the features may
+            be re-extracted with OpenFOAM.
 
-    def extract_features(self):
-        """Extracts surface features from geometry using the surfaceFeatureExtract tool"""
+            Args:
+                included_angle: edges where the surface turns by more than
+                    180 - included_angle degrees are features
+                use_openfoam: run the surfaceFeatureExtract tool instead
+        """
         #This is used by mesh generation but could be used elsewhere so is kept in this class
         if not self.saved:
             self.case.add_tri_surface(self.name, self.geom)
+            self.saved = True
 
         surface_extract_dict = {
             '{}.stl'.format(self.name) : {'extractionMethod' : 'extractFromSurface',
-                                          'extractFromSurfaceCoeffs' : {'includedAngle' : 180,
+                                          'extractFromSurfaceCoeffs' : {'includedAngle' : included_angle,
                                                                         'geometricTestOnly' : True},
                                           'writeObj' : 'yes'}
         }
 
         with self.case.mutable_data_file(FileName.SURFACE_FEATURE_EXTRACT) as d:
             d.update(surface_extract_dict)
-        self.case.run_tool('surfaceFeatureExtract')
+        if use_openfoam:
+            self.case.run_tool('surfaceFeatureExtract')
+        else:
+            self.write_features(included_angle)
+
+    def write_features(self, included_angle=180):
+        """Writes the geometry's feature edges to ``constant/triSurface/<name>.eMesh``
 
-def load_multiple_geometries(geomType, paths, names, case):
+            Args:
+                included_angle: edges where the surface turns by more than
+                    180 - included_angle degrees are features
+        """
+        points, edges = stl_feature_edges(self.indexed(), included_angle)
+        write_feature_edge_mesh(
+            os.path.join(self.case.root_dir_path, 'constant', 'triSurface',
+                         '{}.eMesh'.format(self.name)),
+            points, edges
+        )
+
+def load_multiple_geometries(geomType, paths, names, case, use_openfoam=False,
+                             surface_name=None, processes=None,
+                             parse_processes=None):
     """Loads multiple geometries of the same type and returns as a list
+
+    Each geometry is written to the case and its features are extracted.
+    Feature extraction runs in-process unless *use_openfoam* is True in which
+    case surfaceFeatureExtract is run once over all geometries.
+
+    The geometries are loaded, written and have their features extracted
+    concurrently by a pool of threads. Parsing ASCII STL files is mostly
+    Python work which threads cannot share, so if *parse_processes* is given
+    ASCII files are instead parsed by a pool of that many processes first.
+    Whatever the order in which the geometries finish, they are returned in
+    the order given.
+
+    The seconds spent in each stage ('load', 'write' and 'features') are
+    recorded in each geometry's *loadTimings*. When geometries are written as
+    one surface, writing and feature extraction are not timed per geometry.
+
+    If *surface_name* is given, the geometries are instead written as regions
+    of a single surface by :py:func:`write_multi_region_surface`.
     
     Args:
         geomType (firefish.geometry.GeometryFormat): indicates what type these geometries are
         paths: list of paths to each geometry file eg. stls/foo.stl
         names: the list of names of each geometry e.g. body, fin etc.
         case (firefish.case.Case): the case to place each geometry in
+        use_openfoam: extract features with the surfaceFeatureExtract tool
+        surface_name: name of a single surface to write all geometries to
+        processes: number of threads to use. If None, one per geometry.
+        parse_processes: number of processes to parse ASCII STL files with.
+            If None, they are parsed by the threads.
 
     """
-    geometries = []
+    preloaded = [None] * len(paths)
+    if parse_processes and geomType == GeometryFormat.STL:
+        ascii_idxs = [i for i, path in enumerate(paths)
+                      if _binary_triangle_count(path) is None]
+        if len(ascii_idxs) > 0:
+            pool = multiprocessing.Pool(parse_processes)
+            try:
+                loaded = pool.map(_parse_stl, [paths[i] for i in ascii_idxs])
+            finally:
+                pool.close()
+                pool.join()
+            for i, (data, name, seconds) in zip(ascii_idxs, loaded):
+                preloaded[i] = (mesh.Mesh(data, calculate_normals=False,
+                                          name=name), seconds)
+
+    write_parts = surface_name is None
+    if write_parts:
+        surface_dir = os.path.join(case.root_dir_path, 'constant',
+                                   'triSurface')
+        if not os.path.isdir(surface_dir):
+            os.makedirs(surface_dir)
+
+    def load(i):
+        start = time.time()
+        if preloaded[i] is None:
+            g = Geometry(geomType, paths[i], names[i], case)
+            g.loadTimings['load'] = time.time() - start
+        else:
+            g = Geometry(geomType, paths[i], names[i], case,
+                         geom=preloaded[i][0])
+            g.loadTimings['load'] = preloaded[i][1]
+        if not write_parts:
+            return g
+
+        start = time.time()
+        case.add_tri_surface(g.name, g)
+        g.saved = True
+        g.loadTimings['write'] = time.time() - start
+        if not use_openfoam:
+            start = time.time()
+            g.write_features(180)
+            g.loadTimings['features'] = time.time() - start
+        return g
+
+    pool = ThreadPool(processes or len(names))
+    try:
+        geometries = pool.map(load, range(len(names)))
+    finally:
+        pool.close()
+        pool.join()
+
+    if not write_parts:
+        write_multi_region_surface(case, surface_name, geometries,
+                                   use_openfoam=use_openfoam)
+        return geometries
+
     surface_extract_dict = {}
     for i in range(len(names)):
-        geometries.append(Geometry(geomType,paths[i],names[i],case))
-        geometries[0].case.add_tri_surface(names[i], geometries[i])
         file_dict = {
             '{}.stl'.format(names[i]) : {'extractionMethod' : 'extractFromSurface',
                                       'extractFromSurfaceCoeffs' : {'includedAngle' : 180},
                                       'writeObj' : 'yes'}
         }
         surface_extract_dict.update(file_dict)
-    with geometries[0].case.mutable_data_file(FileName.SURFACE_FEATURE_EXTRACT) as d:
+    with case.mutable_data_file(FileName.SURFACE_FEATURE_EXTRACT) as d:
         d.update(surface_extract_dict)
-    geometries[0].case.run_tool('surfaceFeatureExtract')
+    if use_openfoam:
+        case.run_tool('surfaceFeatureExtract')
 
     return geometries
 
+def _parse_stl(path):
+    """Load an STL file in a worker process.
+
+    Returns:
+        A tuple (data, name, seconds) of the loaded mesh's data and name and
+        the time taken to load it.
+
+    """
+    start = time.time()
+    geom = stl_load(path)
+    return np.array(geom.data), geom.name, time.time() - start
+
+def write_multi_region_surface(case, name, geometries, included_angle=180,
+                               use_openfoam=False):
+    """Writes several geometries to the case as regions of one surface
+
+    The geometries are written as named solids of a single
+    ``constant/triSurface/<name>.stl`` file and the features of the whole
+    surface are written to ``<name>.eMesh``. Each geometry's *surfaceName* is
+    set to *name* so that :py:class:`firefish.meshsnappy.SnappyHexMesh`
+    declares one surface with a region, and so a patch, per geometry.
+
+    Compared to writing each geometry separately this means one file to
+    write, one surfaceFeatureExtract entry and one surface for OpenFOAM to
+    load and search.
+
+    Args:
+        case (firefish.case.Case): the case to write the surface to
+        name: name of the surface
+        geometries: list of :py:class:`Geometry` to write as regions
+        included_angle: edges where the surface turns by more than
+            180 - included_angle degrees are features
+        use_openfoam: extract features with the surfaceFeatureExtract tool
+
+    """
+    surface_dir = os.path.join(case.root_dir_path, 'constant', 'triSurface')
+    if not os.path.isdir(surface_dir):
+        os.makedirs(surface_dir)
+    regions = [(g.name, g.geom) for g in geometries]
+    stl_save_regions(os.path.join(surface_dir, '{}.stl'.format(name)),
+                     regions)
+    for g in geometries:
+        g.surfaceName = name
+        g.saved = True
+
+    with case.mutable_data_file(FileName.SURFACE_FEATURE_EXTRACT) as d:
+        d['{}.stl'.format(name)] = {
+            'extractionMethod' : 'extractFromSurface',
+            'extractFromSurfaceCoeffs' : {'includedAngle' : included_angle,
+                                          'geometricTestOnly' : True},
+            'writeObj' : 'yes'}
+    if use_openfoam:
+        case.run_tool('surfaceFeatureExtract')
+    else:
+        points, edges = stl_feature_edges(
+            stl_concatenate([g for _, g in regions]), included_angle)
+        write_feature_edge_mesh(
+            os.path.join(surface_dir, '{}.eMesh'.format(name)), points, edges)
+
+def _face_vectors(geom):
+    """The (F, 3, 3) vertices of each face of a :py:class:`stl.mesh.Mesh` or
+    :py:class:`IndexedMesh`."""
+    if isinstance(geom, IndexedMesh):
+        return geom.vertices[geom.faces]
+    return geom.vectors
+
+def _unit_normals(geom):
+    """Unit face normals computed from the vertices. Degenerate faces have a
+    zero normal."""
+    vectors = _face_vectors(geom)
+    v0, v1, v2 = vectors[:, 0], vectors[:, 1], vectors[:, 2]
+    normals = np.cross(v1 - v0, v2 - v0).astype(np.float64)
+    lengths = np.linalg.norm(normals, axis=1)
+    lengths[lengths == 0] = np.inf
+    return normals / lengths[:, np.newaxis]
+
+def _edge_faces(geom):
+    """Group the edges of each face by the pair of vertices they join.
+
+    A :py:class:`stl.mesh.Mesh` is first welded with :py:func:`stl_weld` so
+    that vertices with identical co-ordinates are treated as one vertex.
+
+    Returns:
+        A tuple (vertices, edges, edge_faces, starts, counts). *vertices* is
+        the (V, 3) array of distinct vertices and *edges* the (E, 2) array of
+        distinct edges as sorted vertex indices. The faces using edge *i* are
+        ``edge_faces[starts[i]:starts[i] + counts[i]]``.
+
+    """
+    if not isinstance(geom, IndexedMesh):
+        geom = stl_weld(geom)
+    vertices, vertex_ids = geom
+
+    face_edges = np.sort(vertex_ids[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2),
+                         axis=1)
+    faces = np.repeat(np.arange(len(vertex_ids)), 3)
+    order = np.lexsort((face_edges[:, 1], face_edges[:, 0]))
+    face_edges, faces = face_edges[order], faces[order]
+
+    new_edge = np.ones(len(face_edges), dtype=bool)
+    new_edge[1:] = np.any(face_edges[1:] != face_edges[:-1], axis=1)
+    starts = np.flatnonzero(new_edge)
+    counts = np.diff(np.append(starts, len(face_edges)))
+    return vertices, face_edges[starts], faces, starts, counts
+
+def _adjacent_faces(geom):
+    """Find the pairs of faces which share a manifold edge.
+
+    Returns:
+        A pair of 1-d arrays giving the indices of the faces in each pair.
+
+    """
+    _, _, edge_faces, starts, counts = _edge_faces(geom)
+    starts = starts[counts == 2]
+    return edge_faces[starts], edge_faces[starts + 1]
+
+def _cell_keys(cells):
+    """View an (N, 3) array of integer cell co-ordinates as a 1-d array which
+    sorts and searches lexicographically."""
+    return np.ascontiguousarray(cells, dtype=np.int64).view(_CELL_DTYPE).ravel()
+
+def _weld_clusters(points, tolerance, pair_budget=2**20):
+    """Label each point with a cluster such that points within *tolerance*
+    of each other share a cluster.
+
+    Points are binned into cubic cells of side *tolerance*. Points in one
+    cell form a cluster and neighbouring cells are joined if any point in one
+    is within *tolerance* of any point in the other. Joining is transitive.
+    The point pairs of neighbouring cells are compared in batches of at most
+    about *pair_budget* pairs.
+
+    """
+    # Only distinct points need comparing. STL files repeat each vertex for
+    # every face which shares it.
+    points, point_ids = np.unique(points, axis=0, return_inverse=True)
+    cells, cell_ids = np.unique(np.floor(points / tolerance).astype(np.int64),
+                                axis=0, return_inverse=True)
+    cell_ids = cell_ids.ravel()
+    order = np.argsort(cell_ids, kind='stable')
+    sorted_points = points[order]
+    counts = np.bincount(cell_ids, minlength=len(cells))
+    starts = np.cumsum(counts) - counts
+
+    keys = _cell_keys(cells)
+    pairs = []
+    for offset in _HALF_NEIGHBOURS:
+        idx = np.searchsorted(keys, _cell_keys(cells + offset))
+        idx = np.minimum(idx, len(cells) - 1)
+        src = np.flatnonzero(keys[idx] == _cell_keys(cells + offset))
+        dst = idx[src]
+
+        # Enumerate every pair of points of each pair of cells.
+        n_pairs = counts[src] * counts[dst]
+        ends = np.cumsum(n_pairs)
+        lo = 0
+        while lo < len(src):
+            hi = max(lo + 1, np.searchsorted(ends, ends[lo] - n_pairs[lo] +
+                                             pair_budget, side='right'))
+            batch = np.repeat(np.arange(lo, hi), n_pairs[lo:hi])
+            k = np.arange(len(batch)) - np.repeat(
+                ends[lo:hi] - n_pairs[lo:hi] - (ends[lo] - n_pairs[lo]),
+                n_pairs[lo:hi])
+            i = starts[src[batch]] + k // counts[dst[batch]]
+            j = starts[dst[batch]] + k % counts[dst[batch]]
+            close = np.linalg.norm(sorted_points[i] - sorted_points[j],
+                                   axis=1) <= tolerance
+            joined = np.unique(batch[close])
+            pairs.append((src[joined], dst[joined]))
+            lo = hi
+    src = np.concatenate([p[0] for p in pairs] + [np.zeros(0, np.int64)])
+    dst = np.concatenate([p[1] for p in pairs] + [np.zeros(0, np.int64)])
+
+    return _connected_labels(len(cells), src, dst)[cell_ids][point_ids.ravel()]
+
+def _connected_labels(n, src, dst):
+    """Label *n* nodes joined by the pairs (src[i], dst[i]) with the smallest
+    node of their connected component."""
+    # Propagate the smallest label across joined nodes until it settles.
+    labels = np.arange(n)
+    while len(src) > 0:
+        joined = np.minimum(labels[src], labels[dst])
+        if np.all(labels[src] == joined) and np.all(labels[dst] == joined):
+            break
+        np.minimum.at(labels, src, joined)
+        np.minimum.at(labels, dst, joined)
+        labels = labels[labels]
+    return labels
+
+def stl_weld(geom, tolerance=0):
+    """Convert a geometry to an :py:class:`IndexedMesh`.
+
+    Triangle vertices are merged into shared vertices. With the default
+    *tolerance* of zero only vertices with identical co-ordinates are merged.
+    Otherwise vertices within *tolerance* of each other are merged as
+    described below, as are vertices which are chains of such vertices
+    apart. Each merged vertex takes the co-ordinates of one of the vertices
+    merged into it.
+
+    Vertices are binned into cubic cells of side *tolerance* and all vertices
+    in a cell are merged, so vertices up to sqrt(3) times *tolerance* apart
+    may be merged. All the vertices in two neighbouring cells are merged if
+    any vertex of one is within *tolerance* of any vertex of the other.
+
+    Faces are never removed, even if welding makes them degenerate.
+
+    Args:
+        geom (stl.mesh.Mesh): STL geometry
+        tolerance (float): distance within which vertices are merged
+
+    Returns:
+        An :py:class:`IndexedMesh`.
+
+    """
+    points = np.asarray(geom.vectors, dtype=np.float64).reshape(-1, 3)
+    if len(points) == 0:
+        return IndexedMesh(np.zeros((0, 3)), np.zeros((0, 3), dtype=np.int32))
+
+    if tolerance > 0:
+        labels = _weld_clusters(points, tolerance)
+    else:
+        _, labels = np.unique(points, axis=0, return_inverse=True)
+        labels = labels.ravel()
+
+    used, vertex_ids = np.unique(labels, return_inverse=True)
+    order = np.argsort(vertex_ids, kind='stable')
+    first = order[np.searchsorted(vertex_ids[order], np.arange(len(used)))]
+    return IndexedMesh(points[first],
+                       vertex_ids.reshape(-1, 3).astype(np.int32))
+
+def stl_check(geom, tolerance=0):
+    """Check that a surface is closed, manifold and consistently wound.
+
+    Surfaces which fail these checks make snappyHexMesh leak or produce
+    a poor mesh. Edges are found by sorting the three edges of every face so
+    that the whole surface is checked in a few vectorised passes.
+
+    An edge is open if it is used by one face and non-manifold if it is used
+    by more than two faces. An edge used by two faces is inconsistently wound
+    if both faces traverse it in the same direction, i.e. the faces' normals
+    point to opposite sides of the surface. A face is degenerate if two of its
+    vertices are the same vertex or if its area is negligible compared to the
+    square of its longest edge. The edges of faces with repeated vertices are
+    ignored.
+
+    Args:
+        geom (stl.mesh.Mesh or IndexedMesh): STL geometry. A
+            :py:class:`stl.mesh.Mesh` is welded by :py:func:`stl_weld`.
+        tolerance (float): tolerance for welding a :py:class:`stl.mesh.Mesh`
+
+    Returns:
+        A :py:class:`SurfaceCheck`.
+
+    """
+    if not isinstance(geom, IndexedMesh):
+        geom = stl_weld(geom, tolerance)
+    faces = geom.faces
+
+    collapsed = ((faces[:, 0] == faces[:, 1]) | (faces[:, 1] == faces[:, 2]) |
+                 (faces[:, 2] == faces[:, 0]))
+    vectors = _face_vectors(geom)
+    edge_vectors = vectors[:, [1, 2, 0]] - vectors
+    longest = np.max(np.einsum('ijk,ijk->ij', edge_vectors, edge_vectors),
+                     axis=1)
+    cross = np.linalg.norm(np.cross(edge_vectors[:, 0], edge_vectors[:, 1]),
+                           axis=1)
+    degenerate = collapsed | (cross <= 1e-12 * longest)
+
+    directed = faces[~collapsed][:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2)
+    forward = directed[:, 0] < directed[:, 1]
+    edges = np.sort(directed, axis=1)
+    order = np.lexsort((edges[:, 1], edges[:, 0]))
+    edges, forward = edges[order], forward[order]
+
+    new_edge = np.ones(len(edges), dtype=bool)
+    new_edge[1:] = np.any(edges[1:] != edges[:-1], axis=1)
+    starts = np.flatnonzero(new_edge)
+    counts = np.diff(np.append(starts, len(edges)))
+
+    manifold = starts[counts == 2]
+    inconsistent = manifold[forward[manifold] == forward[manifold + 1]]
+    return SurfaceCheck(
+        open_edges=edges[starts[counts == 1]],
+        non_manifold_edges=edges[starts[counts > 2]],
+        inconsistent_edges=edges[inconsistent],
+        degenerate_faces=np.flatnonzero(degenerate),
+    )
+
+def _volume_integrals(geoms):
+    """Integrate 1, x and x x^T over the solids bounded by several surfaces.
+
+    Each triangle and the origin form a tetrahedron whose integrals are known
+    in closed form. Summing them with the sign of the tetrahedron's volume
+    gives the integrals over the enclosed solid. All triangles of all
+    geometries are processed together and the sums for each geometry are
+    separated at the end.
+
+    Returns:
+        A triple of arrays giving, for each geometry, the volume (N,), the
+        first moment (N, 3) and the second moment (N, 3, 3).
+
+    """
+    counts = [len(g.vectors) for g in geoms]
+    vectors = np.concatenate([np.asarray(g.vectors, dtype=np.float64)
+                              for g in geoms])
+    a, b, c = vectors[:, 0], vectors[:, 1], vectors[:, 2]
+    det = np.einsum('ij,ij->i', a, np.cross(b, c))
+    total = a + b + c
+
+    per_face = np.empty((len(vectors), 13))
+    per_face[:, 0] = det / 6.0
+    per_face[:, 1:4] = (det / 24.0)[:, np.newaxis] * total
+    second = (np.einsum('fi,fj->fij', a, a) + np.einsum('fi,fj->fij', b, b) +
+              np.einsum('fi,fj->fij', c, c) +
+              np.einsum('fi,fj->fij', total, total))
+    per_face[:, 4:] = (det / 120.0)[:, np.newaxis] * second.reshape(-1, 9)
+
+    ends = np.cumsum(counts)
+    sums = np.array([per_face[end - count:end].sum(axis=0)
+                     for end, count in zip(ends, counts)]).reshape(-1, 13)
+    return sums[:, 0], sums[:, 1:4], sums[:, 4:].reshape(-1, 3, 3)
+
+def _mass_properties(mass, first, second):
+    """Mass properties from the mass and density-weighted first and second
+    moments about the origin."""
+    centre = first / mass if mass != 0 else np.zeros(3)
+    inertia = np.trace(second) * np.eye(3) - second
+    inertia -= mass * (centre.dot(centre) * np.eye(3) - np.outer(centre, centre))
+    return centre, inertia
+
+def mass_properties(geoms, densities=1.0):
+    """Compute the combined mass properties of several solids.
+
+    The integrals for every part are computed in a single vectorised pass
+    over all triangles. See :py:func:`stl_mass_properties` for the
+    requirements on each surface.
+
+    Args:
+        geoms: list of :py:class:`stl.mesh.Mesh` or :py:class:`Geometry`, e.g.
+            as returned by :py:func:`load_multiple_geometries`
+        densities: density of each part or a single density for all parts
+
+    Returns:
+        A pair giving the :py:class:`MassProperties` of the whole assembly and
+        a list of those of each part.
+
+    """
+    geoms = [g.geom if isinstance(g, Geometry) else g for g in geoms]
+    densities = np.ones(len(geoms)) * densities
+    volumes, firsts, seconds = _volume_integrals(geoms)
+
+    # Surfaces wound inside out enclose negative volume.
+    signs = np.where(volumes < 0, -1.0, 1.0)
+    volumes, firsts, seconds = (
+        volumes * signs, firsts * signs[:, np.newaxis],
+        seconds * signs[:, np.newaxis, np.newaxis])
+
+    masses = densities * volumes
+    firsts = firsts * densities[:, np.newaxis]
+    seconds = seconds * densities[:, np.newaxis, np.newaxis]
+
+    parts = []
+    for mass, volume, first, second in zip(masses, volumes, firsts, seconds):
+        centre, inertia = _mass_properties(mass, first, second)
+        parts.append(MassProperties(mass, volume, centre, inertia))
+    centre, inertia = _mass_properties(masses.sum(), firsts.sum(axis=0),
+                                       seconds.sum(axis=0))
+    total = MassProperties(masses.sum(), volumes.sum(), centre, inertia)
+    return total, parts
+
+def stl_mass_properties(geom, density=1.0):
+    """Compute the mass properties of the solid enclosed by a surface.
+
+    The surface must be closed (see :py:func:`stl_check`) for the results to
+    be meaningful. Surfaces whose normals point inwards are handled by
+    reversing the sign of the enclosed volume.
+
+    Args:
+        geom (stl.mesh.Mesh): STL geometry
+        density (float): density of the solid
+
+    Returns:
+        A :py:class:`MassProperties`.
+
+    """
+    return mass_properties([geom], density)[1][0]
+
+def stl_from_indexed(indexed, name=''):
+    """Convert an :py:class:`IndexedMesh` to a geometry.
+
+    Normals are calculated from the vertices.
+
+    Args:
+        indexed (IndexedMesh): indexed triangle mesh
+        name (str): name of the geometry
+
+    Returns:
+        A new :py:class:`stl.mesh.Mesh`.
+
+    """
+    data = np.zeros(len(indexed.faces), dtype=mesh.Mesh.dtype)
+    data['vectors'] = indexed.vertices[indexed.faces]
+    data['normals'] = _unit_normals(indexed)
+    return mesh.Mesh(data, calculate_normals=False, name=name)
+
+def _plane_quadrics(vertices, faces):
+    """The (F, 4, 4) quadric of the plane of each face.
+
+    The quadric *K* of the plane with unit normal *n* through point *p*
+    gives the squared distance of a point *x* from the plane as
+    ``[x, 1] K [x, 1]``. Degenerate faces have a zero quadric.
+
+    """
+    planes = np.zeros((len(faces), 4))
+    planes[:, :3] = _unit_normals(IndexedMesh(vertices, faces))
+    planes[:, 3] = -np.einsum('ij,ij->i', planes[:, :3], vertices[faces[:, 0]])
+    return planes[:, :, np.newaxis] * planes[:, np.newaxis, :]
+
+def _collapse_targets(quadrics, vertices, edges):
+    """The position minimising the summed quadric error of each edge's
+    vertices and that error.
+
+    The optimal position is used where it is well defined and near the
+    edge. Otherwise the best of the end points and mid-point is used.
+
+    """
+    q = quadrics[edges[:, 0]] + quadrics[edges[:, 1]]
+    a, b = vertices[edges[:, 0]], vertices[edges[:, 1]]
+    candidates = [a, b, 0.5 * (a + b)]
+
+    matrix = q[:, :3, :3]
+    scale = np.trace(matrix, axis1=1, axis2=2) / 3
+    solvable = np.abs(np.linalg.det(matrix)) > 1e-6 * scale ** 3
+    identity = np.broadcast_to(np.eye(3), matrix.shape)
+    optimal = -np.linalg.solve(np.where(solvable[:, np.newaxis, np.newaxis],
+                                        matrix, identity),
+                               q[:, :3, 3:])[..., 0]
+    near = np.linalg.norm(optimal - candidates[2], axis=1) <= \
+        np.linalg.norm(b - a, axis=1)
+    candidates.append(np.where((solvable & near)[:, np.newaxis],
+                               optimal, candidates[2]))
+
+    costs = []
+    for x in candidates:
+        h = np.concatenate([x, np.ones((len(x), 1))], axis=1)
+        costs.append(np.einsum('ni,nij,nj->n', h, q, h))
+    best = np.argmin(costs, axis=0)
+    rows = np.arange(len(edges))
+    position = np.stack(candidates, axis=1)[rows, best]
+    return position, np.maximum(np.stack(costs, axis=1)[rows, best], 0)
+
+def _collapse_allowed(vertices, faces, edges, candidates, positions):
+    """Whether collapsing each candidate edge to the corresponding position
+    keeps the surface manifold and does not fold it over.
+
+    *edges* are all the edges of the surface, sorted as returned by
+    :py:func:`_edge_faces`, and *candidates* indexes those to test. A
+    collapse must satisfy the link condition: the vertices of the edge must
+    share exactly two neighbours, those of the two faces which are removed.
+    Each remaining face around the edge must not turn through more than 60
+    degrees or become degenerate.
+
+    """
+    n_vertices = len(vertices)
+    keys = edges[:, 0] * n_vertices + edges[:, 1]
+
+    # Neighbours of each vertex over the whole surface, and faces of each
+    # vertex, in compressed sparse row form.
+    both = np.concatenate([edges, edges[:, ::-1]])
+    both = both[np.argsort(both[:, 0], kind='stable')]
+    neighbour_starts = np.searchsorted(both[:, 0], np.arange(n_vertices + 1))
+    corners = np.argsort(faces.ravel(), kind='stable')
+    face_starts = np.searchsorted(faces.ravel()[corners],
+                                  np.arange(n_vertices + 1))
+
+    edges = edges[candidates]
+    allowed = np.ones(len(edges), dtype=bool)
+
+    def expand(starts, vertex):
+        """Index each edge alongside each entry of a vertex's row."""
+        counts = starts[vertex + 1] - starts[vertex]
+        edge_ids = np.repeat(np.arange(len(edges)), counts)
+        offsets = np.arange(len(edge_ids)) - np.repeat(
+            np.cumsum(counts) - counts, counts)
+        return edge_ids, starts[vertex][edge_ids] + offsets
+
+    edge_ids, entries = expand(neighbour_starts, edges[:, 0])
+    shared = both[entries, 1]
+    other = edges[edge_ids, 1]
+    pair_keys = np.minimum(shared, other) * n_vertices + \
+        np.maximum(shared, other)
+    found = np.searchsorted(keys, pair_keys)
+    found = (found < len(keys)) & \
+        (keys[np.minimum(found, len(keys) - 1)] == pair_keys)
+    allowed &= np.bincount(edge_ids, found, len(edges)) == 2
+
+    old_normals = np.cross(
+        vertices[faces[:, 1]] - vertices[faces[:, 0]],
+        vertices[faces[:, 2]] - vertices[faces[:, 0]])
+    for side in (0, 1):
+        edge_ids, entries = expand(face_starts, edges[:, side])
+        face_ids, corner = np.divmod(corners[entries], 3)
+        triangles = vertices[faces[face_ids]]
+        triangles[np.arange(len(face_ids)), corner] = positions[edge_ids]
+        new_normals = np.cross(triangles[:, 1] - triangles[:, 0],
+                               triangles[:, 2] - triangles[:, 0])
+        removed = np.any(faces[face_ids] == edges[edge_ids, 1 - side,
+                                                  np.newaxis], axis=1)
+        old = old_normals[face_ids]
+        old_sq = np.einsum('ij,ij->i', old, old)
+        new_sq = np.einsum('ij,ij->i', new_normals, new_normals)
+        dot = np.einsum('ij,ij->i', old, new_normals)
+        folded = (dot <= 0.5 * np.sqrt(old_sq * new_sq)) | \
+            (new_sq <= 1e-12 * old_sq)
+        allowed &= np.bincount(edge_ids, folded & ~removed, len(edges)) == 0
+    return allowed
+
+def stl_decimate(geom, target_faces=None, tolerance=None):
+    """Reduce the number of faces of a closed surface by collapsing edges.
+
+    Edges are collapsed in order of the quadric error metric of Garland and
+    Heckbert, "Surface Simplification Using Quadric Error Metrics", 1997.
+    Each vertex accumulates the planes of the original faces merged into it
+    and collapsing an edge moves the merged vertex to the position which
+    minimises the sum of squared distances to those planes.
+
+    Rather than one collapse at a time, each pass collapses every edge whose
+    error is lower than that of any other edge touching its vertices or
+    their neighbours. These collapses change disjoint sets of faces so are
+    made together in a few vectorised operations. Collapses which would make
+    the surface non-manifold or fold it over are skipped. Edges on open or
+    non-manifold parts of the surface are never collapsed.
+
+    Decimation stops when the surface has *target_faces* faces or when the
+    error of every remaining collapse exceeds *tolerance*. At least one must
+    be given. The error is the root sum of squares of the distances of the
+    merged vertex from its original planes, so it also bounds the distance
+    from each plane.
+
+    The deviation returned is the larger of the distance of the original
+    vertices from the decimated surface and of the decimated vertices from
+    the original surface.
+
+    Args:
+        geom (stl.mesh.Mesh): STL geometry or an :py:class:`IndexedMesh`
+        target_faces (int): number of faces to stop at
+        tolerance (float): greatest quadric error of a collapse
+
+    Returns:
+        A tuple of the new :py:class:`stl.mesh.Mesh` and the deviation.
+
+    Raises:
+        ValueError: if neither a target nor a tolerance was given
+
+    """
+    from firefish.spatial import TriangleBVH
+
+    if target_faces is None and tolerance is None:
+        raise ValueError('Specify a target face count or a tolerance')
+    original = geom if isinstance(geom, IndexedMesh) else stl_weld(geom)
+    vertices = np.array(original.vertices, dtype=np.float64)
+    faces = np.array(original.faces, dtype=np.int64)
+    max_cost = np.inf if tolerance is None else float(tolerance) ** 2
+    target = max(4, 0 if target_faces is None else int(target_faces))
+
+    plane_quadrics = _plane_quadrics(vertices, faces)
+    quadrics = np.zeros((len(vertices), 4, 4))
+    for corner in range(3):
+        quadrics += np.stack([
+            np.bincount(faces[:, corner], plane_quadrics[:, i, j],
+                        len(vertices))
+            for i in range(4) for j in range(4)], axis=1).reshape(-1, 4, 4)
+
+    while len(faces) > target:
+        _, edges, _, _, counts = _edge_faces(IndexedMesh(vertices, faces))
+        locked = np.zeros(len(vertices), dtype=bool)
+        locked[edges[counts != 2].ravel()] = True
+        candidates = np.flatnonzero(~locked[edges].any(axis=1))
+        positions, costs = _collapse_targets(quadrics, vertices,
+                                             edges[candidates])
+        keep = costs <= max_cost
+        if np.any(keep):
+            keep[keep] = _collapse_allowed(vertices, faces, edges,
+                                           candidates[keep], positions[keep])
+        if not np.any(keep):
+            break
+        candidates, positions, costs = \
+            candidates[keep], positions[keep], costs[keep]
+
+        # Choose the edges whose rank is the lowest within two edges.
+        order = np.argsort(costs, kind='stable')
+        rank = np.full(len(edges), np.inf)
+        rank[candidates[order]] = np.arange(len(order))
+        vertex_min = np.full(len(vertices), np.inf)
+        np.minimum.at(vertex_min, edges[:, 0], rank)
+        np.minimum.at(vertex_min, edges[:, 1], rank)
+        nearby_min = vertex_min.copy()
+        np.minimum.at(nearby_min, edges[:, 0], vertex_min[edges[:, 1]])
+        np.minimum.at(nearby_min, edges[:, 1], vertex_min[edges[:, 0]])
+        chosen = order[(rank[candidates[order]] ==
+                        nearby_min[edges[candidates[order], 0]]) &
+                       (rank[candidates[order]] ==
+                        nearby_min[edges[candidates[order], 1]])]
+        chosen = chosen[:(len(faces) - target) // 2]
+        if len(chosen) == 0:
+            break
+
+        kept, removed = edges[candidates[chosen]].T
+        vertices[kept] = positions[chosen]
+        quadrics[kept] += quadrics[removed]
+        remap = np.arange(len(vertices))
+        remap[removed] = kept
+        faces = remap[faces]
+        faces = faces[(faces[:, 0] != faces[:, 1]) &
+                      (faces[:, 1] != faces[:, 2]) &
+                      (faces[:, 2] != faces[:, 0])]
+
+    used, faces = np.unique(faces, return_inverse=True)
+    decimated = IndexedMesh(vertices[used], faces.reshape(-1, 3))
+    deviation = max(
+        TriangleBVH(decimated).distance(original.vertices).max(),
+        TriangleBVH(original).distance(decimated.vertices).max())
+    name = getattr(geom, 'name', '')
+    return stl_from_indexed(decimated, name=name), float(deviation)
+
+def _weighted_quantile(values, weights, q):
+    """The smallest value such that values no larger than it carry at least a
+    fraction *q* of the total weight."""
+    order = np.argsort(values)
+    cumulative = np.cumsum(weights[order])
+    idx = np.searchsorted(cumulative, q * cumulative[-1])
+    return int(values[order][min(idx, len(values) - 1)])
+
 def _erase_attr(o, attr):
     """Delete the attribute *attr* from *o* but only if present."""
     if hasattr(o, attr):
         delattr(o, attr)
 
-def stl_load(path):
+#: Size in bytes of the header and triangle count of a binary STL file.
+_BINARY_HEADER_SIZE = 84
+
+def _binary_triangle_count(path):
+    """The number of triangles in a binary STL file or None if *path* is not
+    a binary STL file.
+
+    The file is binary if its size matches the triangle count in its header.
+    Checking the size rather than the leading "solid" keyword copes with
+    binary files whose header starts with "solid".
+
+    """
+    size = os.path.getsize(path)
+    if size < _BINARY_HEADER_SIZE:
+        return None
+    with open(path, 'rb') as f:
+        f.seek(_BINARY_HEADER_SIZE - 4)
+        count = int(np.frombuffer(f.read(4), dtype='<u4')[0])
+    if size != _BINARY_HEADER_SIZE + count * mesh.Mesh.dtype.itemsize:
+        return None
+    return count
+
+def stl_load_binary(path):
+    """Load a binary STL file by memory-mapping it.
+
+    The triangle records of a binary STL file have exactly the layout of
+    :py:attr:`stl.mesh.Mesh.dtype` (a normal, three vertices and an attribute
+    count) and so the file is mapped directly as the mesh's data array.
+    Nothing is read until it is used and pages are only read as they are
+    touched, so computing the bounds or area of a large geometry never needs
+    more than one copy of it in memory.
+
+    The mapping is read-only. The transform functions in this module copy the
+    data into memory the first time they modify a mapped geometry and
+    :py:func:`stl_copy` shares the mapping, so data is copied only when it is
+    about to change. Code which modifies the arrays of a mapped geometry
+    directly must call :py:func:`stl_materialise` first.
+
+    Args:
+        path (str): pathname to binary STL file
+
+    Returns:
+        an new instance of :py:class:`stl.mesh.Mesh`
+
+    Raises:
+        ValueError: if *path* is not a binary STL file
+
+    """
+    count = _binary_triangle_count(path)
+    if count is None:
+        raise ValueError('Not a binary STL file: {}'.format(path))
+
+    with open(path, 'rb') as f:
+        name = f.read(_BINARY_HEADER_SIZE - 4).split(b'\0')[0].strip()
+    if count == 0:
+        # Empty files cannot be mapped.
+        data = np.zeros(0, dtype=mesh.Mesh.dtype)
+    else:
+        data = np.memmap(path, dtype=mesh.Mesh.dtype, mode='r',
+                         offset=_BINARY_HEADER_SIZE, shape=(count,))
+    return mesh.Mesh(data, calculate_normals=False, name=name)
+
+# Keywords within a solid. Those containing others must come first.
+_FACET_KEYWORDS = [
+    b'endfacet', b'endloop', b'facet', b'normal', b'outer', b'loop', b'vertex',
+]
+
+def stl_load_ascii(path, return_solids=False):
+    """Load an ASCII STL file.
+
+    Rather than parsing the file line by line, the keywords are stripped from
+    each solid and the remaining numbers are converted by numpy in one call.
+    Each facet contributes twelve numbers: its normal followed by its three
+    vertices.
+
+    Files containing more than one solid are loaded as a single geometry.
+    Pass *return_solids* to find out which triangles came from which solid.
+
+    Args:
+        path (str): pathname to ASCII STL file
+        return_solids (bool): also return the names and extents of the solids
+
+    Returns:
+        an new instance of :py:class:`stl.mesh.Mesh`. If *return_solids* is
+        True, a pair whose second element is a list of (name, start, stop)
+        tuples giving the name of each solid and the range of triangles it
+        contains.
+
+    Raises:
+        ValueError: if *path* is not a valid ASCII STL file
+
+    """
+    with open(path, 'rb') as f:
+        text = f.read()
+
+    # Each solid ends with an "endsolid" line. Splitting on it leaves the end
+    # of the previous "endsolid" line before each solid's "solid" line.
+    solids, blocks, start = [], [], 0
+    chunks = text.split(b'endsolid')
+    for idx, chunk in enumerate(chunks[:-1]):
+        if idx > 0:
+            chunk = chunk[chunk.find(b'\n') + 1:]
+        header_start = chunk.find(b'solid')
+        header_end = chunk.find(b'\n', header_start)
+        if header_start < 0 or header_end < 0 or chunk[:header_start].strip():
+            raise ValueError('Not an ASCII STL file: {}'.format(path))
+
+        body = chunk[header_end:]
+        for keyword in _FACET_KEYWORDS:
+            body = body.replace(keyword, b' ')
+        values = np.fromstring(body.decode('ascii'), sep=' ')
+        if values.size % 12 != 0:
+            raise ValueError('Malformed solid in ASCII STL file: {}'.format(
+                path))
+        values = values.reshape(-1, 12)
+        blocks.append(values)
+        name = chunk[header_start + len(b'solid'):header_end].strip()
+        solids.append((name, start, start + len(values)))
+        start += len(values)
+    if len(solids) == 0:
+        raise ValueError('Not an ASCII STL file: {}'.format(path))
+
+    values = np.concatenate(blocks)
+    data = np.zeros(len(values), dtype=mesh.Mesh.dtype)
+    data['normals'] = values[:, :3]
+    data['vectors'] = values[:, 3:].reshape(-1, 3, 3)
+    geom = mesh.Mesh(data, calculate_normals=False, name=solids[0][0])
+    if return_solids:
+        return geom, solids
+    return geom
+
+def stl_load(path, memory_map=True):
     """Convenience function to load a :py:class:`stl.mesh.Mesh` from disk.
 
+    Binary STL files are memory-mapped by :py:func:`stl_load_binary` unless
+    *memory_map* is False. ASCII STL files are parsed by
+    :py:func:`stl_load_ascii`. Files which neither can read are passed to
+    numpy-stl.
+
     .. note::
 
-        The :py:meth:`save` method on :py:class:`stl.mesh.Mesh` may be used to
-        write geometry to disk.
+        Use :py:func:`stl_save` to write geometry to disk. The :py:meth:`save`
+        method on :py:class:`stl.mesh.Mesh` recalculates normals in place and
+        so fails for memory-mapped geometry unless :py:func:`stl_materialise`
+        is called first.
 
     Args:
         path (str): pathname to STL file
+        memory_map (bool): memory-map binary STL files
 
     Returns:
         an new instance of :py:class:`stl.mesh.Mesh`
     """
+    if _binary_triangle_count(path) is not None:
+        if memory_map:
+            return stl_load_binary(path)
+    else:
+        try:
+            return stl_load_ascii(path)
+        except (ValueError, UnicodeDecodeError):
+            pass
     return mesh.Mesh.from_file(path)
 
+def stl_materialise(geom):
+    """Ensure that a geometry's data is held in writeable memory.
+
+    Geometry loaded by :py:func:`stl_load_binary`, and copies of it, share a
+    read-only mapping of the file. This function replaces such data with an
+    in-memory copy. Other geometry is left untouched.
+
+    Args:
+        geom (stl.mesh.Mesh): STL geometry
+
+    Returns:
+        The passed geometry to allow for easy chaining of calls.
+
+    """
+    if not geom.data.flags.writeable:
+        geom.data = np.array(geom.data)
+    return geom
+
+_ASCII_FACET = (
+    '  facet normal %e %e %e\n'
+    '    outer loop\n'
+    '      vertex %e %e %e\n'
+    '      vertex %e %e %e\n'
+    '      vertex %e %e %e\n'
+    '    endloop\n'
+    '  endfacet\n'
+)
+
+def _solid_name(name):
+    """The name of a solid as bytes."""
+    if isinstance(name, bytes):
+        return name
+    return str(name).encode('ascii', 'replace')
+
+def _write_replacing(path, chunks):
+    """Write byte strings to a temporary file and rename it to *path*.
+
+    The geometry being written may be memory-mapped from *path* itself, so
+    the file must not be truncated until all of it has been written.
+
+    """
+    tmp_path = '{}.tmp-{}-{}'.format(path, os.getpid(),
+                                     threading.current_thread().ident)
+    try:
+        with open(tmp_path, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.rename(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def _ascii_solid(geom, name):
+    """Format a geometry as an ASCII STL solid named *name*."""
+    values = np.concatenate((geom.normals, geom.vectors.reshape(-1, 9)),
+                            axis=1)
+    facets = (_ASCII_FACET * len(values)) % tuple(values.ravel().tolist())
+    return b''.join((b'solid ', name, b'\n', facets.encode('ascii'),
+                     b'endsolid ', name, b'\n'))
+
+def stl_save(geom, path, ascii=False, name=None):
+    """Write a geometry to disk as an STL file.
+
+    A binary file is written straight from the geometry's data array, which
+    already has the layout of a binary STL file, without copying it. An ASCII
+    file is formatted in a single string operation. In neither case is the
+    file written facet by facet.
+
+    Unlike :py:meth:`stl.mesh.Mesh.save`, normals are written as they are
+    rather than being recalculated.
+
+    Args:
+        geom (stl.mesh.Mesh): STL geometry
+        path (str): pathname to write to
+        ascii (bool): write an ASCII rather than a binary STL file
+        name (str): name to record in the file. Defaults to the geometry's
+            name.
+
+    """
+    if name is None:
+        name = geom.name
+    name = _solid_name(name)
+
+    if ascii:
+        _write_replacing(path, [_ascii_solid(geom, name)])
+        return
+
+    data = np.ascontiguousarray(geom.data, dtype=mesh.Mesh.dtype)
+    header = name[:_BINARY_HEADER_SIZE - 4].ljust(_BINARY_HEADER_SIZE - 4)
+    _write_replacing(path, [
+        header + np.array([len(data)], dtype='<u4').tobytes(), data])
+
+def stl_save_regions(path, regions):
+    """Write several geometries to one ASCII STL file as named solids.
+
+    OpenFOAM reads each solid of such a file as a separate region of the
+    surface. :py:func:`stl_load_ascii` reads it back as a single geometry.
+
+    Args:
+        path (str): pathname to write to
+        regions: sequence of (name, geom) pairs giving the name and
+            :py:class:`stl.mesh.Mesh` of each solid
+
+    """
+    contents = b''.join(_ascii_solid(geom, _solid_name(name))
+                        for name, geom in regions)
+    with open(path, 'wb') as f:
+        f.write(contents)
+
+def stl_concatenate(geoms, name=''):
+    """Join several geometries into one.
+
+    Args:
+        geoms: sequence of :py:class:`stl.mesh.Mesh`
+        name (str): name of the joined geometry
+
+    Returns:
+        A new geometry containing the triangles of each geometry in turn.
+
+    """
+    data = np.concatenate([np.asarray(g.data, dtype=mesh.Mesh.dtype)
+                           for g in geoms])
+    return mesh.Mesh(data, calculate_normals=False, name=name)
+
 def stl_bounds(geom):
     """Compute the bounding box of the geometry.
 
@@ -195,6 +1485,180 @@ def stl_bounds(geom):
     """
     return geom.min_, geom.max_
 
+def stl_area(geom):
+    """Compute the total surface area of the geometry.
+
+    The area is computed directly from the triangle vertices and so does not
+    depend on any cached values on *geom*.
+
+    Args:
+        geom (stl.mesh.Mesh): STL geometry
+
+    Returns:
+        The surface area as a float.
+
+    """
+    v0, v1, v2 = geom.v0, geom.v1, geom.v2
+    cross = np.cross(v1 - v0, v2 - v0)
+    return 0.5 * float(np.sum(np.sqrt(np.einsum('ij,ij->i', cross, cross))))
+
+def stl_dihedral_angles(geom):
+    """Compute the angle between the normals of each pair of adjacent faces.
+
+    Faces are adjacent if they share an edge, i.e. two vertices with
+    identical co-ordinates or, for an :py:class:`IndexedMesh`, two vertex
+    indices. The angle is zero for coplanar faces.
+
+    Args:
+        geom (stl.mesh.Mesh or IndexedMesh): STL geometry
+
+    Returns:
+        A triple of 1-d arrays giving the indices of the first and second
+        face of each adjacent pair and the angle between their normals in
+        degrees.
+
+    """
+    face_a, face_b = _adjacent_faces(geom)
+    normals = _unit_normals(geom)
+    cosines = np.einsum('ij,ij->i', normals[face_a], normals[face_b])
+    angles = np.degrees(np.arccos(np.clip(cosines, -1, 1)))
+    return face_a, face_b, angles
+
+def stl_curvature(geom, feature_angle=30):
+    """Estimate the curvature of the surface at each triangle.
+
+    The curvature across each edge is estimated as the angle between the
+    normals of the adjacent faces divided by the distance between their
+    centroids. Each triangle takes the mean curvature across its edges.
+    Edges sharper than *feature_angle* are treated as features rather than
+    as curvature and are ignored.
+
+    Args:
+        geom (stl.mesh.Mesh or IndexedMesh): STL geometry
+        feature_angle (float): angle in degrees above which edges are features
+
+    Returns:
+        A 1-d array giving the curvature (reciprocal of the radius of
+        curvature) at each triangle.
+
+    """
+    face_a, face_b, angles = stl_dihedral_angles(geom)
+    smooth = angles <= feature_angle
+    face_a, face_b, angles = face_a[smooth], face_b[smooth], angles[smooth]
+
+    centroids = _face_vectors(geom).mean(axis=1).astype(np.float64)
+    distances = np.linalg.norm(centroids[face_a] - centroids[face_b], axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        edge_curvature = np.where(distances > 0,
+                                  np.radians(angles) / distances, 0)
+
+    n_faces = len(centroids)
+    totals = (np.bincount(face_a, edge_curvature, n_faces) +
+              np.bincount(face_b, edge_curvature, n_faces))
+    counts = np.bincount(face_a, minlength=n_faces) + \
+        np.bincount(face_b, minlength=n_faces)
+    return totals / np.maximum(counts, 1)
+
+def stl_refinement_levels(geom, cell_size, angular_resolution=10,
+                          feature_angle=30, max_level=10):
+    """Choose snappyHexMesh refinement levels to resolve a surface.
+
+    A curved surface with radius of curvature R is resolved with an angle of
+    *angular_resolution* per cell if the cell size is no more than R times
+    the angular resolution in radians. Each triangle is given the lowest
+    refinement level of a background mesh with *cell_size* cells which
+    achieves this.
+
+    The minimum surface level resolves half of the surface area and the
+    maximum level resolves all but the most curved 1%, which is assumed to be
+    noise in the triangulation. Feature edges, i.e. those sharper than
+    *feature_angle*, are refined to the maximum level if present.
+
+    Args:
+        geom (stl.mesh.Mesh or IndexedMesh): STL geometry
+        cell_size (float): background mesh cell size
+        angular_resolution (float): wanted angle in degrees per cell
+        feature_angle (float): angle in degrees above which edges are features
+        max_level (int): upper bound on the returned levels
+
+    Returns:
+        A triple giving the minimum and maximum surface refinement levels and
+        the feature edge refinement level.
+
+    """
+    curvature = stl_curvature(geom, feature_angle)
+    with np.errstate(divide='ignore'):
+        levels = np.log2(curvature * cell_size / np.radians(angular_resolution))
+    levels = np.clip(np.ceil(levels), 0, max_level).astype(int)
+
+    vectors = _face_vectors(geom)
+    v0, v1, v2 = vectors[:, 0], vectors[:, 1], vectors[:, 2]
+    areas = 0.5 * np.linalg.norm(np.cross(v1 - v0, v2 - v0), axis=1)
+    min_level = _weighted_quantile(levels, areas, 0.5)
+    surface_max = _weighted_quantile(levels, areas, 0.99)
+
+    _, _, angles = stl_dihedral_angles(geom)
+    edge_level = surface_max if np.any(angles > feature_angle) else min_level
+    return min_level, surface_max, edge_level
+
+def stl_feature_edges(geom, included_angle=180):
+    """Find the feature edges of a surface.
+
+    This follows the "extractFromSurface" method of OpenFOAM's
+    surfaceFeatureExtract. An edge is a feature if it is open (used by one
+    face), non-manifold (used by more than two faces) or if the angle between
+    the normals of its two faces is more than 180 - *included_angle* degrees.
+
+    Args:
+        geom (stl.mesh.Mesh or IndexedMesh): STL geometry
+        included_angle (float): included angle in degrees
+
+    Returns:
+        A pair giving the feature points as an (N, 3) array and the feature
+        edges as an (M, 2) array of indices into the points.
+
+    """
+    vertices, edges, edge_faces, starts, counts = _edge_faces(geom)
+
+    feature = counts != 2
+    manifold = np.flatnonzero(counts == 2)
+    normals = _unit_normals(geom)
+    face_a = edge_faces[starts[manifold]]
+    face_b = edge_faces[starts[manifold] + 1]
+    cosines = np.einsum('ij,ij->i', normals[face_a], normals[face_b])
+    feature[manifold] = cosines < np.cos(np.radians(180.0 - included_angle))
+
+    edges = edges[feature]
+    used, edges = np.unique(edges, return_inverse=True)
+    return vertices[used], edges.reshape(-1, 2)
+
+def write_feature_edge_mesh(path, points, edges):
+    """Write feature edges as an OpenFOAM featureEdgeMesh (.eMesh) file.
+
+    Args:
+        path (str): path of the file to write
+        points (array like): (N, 3) array of points
+        edges (array like): (M, 2) array of indices into *points*
+
+    """
+    header = (
+        'FoamFile\n{{\n    version     2.0;\n    format      ascii;\n'
+        '    class       featureEdgeMesh;\n'
+        '    location    "constant/triSurface";\n'
+        '    object      {};\n}}\n\n'
+    ).format(os.path.basename(path))
+
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(header)
+        f.write('// points:\n\n{}\n(\n'.format(len(points)))
+        np.savetxt(f, np.asarray(points, dtype=np.float64),
+                   fmt='(%.9g %.9g %.9g)')
+        f.write(')\n\n// edges:\n\n{}\n(\n'.format(len(edges)))
+        np.savetxt(f, np.asarray(edges, dtype=np.int64), fmt='(%d %d)')
+        f.write(')\n')
+
 def stl_geometric_centre(geom):
     """Compute the centre of the bounding box.
 
@@ -213,6 +1677,10 @@ def stl_copy(geom):
     Use this function sparingly. Geometry can be quite heavyweight as data
     structures go.
 
+    Read-only data, such as that of geometry loaded by
+    :py:func:`stl_load_binary`, is shared rather than copied. It is copied by
+    the first transform which modifies either geometry.
+
     Args:
         geom (stl.mesh.Mesh): STL geometry
 
@@ -220,7 +1688,39 @@ def stl_copy(geom):
         A deep copy of the geometry.
 
     """
-    return mesh.Mesh(geom.data, calculate_normals=False, name=geom.name)
+    data = geom.data
+    if data.flags.writeable:
+        data = data.copy()
+    return mesh.Mesh(data, calculate_normals=False, name=geom.name)
+
+def stl_transform(geom, matrix):
+    """Apply an affine transformation to a geometry.
+
+    Unlike the other transformation functions, this function returns a new
+    geometry and leaves the passed one unchanged. The vertices are
+    transformed in a single matrix multiplication. Normals are transformed by
+    the cofactor matrix of the linear part, which keeps them perpendicular to
+    their faces and consistent with the vertex winding.
+
+    Args:
+        geom (stl.mesh.Mesh): STL geometry
+        matrix (array like): 4x4 matrix acting on homogeneous co-ordinates
+
+    Returns:
+        A new transformed geometry.
+
+    """
+    matrix = np.asarray(matrix, dtype=np.float64)
+    linear, offset = matrix[:3, :3], matrix[:3, 3]
+    cofactor = np.array([np.cross(linear[:, 1], linear[:, 2]),
+                         np.cross(linear[:, 2], linear[:, 0]),
+                         np.cross(linear[:, 0], linear[:, 1])])
+
+    data = np.empty(len(geom.data), dtype=geom.data.dtype)
+    data['vectors'] = geom.vectors.dot(linear.T) + offset
+    data['normals'] = geom.normals.dot(cofactor)
+    data['attr'] = geom.attr
+    return mesh.Mesh(data, calculate_normals=False, name=geom.name)
 
 def stl_translate(geom, delta):
     """Translate a geometry along some vector.
@@ -236,6 +1736,7 @@ def stl_translate(geom, delta):
 
     """
     cx, cy, cz = np.atleast_1d(delta)
+    stl_materialise(geom)
     geom.x += cx
     geom.y += cy
     geom.z += cz
@@ -285,6 +1786,7 @@ def stl_scale(geom, factor):
         factor = np.ones(3) * factor[0]
     sx, sy, sz = factor
 
+    stl_materialise(geom)
     geom.x *= sx
     geom.y *= sy
     geom.z *= sz
@@ -296,3 +1798,448 @@ def stl_scale(geom, factor):
     _erase_attr(geom, '_areas')
 
     return geom
+
+def _nose_profile(shape, length, radius, x):
+    """Radius of a nose cone at distances *x* behind its tip."""
+    shape = NoseShape(shape)
+    if shape == NoseShape.CONIC:
+        return radius * x / length
+    if shape == NoseShape.OGIVE:
+        # A tangent ogive: an arc of a circle which meets the body tube at a
+        # tangent.
+        rho = (radius ** 2 + length ** 2) / (2 * radius)
+        return np.sqrt(np.maximum(rho ** 2 - (length - x) ** 2, 0)) + \
+            radius - rho
+    theta = np.arccos(np.clip(1 - 2 * x / length, -1, 1))
+    return radius / np.sqrt(np.pi) * np.sqrt(theta - np.sin(2 * theta) / 2)
+
+def rocket_surface(radius, nose_length, body_length,
+                   nose_shape=NoseShape.OGIVE, boat_tail_length=0,
+                   boat_tail_radius=None, fin_count=0, fin_root_chord=0,
+                   fin_tip_chord=0, fin_span=0, fin_sweep=0, fin_thickness=0,
+                   fin_offset=0, n_around=32, n_nose=16, n_body=1,
+                   n_boat_tail=1, name='rocket'):
+    """Triangulate a rocket made of a nose cone, body tube, boat tail and fins.
+
+    The surface is built directly from the design parameters without any
+    boolean operations so that many design variants can be generated
+    quickly, e.g. for design sweeps.
+
+    The rocket lies along the X axis with the tip of the nose at the origin.
+    The nose cone, body tube, boat tail and base are one closed surface of
+    revolution. Each fin is a separate closed flat plate with a trapezoidal
+    planform. Its root is extended into the body tube to half the tube's
+    radius so that the fins and tube overlap rather than meet.
+    snappyHexMesh meshes the region outside all of the surfaces so the
+    overlap need not be removed. Fins are spaced evenly around the tube with
+    the first in the +Y direction.
+
+    The triangles of each part form a contiguous range. The ranges are
+    returned as (name, start, stop) tuples as by :py:func:`stl_load_ascii`
+    with the names "nose", "body", "boatTail" (if the boat tail has non-zero
+    length), "base" and "fin1" to "finN". :py:func:`stl_split` separates the
+    parts, e.g. to write them as regions of one surface with
+    :py:func:`stl_save_regions` so that forces on each may be reported
+    separately.
+
+    >>> geom, regions = rocket_surface(0.05, 0.3, 1, fin_count=3,
+    ...                                fin_root_chord=0.2, fin_tip_chord=0.1,
+    ...                                fin_span=0.08, fin_thickness=0.005)
+    >>> [r[0] for r in regions]
+    ['nose', 'body', 'base', 'fin1', 'fin2', 'fin3']
+    >>> stl_check(geom).closed
+    True
+
+    Args:
+        radius: radius of the body tube
+        nose_length: length of the nose cone
+        body_length: length of the body tube
+        nose_shape (NoseShape): profile of the nose cone. A tangent ogive
+            must be at least as long as the tube's radius.
+        boat_tail_length: length of the boat tail
+        boat_tail_radius: radius of the aft end of the boat tail. Defaults
+            to the radius of the body tube.
+        fin_count: number of fins
+        fin_root_chord: chord of the fins where they meet the body tube
+        fin_tip_chord: chord of the fins at their tips
+        fin_span: distance from the body tube to the tips of the fins
+        fin_sweep: distance from the leading edge of the root of the fins
+            back to the leading edge of their tips
+        fin_thickness: thickness of the fins
+        fin_offset: distance from the aft end of the body tube forward to
+            the trailing edge of the root of the fins
+        n_around: number of facets around the surface of revolution
+        n_nose: number of divisions along the nose cone. They are closer
+            together towards the tip.
+        n_body: number of divisions along the body tube
+        n_boat_tail: number of divisions along the boat tail
+        name (str): name of the geometry
+
+    Returns:
+        A pair of the new :py:class:`stl.mesh.Mesh` and the list of regions.
+
+    Raises:
+        ValueError: if the dimensions do not describe a valid rocket
+
+    """
+    if boat_tail_radius is None:
+        boat_tail_radius = radius
+    if min(radius, nose_length, body_length, boat_tail_radius) <= 0 or \
+            boat_tail_length < 0:
+        raise ValueError('Rocket dimensions must be positive')
+    if NoseShape(nose_shape) == NoseShape.OGIVE and nose_length < radius:
+        raise ValueError('An ogive nose must be at least as long as the '
+                         'body radius')
+    if fin_count > 0 and min(fin_root_chord, fin_tip_chord, fin_span,
+                             fin_thickness) <= 0:
+        raise ValueError('Fins need positive chords, span and thickness')
+    if boat_tail_length == 0:
+        n_boat_tail = 0
+
+    # Stations along the surface of revolution, starting at the tip.
+    t = np.linspace(0, 1, n_nose + 1)
+    nose_x = nose_length * (1 - np.cos(0.5 * np.pi * t))
+    body_x = nose_length + body_length * np.arange(1, n_body + 1) / n_body
+    tail_t = np.arange(1, n_boat_tail + 1) / max(n_boat_tail, 1)
+    x = np.concatenate([nose_x, body_x,
+                        body_x[-1] + boat_tail_length * tail_t])
+    r = np.concatenate([_nose_profile(nose_shape, nose_length, radius, nose_x),
+                        np.full(n_body, radius),
+                        radius + (boat_tail_radius - radius) * tail_t])
+    r[0] = 0
+
+    # Rings of vertices with the first vertex repeated at the end of each
+    # ring. Between each pair of rings is a band of quadrilaterals split into
+    # two triangles, except at the tip where only one triangle is needed.
+    phi = 2 * np.pi * (np.arange(n_around + 1) % n_around) / n_around
+    rings = np.empty((len(x), n_around + 1, 3))
+    rings[..., 0] = x[:, np.newaxis]
+    rings[..., 1] = r[:, np.newaxis] * np.cos(phi)
+    rings[..., 2] = r[:, np.newaxis] * np.sin(phi)
+    a, b = rings[:-1, :-1], rings[:-1, 1:]
+    c, d = rings[1:, 1:], rings[1:, :-1]
+    bands = np.stack([np.stack([a, b, d], axis=2),
+                      np.stack([b, c, d], axis=2)], axis=2)
+    centre = np.broadcast_to([x[-1], 0, 0], (n_around, 3))
+    base = np.stack([centre, rings[-1, :-1], rings[-1, 1:]], axis=1)
+    parts = [bands[0, :, 1], bands[1:].reshape(-1, 3, 3), base]
+
+    names = ['nose', 'body', 'boatTail', 'base']
+    counts = [n_around * (2 * n_nose - 1), 2 * n_around * n_body,
+              2 * n_around * n_boat_tail, n_around]
+
+    if fin_count > 0:
+        # The fin planform in (axial, radial) co-ordinates, anticlockwise
+        # from the leading edge of the embedded part of the root.
+        te = x[n_nose + n_body] - fin_offset
+        le = te - fin_root_chord
+        tip_le = le + fin_sweep
+        tip = radius + fin_span
+        planform = np.array([
+            [le, 0.5 * radius], [te, 0.5 * radius], [te, radius],
+            [tip_le + fin_tip_chord, tip], [tip_le, tip], [le, radius],
+        ])
+        caps = np.array([[0, 1, 2], [0, 2, 5], [5, 2, 3], [5, 3, 4]])
+        edges = np.stack([np.arange(6), (np.arange(6) + 1) % 6], axis=1)
+
+        # Vertices 0-5 are on the anticlockwise side of each fin and 6-11
+        # on the other side.
+        angles = 2 * np.pi * np.arange(fin_count) / fin_count
+        cos, sin = np.cos(angles)[:, np.newaxis], np.sin(angles)[:, np.newaxis]
+        offset = 0.5 * fin_thickness * np.repeat([1, -1], 6)
+        radial = np.tile(planform[:, 1], 2)
+        vertices = np.empty((fin_count, 12, 3))
+        vertices[..., 0] = np.tile(planform[:, 0], 2)
+        vertices[..., 1] = radial * cos - offset * sin
+        vertices[..., 2] = radial * sin + offset * cos
+        fin_faces = np.concatenate([
+            caps, caps[:, ::-1] + 6,
+            np.stack([edges[:, 0] + 6, edges[:, 1] + 6, edges[:, 1]], axis=1),
+            np.stack([edges[:, 0] + 6, edges[:, 1], edges[:, 0]], axis=1),
+        ])
+        parts.append(vertices[:, fin_faces].reshape(-1, 3, 3))
+        names.extend('fin{}'.format(i + 1) for i in range(fin_count))
+        counts.extend([len(fin_faces)] * fin_count)
+
+    data = np.zeros(sum(counts), dtype=mesh.Mesh.dtype)
+    data['vectors'] = np.concatenate(parts)
+    normals = np.cross(data['vectors'][:, 1] - data['vectors'][:, 0],
+                       data['vectors'][:, 2] - data['vectors'][:, 0])
+    lengths = np.sqrt(np.einsum('ij,ij->i', normals, normals))
+    data['normals'] = normals / np.where(lengths > 0, lengths,
+                                         1)[:, np.newaxis]
+
+    stops = np.cumsum(counts)
+    regions = [(n, int(stop - count), int(stop))
+               for n, count, stop in zip(names, counts, stops) if count > 0]
+    return mesh.Mesh(data, calculate_normals=False, name=name), regions
+
+def stl_split(geom, regions):
+    """Split a geometry into regions.
+
+    Args:
+        geom (stl.mesh.Mesh): STL geometry
+        regions: list of (name, start, stop) tuples giving the name of each
+            region and the range of triangles it contains
+
+    Returns:
+        A list of (name, geom) pairs giving each region as a new
+        :py:class:`stl.mesh.Mesh`, as taken by :py:func:`stl_save_regions`.
+
+    """
+    return [(name, mesh.Mesh(geom.data[start:stop].copy(),
+                             calculate_normals=False, name=name))
+            for name, start, stop in regions]
+
+def _triangles_of(geom):
+    """The (F, 3, 3) float64 triangles of a :py:class:`Geometry`,
+    :py:class:`stl.mesh.Mesh` or :py:class:`IndexedMesh`."""
+    if isinstance(geom, Geometry):
+        geom = geom.geom
+    return np.asarray(_face_vectors(geom), dtype=np.float64)
+
+def _connected_parts(triangles):
+    """Split (F, 3, 3) triangles into the parts connected by shared
+    vertices."""
+    vertices, vertex_ids = np.unique(triangles.reshape(-1, 3), axis=0,
+                                     return_inverse=True)
+    faces = vertex_ids.reshape(-1, 3)
+    labels = _connected_labels(len(vertices), faces[:, :2].ravel(),
+                               faces[:, 1:].ravel())[faces[:, 0]]
+    return [triangles[labels == label] for label in np.unique(labels)]
+
+def _triangle_areas(triangles):
+    cross = np.cross(triangles[:, 1] - triangles[:, 0],
+                     triangles[:, 2] - triangles[:, 0])
+    return 0.5 * np.sqrt(np.einsum('ij,ij->i', cross, cross))
+
+def _subtriangle_centroids(n):
+    """Barycentric co-ordinates of the centroids of the n * n triangles
+    of a triangle whose edges are divided into n."""
+    i, j = np.meshgrid(np.arange(n), np.arange(n), indexing='ij')
+    up = i + j <= n - 1
+    down = i + j <= n - 2
+    u = np.concatenate([i[up] + 1.0 / 3, i[down] + 2.0 / 3]) / n
+    v = np.concatenate([j[up] + 1.0 / 3, j[down] + 2.0 / 3]) / n
+    return np.stack([1 - u - v, u, v], axis=1)
+
+def wetted_area(geometries, subdivisions=4):
+    """Compute the area of several geometries which is exposed to the flow.
+
+    Each geometry is split into parts connected by shared vertices, such as
+    the body and fins made by :py:func:`rocket_surface`. Where the parts
+    overlap, e.g. where the root of a fin is embedded in a body tube, the
+    areas of each part inside the others are not wetted. Each triangle is
+    divided into *subdivisions* squared smaller triangles and the area of
+    those whose centroids are inside another part is discounted. Insideness
+    is only meaningful for closed parts, so each part must be a closed
+    surface unless it is the only one.
+
+    Args:
+        geometries: list of :py:class:`Geometry`, :py:class:`stl.mesh.Mesh`
+            or :py:class:`IndexedMesh`
+        subdivisions (int): number of divisions of each edge of a triangle
+
+    Returns:
+        The wetted area as a float.
+
+    """
+    from firefish.spatial import TriangleBVH
+
+    parts = [part for g in geometries
+             for part in _connected_parts(_triangles_of(g))]
+    if len(parts) == 1:
+        return float(_triangle_areas(parts[0]).sum())
+
+    centroids = _subtriangle_centroids(subdivisions)
+    total = 0.0
+    for i, triangles in enumerate(parts):
+        others = TriangleBVH([IndexedMesh(t.reshape(-1, 3),
+                                          np.arange(3 * len(t)).reshape(-1, 3))
+                              for j, t in enumerate(parts) if j != i])
+        points = np.einsum('sk,fkd->fsd', centroids, triangles)
+        outside = ~others.contains(points.reshape(-1, 3))
+        total += float(np.dot(_triangle_areas(triangles),
+                              outside.reshape(len(triangles), -1).mean(axis=1)))
+    return total
+
+def frontal_area(geometries, axis=(1, 0, 0), resolution=1024,
+                 pixel_budget=2**20):
+    """Compute the area of several geometries projected along an axis.
+
+    This is the area of the union of the triangles projected onto a plane
+    normal to *axis*. The union is found by rasterising the projected
+    triangles onto a grid of *resolution* pixels across the larger side of
+    their bounding box. A pixel is covered if its centre is inside or on the
+    edge of any triangle, so the area is accurate to about a pixel around
+    the outline. Triangles are rasterised together in batches covering at
+    most about *pixel_budget* pixels of their bounding boxes.
+
+    Args:
+        geometries: list of :py:class:`Geometry`, :py:class:`stl.mesh.Mesh`
+            or :py:class:`IndexedMesh`
+        axis: the axis to project along, e.g. the flight axis
+        resolution (int): number of pixels across the raster
+        pixel_budget (int): number of pixels to test at once
+
+    Returns:
+        The frontal area as a float.
+
+    """
+    axis = np.asarray(axis, dtype=np.float64)
+    axis = axis / np.linalg.norm(axis)
+    u = np.cross(axis, np.eye(3)[np.argmin(np.abs(axis))])
+    u /= np.linalg.norm(u)
+    v = np.cross(axis, u)
+
+    triangles = np.concatenate([_triangles_of(g) for g in geometries])
+    projected = np.stack([triangles.dot(u), triangles.dot(v)], axis=-1)
+    lo = projected.reshape(-1, 2).min(axis=0)
+    hi = projected.reshape(-1, 2).max(axis=0)
+    pixel = (hi - lo).max() / resolution
+    if pixel == 0:
+        return 0.0
+    shape = np.maximum(np.ceil((hi - lo) / pixel).astype(int), 1)
+    covered = np.zeros(shape, dtype=bool)
+
+    # Pixel co-ordinates with the vertices of each triangle anticlockwise.
+    # Triangles seen edge on cover nothing.
+    p = (projected - lo) / pixel
+    e1, e2 = p[:, 1] - p[:, 0], p[:, 2] - p[:, 0]
+    twice_area = e1[:, 0] * e2[:, 1] - e1[:, 1] * e2[:, 0]
+    p = p[twice_area != 0]
+    clockwise = twice_area[twice_area != 0] < 0
+    p[clockwise] = p[clockwise][:, ::-1]
+
+    # A point (x, y) is inside or on edge k of a triangle when
+    # edge_x[k] * x + edge_y[k] * y + edge_c[k] >= 0.
+    edge = np.roll(p, -1, axis=1) - p
+    edge_x, edge_y = -edge[..., 1], edge[..., 0]
+    edge_c = edge[..., 1] * p[..., 0] - edge[..., 0] * p[..., 1]
+
+    first = np.maximum(np.ceil(p.min(axis=1) - 0.5).astype(int), 0)
+    last = np.minimum(np.floor(p.max(axis=1) - 0.5).astype(int), shape - 1)
+    spans = np.maximum(last - first + 1, 0)
+    counts = spans[:, 0] * spans[:, 1]
+    ends = np.cumsum(counts)
+    starts = ends - counts
+    n_batches = int(ends[-1] // pixel_budget) + 1 if len(ends) else 0
+    bounds = np.unique(np.concatenate([
+        [0], np.searchsorted(ends, pixel_budget * np.arange(1, n_batches)),
+        [len(p)]]))
+
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        tri = np.repeat(np.arange(start, stop), counts[start:stop])
+        offsets = np.arange(len(tri)) + starts[start] - starts[tri]
+        i = first[tri, 0] + offsets // spans[tri, 1]
+        j = first[tri, 1] + offsets % spans[tri, 1]
+        inside = np.all(edge_x[tri] * (i + 0.5)[:, np.newaxis] +
+                        edge_y[tri] * (j + 0.5)[:, np.newaxis] +
+                        edge_c[tri] >= 0, axis=1)
+        covered[i[inside], j[inside]] = True
+
+    return float(covered.sum()) * pixel ** 2
+
+def reference_length(geometries, axis=(1, 0, 0)):
+    """Compute the length of several geometries along an axis.
+
+    Args:
+        geometries: list of :py:class:`Geometry`, :py:class:`stl.mesh.Mesh`
+            or :py:class:`IndexedMesh`
+        axis: the axis to measure along, e.g. the flight axis
+
+    Returns:
+        The length as a float.
+
+    """
+    axis = np.asarray(axis, dtype=np.float64)
+    axis = axis / np.linalg.norm(axis)
+    extents = [_triangles_of(g).reshape(-1, 3).dot(axis) for g in geometries]
+    return float(max(e.max() for e in extents) - min(e.min() for e in extents))
+
+def reference_values(geometries, axis=(1, 0, 0), resolution=1024):
+    """Compute reference values for the force coefficients of geometries.
+
+    See :py:func:`wetted_area`, :py:func:`frontal_area` and
+    :py:func:`reference_length`.
+
+    Args:
+        geometries: list of :py:class:`Geometry`, :py:class:`stl.mesh.Mesh`
+            or :py:class:`IndexedMesh`
+        axis: the flight axis
+        resolution (int): number of pixels across the raster of the frontal
+            area
+
+    Returns:
+        A :py:class:`ReferenceValues`.
+
+    """
+    return ReferenceValues(wetted_area(geometries),
+                           frontal_area(geometries, axis, resolution),
+                           reference_length(geometries, axis))
+
+def force_coeffs_dict(geometries, mag_u_inf, drag_dir=(1, 0, 0),
+                      lift_dir=(0, 1, 0), rho_inf=1, origin=(0, 0, 0),
+                      a_ref=None, l_ref=None, resolution=1024):
+    """Make a forceCoeffs function object dictionary for some geometries.
+
+    The forces are integrated over the patches named after the geometries.
+    Unless given, the reference area is the frontal area along the drag
+    direction and the reference length is the length along it. The pitch
+    axis is normal to the drag and lift directions.
+
+    In a sweep over flow conditions the reference values need only be
+    computed once; change *magUInf* in the returned dictionary for each
+    case and write it with :py:func:`write_force_coeffs`.
+
+    Args:
+        geometries: list of :py:class:`Geometry`
+        mag_u_inf: free stream speed
+        drag_dir: direction of drag, i.e. of the free stream
+        lift_dir: direction of lift
+        rho_inf: free stream density
+        origin: centre of rotation for moments
+        a_ref: reference area
+        l_ref: reference length
+        resolution (int): number of pixels across the raster of the frontal
+            area
+
+    Returns:
+        A dict to use as an entry of a controlDict's *functions*.
+
+    """
+    if a_ref is None:
+        a_ref = frontal_area(geometries, drag_dir, resolution)
+    if l_ref is None:
+        l_ref = reference_length(geometries, drag_dir)
+    pitch_axis = np.cross(drag_dir, lift_dir)
+    return {
+        'type' : 'forceCoeffs',
+        'functionObjectLibs' : ['"libforces.so"'],
+        'log' : 'yes',
+        'patches' : [g.name for g in geometries],
+        'dragDir' : [float(x) for x in drag_dir],
+        'liftDir' : [float(x) for x in lift_dir],
+        'pitchAxis' : [float(x) for x in pitch_axis],
+        'magUInf' : mag_u_inf,
+        'lRef' : l_ref,
+        'Aref' : a_ref,
+        'rhoName' : 'rhoInf',
+        'rhoInf' : rho_inf,
+        'origin' : [float(x) for x in origin],
+    }
+
+def write_force_coeffs(case, coeffs, name='forceCoefficients'):
+    """Add a forceCoeffs function object to a case's controlDict.
+
+    Args:
+        case (firefish.case.Case): the case to write to
+        coeffs (dict): the function object, e.g. from
+            :py:func:`force_coeffs_dict`
+        name: name of the function object
+
+    """
+    with case.mutable_data_file(FileName.CONTROL) as d:
+        functions = d['functions'] if 'functions' in d else {}
+        functions[name] = coeffs
+        d['functions'] = functions
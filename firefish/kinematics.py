@@ -19,6 +19,17 @@ class KinematicBody(object):
         self.vel = np.zeros(3, float)
         self.rot = np.zeros(3, float)
 
+    @classmethod
+    def from_mass_properties(cls, properties):
+        """
+        Creates a body from mass properties computed from its geometry, e.g. by
+        firefish.geometry.mass_properties. The geometry's axes are taken as the
+        body axes and products of inertia are ignored.
+        Args:
+            properties (firefish.geometry.MassProperties): mass properties of the body
+        """
+        return cls(properties.mass, list(np.diag(properties.inertia)))
+
     def update_moi(self):
         """
         We update moments of inertias.
@@ -0,0 +1,235 @@
+"""
+This module provides a local cache of generated meshes.
+
+Parameter sweeps often re-mesh identical geometry with identical settings and
+change only the boundary conditions. A :py:class:`MeshCache` stores the
+``constant/polyMesh`` directory produced for a given set of mesh generation
+inputs so that later cases with the same inputs can restore it instead of
+re-running the mesher.
+
+The inputs which identify a mesh are the files in ``constant/triSurface``
+along with the blockMeshDict, snappyHexMeshDict and meshQualityDict.
+
+"""
+import hashlib
+import os
+import shutil
+import stat
+import tempfile
+
+from firefish.case import FileName
+
+#: Files whose contents, together with constant/triSurface, determine a mesh.
+KEY_FILES = [
+    FileName.BLOCK_MESH,
+    FileName.SNAPPY_HEX_MESH,
+    FileName.MESH_QUALITY_SETTINGS,
+]
+
+_POLY_MESH = os.path.join('constant', 'polyMesh')
+_TRI_SURFACE = os.path.join('constant', 'triSurface')
+
+def default_cache_dir():
+    """The default location of the mesh cache.
+
+    This is the directory named by the ``FIREFISH_MESH_CACHE`` environment
+    variable if set or ``~/.cache/firefish/meshes`` otherwise.
+
+    """
+    return os.environ.get('FIREFISH_MESH_CACHE', os.path.join(
+        os.path.expanduser('~'), '.cache', 'firefish', 'meshes'
+    ))
+
+class MeshCache(object):
+    """A size-bounded store of polyMesh directories keyed by their inputs.
+
+    When the total size of the cache exceeds *max_bytes*, the least recently
+    used meshes are evicted.
+
+    Meshes are restored by hard-linking the cached files into the case where
+    possible and by copying them otherwise. Cached files are made read-only so
+    that a tool which rewrites a linked mesh in place fails rather than
+    silently corrupting the cache. Pass ``link=False`` to always copy.
+
+    >>> case = getfixture('tmpcase')
+    >>> with case.mutable_data_file(FileName.SNAPPY_HEX_MESH) as d:
+    ...     d['castellatedMesh'] = True
+    >>> cache = MeshCache(getfixture('tmpdir').join('cache').strpath)
+    >>> cache.restore(case)
+    False
+
+    Attributes:
+        cache_dir (str): directory holding the cached meshes
+        max_bytes (int): maximum total size of the cache in bytes
+        link (bool): whether to hard-link rather than copy cached files
+
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=20 * 1024**3, link=True):
+        """Initialises the cache, creating its directory if necessary.
+
+        Args:
+            cache_dir (str): directory to store meshes in. If None,
+                :py:func:`default_cache_dir` is used.
+            max_bytes (int): maximum total size of the cache in bytes
+            link (bool): hard-link cached files into cases where possible
+
+        """
+        self.cache_dir = cache_dir if cache_dir is not None else \
+            default_cache_dir()
+        self.max_bytes = max_bytes
+        self.link = link
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def key(self, case):
+        """Compute the cache key for a case's mesh generation inputs.
+
+        Args:
+            case (firefish.case.Case): the case to compute the key for
+
+        Returns:
+            A hexadecimal digest as a string.
+
+        """
+        digest = hashlib.sha256()
+        rel_paths = [f.value for f in KEY_FILES]
+        surface_dir = os.path.join(case.root_dir_path, _TRI_SURFACE)
+        if os.path.isdir(surface_dir):
+            rel_paths.extend(os.path.join(_TRI_SURFACE, n)
+                             for n in sorted(os.listdir(surface_dir)))
+
+        for rel_path in rel_paths:
+            path = os.path.join(case.root_dir_path, rel_path)
+            if not os.path.isfile(path):
+                continue
+            digest.update(rel_path.replace(os.sep, '/').encode('utf-8'))
+            digest.update(b'\0')
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(block)
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def contains(self, key):
+        """Return True if a mesh is cached under *key*."""
+        return os.path.isdir(self._entry_path(key))
+
+    def restore(self, case, key=None):
+        """Restore a cached mesh into ``constant/polyMesh`` if present.
+
+        Any existing polyMesh in the case is replaced.
+
+        Args:
+            case (firefish.case.Case): the case to restore the mesh into
+            key (str): cache key. If None, it is computed from *case*.
+
+        Returns:
+            True if a cached mesh was restored, False otherwise.
+
+        """
+        if key is None:
+            key = self.key(case)
+        entry = self._entry_path(key)
+        if not os.path.isdir(entry):
+            return False
+
+        dest = os.path.join(case.root_dir_path, _POLY_MESH)
+        if os.path.isdir(dest):
+            shutil.rmtree(dest)
+        for dir_path, _, file_names in os.walk(entry):
+            dest_dir = os.path.join(dest, os.path.relpath(dir_path, entry))
+            if not os.path.isdir(dest_dir):
+                os.makedirs(dest_dir)
+            for file_name in file_names:
+                src = os.path.join(dir_path, file_name)
+                dst = os.path.join(dest_dir, file_name)
+                if self.link:
+                    try:
+                        os.link(src, dst)
+                        continue
+                    except OSError:
+                        pass
+                shutil.copyfile(src, dst)
+
+        # Mark the entry as recently used.
+        os.utime(entry, None)
+        return True
+
+    def store(self, case, key=None):
+        """Store a case's ``constant/polyMesh`` in the cache.
+
+        Args:
+            case (firefish.case.Case): the case whose mesh should be stored
+            key (str): cache key. If None, it is computed from *case*.
+
+        Returns:
+            The key the mesh was stored under.
+
+        Raises:
+            IOError: if the case has no polyMesh
+
+        """
+        if key is None:
+            key = self.key(case)
+        src = os.path.join(case.root_dir_path, _POLY_MESH)
+        if not os.path.isdir(src):
+            raise IOError('No polyMesh in case: {}'.format(case.root_dir_path))
+        if self.contains(key):
+            return key
+
+        # Copy into a temporary directory and rename so that a partially
+        # written entry is never visible.
+        tmp_dir = tempfile.mkdtemp(prefix='.tmp-', dir=self.cache_dir)
+        tmp_entry = os.path.join(tmp_dir, 'polyMesh')
+        shutil.copytree(src, tmp_entry)
+        for dir_path, _, file_names in os.walk(tmp_entry):
+            for file_name in file_names:
+                os.chmod(os.path.join(dir_path, file_name),
+                         stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        try:
+            os.rename(tmp_entry, self._entry_path(key))
+        except OSError:
+            # Another process stored the same mesh first.
+            shutil.rmtree(tmp_entry)
+        os.rmdir(tmp_dir)
+
+        self.evict()
+        return key
+
+    def size(self):
+        """Total size of the cached meshes in bytes."""
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """Remove least recently used meshes until the cache fits.
+
+        Returns:
+            A list of the evicted keys.
+
+        """
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        evicted = []
+        for key, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(self._entry_path(key))
+            total -= size
+            evicted.append(key)
+        return evicted
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def _entries(self):
+        """Yield (key, size, last used time) triples for cached meshes."""
+        for key in os.listdir(self.cache_dir):
+            path = self._entry_path(key)
+            if key.startswith('.') or not os.path.isdir(path):
+                continue
+            size = 0
+            for dir_path, _, file_names in os.walk(path):
+                size += sum(os.path.getsize(os.path.join(dir_path, n))
+                            for n in file_names)
+            yield key, size, os.stat(path).st_mtime
@@ -1,7 +1,90 @@
 """This module provides tools for building and running SnappyHexMesh
 
 """
+import collections
+import math
+import os
+import re
+import shutil
+import time
+import warnings
+
+import numpy as np
+import pandas
+
 from firefish.case import FileName
+from firefish.geometry import (
+    stl_area, stl_decimate, stl_refinement_levels, write_multi_region_surface
+)
+from firefish.spatial import TriangleBVH
+
+#: The extent and resolution of a single-block background mesh. *min_* and
+#: *max_* are the corners of the domain, *cells* the number of cells along
+#: each axis and *cell_size* the (cubic) cell edge length.
+BackgroundMesh = collections.namedtuple(
+    'BackgroundMesh', ['min_', 'max_', 'cells', 'cell_size']
+)
+
+#: A prediction of the size of a snappyHexMesh mesh. *cells* is the estimated
+#: final cell count, *memory* the estimated peak memory in bytes summed over
+#: all processes and *n_procs* the recommended number of processes.
+MeshEstimate = collections.namedtuple(
+    'MeshEstimate', ['cells', 'memory', 'n_procs']
+)
+
+class MeshSizeWarning(UserWarning):
+    """A mesh is predicted to exceed the configured snappyHexMesh limits."""
+
+#: A row of the table produced by :py:class:`SnappyLogParser`. *phase* is one
+#: of "refinement", "snapping" or "layers", *stage* names the iteration or step
+#: which produced the mesh, *cells*, *faces* and *points* give the mesh size
+#: after the stage, *seconds* is the time reported for the stage and *memory*
+#: is the most recently reported memory usage in bytes or None.
+SnappyLogRecord = collections.namedtuple(
+    'SnappyLogRecord',
+    ['phase', 'stage', 'cells', 'faces', 'points', 'seconds', 'memory']
+)
+
+# snappyHexMesh reports durations as, e.g., "Mesh refined in = 12.5 s."
+_TIMING_RE = re.compile(r'^\s*(.+?) in = ([0-9.eE+-]+) s')
+
+# Mesh sizes are reported as, e.g., "Snapped mesh : cells:1234  faces:..."
+_MESH_SIZE_RE = re.compile(
+    r'^\s*(.*?)\s*:?\s*cells:\s*(\d+)\s+faces:\s*(\d+)\s+points:\s*(\d+)'
+)
+
+# Iteration headers, e.g. "Surface refinement iteration 2"
+_ITERATION_RE = re.compile(
+    r'^\s*((?:\w+ )?(?:refinement|[Ll]ayer addition) iteration \d+)\s*$'
+)
+
+# Memory usage, e.g. "Memory usage (MB) : 312" or "mem = 312 MB"
+_MEMORY_RE = re.compile(
+    r'\bmem(?:ory)?\b[^:=(]*(?:\(([kMG]B)\))?'
+    r'\s*[:=]\s*([0-9.]+)\s*([kMG]B)?', re.IGNORECASE
+)
+_MEMORY_UNITS = {None: 1, 'KB': 1024, 'MB': 1024**2, 'GB': 1024**3}
+
+_PHASE_HEADERS = {
+    'Refinement phase': 'refinement',
+    'Morphing phase': 'snapping',
+    'Shrinking and layer addition phase': 'layers',
+    'Layer addition phase': 'layers',
+}
+
+# Timings which summarise a whole phase of meshing
+_PHASE_TIMINGS = [
+    'Read mesh', 'Mesh refined', 'Mesh snapped', 'Layers added',
+    'Finished meshing',
+]
+
+# Outward-facing blockMesh faces of a single hex block indexed by axis and
+# side (0 for the minimum face, 1 for the maximum face).
+_BLOCK_FACES = [
+    [[0, 4, 7, 3], [2, 6, 5, 1]],
+    [[1, 5, 4, 0], [3, 7, 6, 2]],
+    [[0, 3, 2, 1], [4, 5, 6, 7]],
+]
 
 
 class SnappyHexMesh(object):
@@ -35,6 +118,7 @@ class SnappyHexMesh(object):
         self.resolveFeatureAngle = 100
         self.distanceRefinements = [0.1, 0.2]
         self.distanceLevels = [4, 3]
+        #None to choose a point automatically when the dict is written
         self.locationToKeep = [0.001, 0.001, 0.0015]
         self.allowFreeStandingFaces = True
         self.nSmoothPatch = 3
@@ -64,35 +148,392 @@ class SnappyHexMesh(object):
         self.nLayerIter = 50
         self.mergeTolerance = 1e-6
         self.debug = 0
+        #per-geometry overrides of the refinement settings above, keyed by
+        #geometry name, and refinement regions not tied to any geometry
+        self.geometryRefinements = {}
+        self.refinementShapes = []
+        #parsed log of the last snappyHexMesh run
+        self.meshLog = None
+
+    def set_geometry_refinement(self, name, surface=None, edge=None,
+                                layers=None, distance=None):
+        """Override the refinement settings for a single geometry
+
+        Settings which are not given (or are None) fall back to the values
+        set on this object.
+
+        Args:
+            name: name of the geometry
+            surface: (min, max) surface refinement levels
+            edge: feature edge refinement level
+            layers: number of surface layers
+            distance: list of (distance, level) pairs for distance
+                refinement around the geometry. By default only the first
+                geometry has distance refinement. Pass an empty list to
+                disable it.
+        """
+        overrides = self.geometryRefinements.setdefault(name, {})
+        for key, value in (('surface', surface), ('edge', edge),
+                           ('layers', layers), ('distance', distance)):
+            if value is not None:
+                overrides[key] = value
+
+    def geometry_refinement(self, part):
+        """Returns the refinement settings which apply to a geometry
+
+        Args:
+            part (firefish.geometry.Geometry): one of this object's geometries
+
+        Returns:
+            A dict with keys 'surface', 'edge', 'layers' and 'distance' as
+            described in :py:meth:`set_geometry_refinement`.
+        """
+        refinement = {
+            'surface': (self.refinementSurfaceMin, self.refinementSurfaceMax),
+            'edge': self.edgeRefinementLevel,
+            'layers': self.nSurfaceLayers,
+            'distance': [],
+        }
+        if part is self.geometries[0]:
+            refinement['distance'] = list(zip(self.distanceRefinements,
+                                              self.distanceLevels))
+        refinement.update(self.geometryRefinements.get(part.name, {}))
+        return refinement
+
+    def auto_refinement(self, angular_resolution=10, cell_size=None,
+                        max_level=10, feature_angle=30):
+        """Chooses per-geometry refinement levels from surface curvature
+
+        For each geometry, the surface refinement levels and feature edge level
+        are chosen by :py:func:`firefish.geometry.stl_refinement_levels` so
+        that curved surfaces are resolved to *angular_resolution* degrees per
+        cell. The levels are set via :py:meth:`set_geometry_refinement`. Edges
+        where the surface turns by more than *feature_angle* degrees are
+        treated as features rather than curvature.
+
+        Args:
+            angular_resolution: wanted angle in degrees per cell
+            cell_size: background cell size. If None, it is read from the
+                case's blockMeshDict.
+            max_level: upper bound on the chosen levels
+            feature_angle: angle in degrees between face normals above
+                which an edge is a feature
+
+        Returns:
+            A dict mapping geometry names to (surface min, surface max, edge)
+            level triples.
+        """
+        if cell_size is None:
+            cell_size = read_background_mesh(self.case).cell_size
+
+        chosen = {}
+        for part in self.geometries:
+            min_level, max_level_, edge_level = stl_refinement_levels(
+                part.indexed(), cell_size, angular_resolution,
+                feature_angle=feature_angle, max_level=max_level
+            )
+            self.set_geometry_refinement(part.name,
+                                         surface=(min_level, max_level_),
+                                         edge=edge_level)
+            chosen[part.name] = (min_level, max_level_, edge_level)
+        return chosen
+
+    def decimate_geometries(self, cell_fraction=0.1, background=None):
+        """Reduces the face count of each geometry to suit the mesh
+
+        Surfaces with far more faces than there are cells at the surface
+        slow down snappyHexMesh's surface searches without improving the
+        mesh. Each geometry is decimated by
+        :py:func:`firefish.geometry.stl_decimate` with a tolerance of
+        *cell_fraction* of the cell size at its finest surface refinement
+        level. The geometries are modified in place and marked as unsaved so
+        that they are written again by
+        :py:meth:`firefish.geometry.Geometry.extract_features` or
+        :py:meth:`combine_surfaces`.
+
+        Args:
+            cell_fraction: tolerance as a fraction of the surface cell size
+            background (BackgroundMesh): the background mesh. If None, it is
+                read from the case's blockMeshDict.
+
+        Returns:
+            A dict mapping geometry names to the deviation of the decimated
+            surfaces from the originals.
+        """
+        if background is None:
+            background = read_background_mesh(self.case)
+
+        deviations = {}
+        for part in self.geometries:
+            level = max(self.geometry_refinement(part)['surface'])
+            tolerance = cell_fraction * background.cell_size / 2 ** level
+            part.geom, deviations[part.name] = stl_decimate(
+                part.geom, tolerance=tolerance)
+            part.saved = False
+        return deviations
+
+    def combine_surfaces(self, name, use_openfoam=False):
+        """Writes all geometries to the case as regions of one surface
+
+        See :py:func:`firefish.geometry.write_multi_region_surface`. The
+        snappyHexMeshDict will then declare a single surface with one region
+        per geometry. Each region becomes a patch named after its geometry
+        and keeps the geometry's surface refinement levels and layers. Feature
+        edges are refined to the finest of the geometries' edge levels.
+
+        Args:
+            name: name of the surface
+            use_openfoam: extract features with the surfaceFeatureExtract tool
+        """
+        write_multi_region_surface(self.case, name, self.geometries,
+                                   use_openfoam=use_openfoam)
+
+    def add_refinement_box(self, name, min_, max_, level):
+        """Refines all cells inside an axis-aligned box
+
+        Args:
+            name: name of the region
+            min_: minimum X, Y and Z co-ordinates of the box
+            max_: maximum X, Y and Z co-ordinates of the box
+            level: refinement level inside the box
+        """
+        self.refinementShapes.append({
+            'name': name, 'level': level,
+            'geometry': {'type': 'searchableBox',
+                         'min': [float(x) for x in min_],
+                         'max': [float(x) for x in max_]}})
+
+    def add_refinement_cylinder(self, name, point1, point2, radius, level):
+        """Refines all cells inside a cylinder, e.g. to capture a wake
+
+        Args:
+            name: name of the region
+            point1: centre of one end of the cylinder
+            point2: centre of the other end of the cylinder
+            radius: radius of the cylinder
+            level: refinement level inside the cylinder
+        """
+        self.refinementShapes.append({
+            'name': name, 'level': level,
+            'geometry': {'type': 'searchableCylinder',
+                         'point1': [float(x) for x in point1],
+                         'point2': [float(x) for x in point2],
+                         'radius': float(radius)}})
     
+    def finest_level(self):
+        """Returns the finest refinement level used by any setting"""
+        levels = [0]
+        for part in self.geometries:
+            refinement = self.geometry_refinement(part)
+            levels.extend(refinement['surface'])
+            levels.append(refinement['edge'])
+            levels.extend(l for _, l in refinement['distance'])
+        levels.extend(shape['level'] for shape in self.refinementShapes)
+        return max(levels)
+
+    def check_location_in_mesh(self, point=None, background=None,
+                               clearance=None, face_tolerance=0.05):
+        """Checks that a point is a safe choice for locationInMesh
+
+        snappyHexMesh keeps the region of the mesh containing locationInMesh.
+        The point must therefore be inside the background mesh and outside
+        every geometry. It must also be clear of the surfaces, so that the
+        cell containing it is not cut by them, and of the faces of the
+        refined background mesh, on which it is ambiguous which cell
+        contains it.
+
+        Args:
+            point: the point to check. If None, *locationToKeep* is checked.
+            background (BackgroundMesh): the background mesh. If None, it is
+                read from the case's blockMeshDict.
+            clearance: minimum distance from the point to any surface. If
+                None, this is the diagonal of a cell at the finest surface
+                refinement level.
+            face_tolerance: minimum distance from the point to a face of a
+                cell at :py:meth:`finest_level` as a fraction of the cell size
+
+        Raises:
+            ValueError: if the point is not a safe choice
+        """
+        if point is None:
+            point = self.locationToKeep
+        if background is None:
+            background = read_background_mesh(self.case)
+        point = np.asarray(point, dtype=float)
+        if clearance is None:
+            clearance = self._default_clearance(background)
+
+        if np.any(point <= background.min_) or np.any(point >= background.max_):
+            raise ValueError('locationInMesh {} is outside the background '
+                             'mesh'.format(list(point)))
+
+        spacing = self._finest_spacing(background)
+        offset = np.mod((point - background.min_) / spacing, 1)
+        if np.any(np.minimum(offset, 1 - offset) < face_tolerance):
+            raise ValueError('locationInMesh {} is too close to a face of the '
+                             'refined background mesh'.format(list(point)))
+
+        bvh = TriangleBVH(self.geometries)
+        if bvh.contains(point)[0]:
+            raise ValueError('locationInMesh {} is inside a '
+                             'geometry'.format(list(point)))
+        distance = bvh.distance(point)[0]
+        if distance < clearance:
+            raise ValueError('locationInMesh {} is {:g} from a surface, closer '
+                             'than {:g}'.format(list(point), distance,
+                                                clearance))
+
+    def choose_location_in_mesh(self, background=None, n_samples=1000,
+                                clearance=None, seed=0):
+        """Chooses locationInMesh automatically
+
+        Candidate points are sampled at random in the background mesh and
+        moved to the centre of their cell at :py:meth:`finest_level`, which
+        is as far as possible from any face. Candidates inside a geometry or
+        closer than *clearance* to a surface are rejected. Of the rest, the
+        one furthest from both the surfaces and the domain boundary is chosen
+        and set as *locationToKeep*.
+
+        Args:
+            background (BackgroundMesh): the background mesh. If None, it is
+                read from the case's blockMeshDict.
+            n_samples: number of candidate points
+            clearance: as for :py:meth:`check_location_in_mesh`
+            seed: seed for the random candidate points
+
+        Returns:
+            The chosen point as a list.
+
+        Raises:
+            ValueError: if no candidate is suitable
+        """
+        if background is None:
+            background = read_background_mesh(self.case)
+        if clearance is None:
+            clearance = self._default_clearance(background)
+
+        spacing = self._finest_spacing(background)
+        samples = np.random.RandomState(seed).uniform(
+            background.min_, background.max_, (n_samples, 3))
+        candidates = background.min_ + spacing * (
+            np.floor((samples - background.min_) / spacing) + 0.5)
+
+        bvh = TriangleBVH(self.geometries)
+        distance = bvh.distance(candidates)
+        to_boundary = np.minimum(candidates - background.min_,
+                                 background.max_ - candidates).min(axis=1)
+        score = np.minimum(distance, to_boundary)
+        score[(distance < clearance) | bvh.contains(candidates)] = -np.inf
+        best = int(np.argmax(score))
+        if not np.isfinite(score[best]):
+            raise ValueError('No point in the background mesh is clear of '
+                             'the geometries')
+
+        self.locationToKeep = [float(x) for x in candidates[best]]
+        return self.locationToKeep
+
+    def _finest_spacing(self, background):
+        """Size along each axis of a cell at the finest refinement level"""
+        return (np.asarray(background.max_) - background.min_) / \
+            background.cells / 2 ** self.finest_level()
+
+    def _default_clearance(self, background):
+        """Diagonal of a cell at the finest surface refinement level"""
+        level = max(max(self.geometry_refinement(part)['surface'])
+                    for part in self.geometries)
+        return math.sqrt(3) * background.cell_size / 2 ** level
+
     def write_snappy_dict(self):
         """Writes the SHM dictionary
 
+        If *locationToKeep* is None, a point is chosen with
+        :py:meth:`choose_location_in_mesh`. Otherwise, if the case has a
+        blockMeshDict, the point is checked with
+        :py:meth:`check_location_in_mesh` before anything is written.
+
         .. note::
             This is called by SnappyHexMesh when it generates the mesh
         """
+        if self.locationToKeep is None:
+            self.choose_location_in_mesh()
+        elif os.path.isfile(os.path.join(self.case.root_dir_path,
+                                         FileName.BLOCK_MESH.value)):
+            self.check_location_in_mesh()
+
         feature_list = []
         refinement_surface_dict = {}
+        refinement_regions = {}
         layer_dict = {}
         geom_dict = {}
 
+        surfaces = collections.OrderedDict()
         for part in self.geometries:
+            if part.surfaceName is not None:
+                surfaces.setdefault(part.surfaceName, []).append(part)
+                continue
+
+            refinement = self.geometry_refinement(part)
             geom = { part.filename : {'type':'triSurfaceMesh', 'name':part.name}}
             geom_dict.update(geom)
 
             """edge refinement for where the snapped mesh intersects with the block mesh""" 
             file_dict = {'file' : '"{}.eMesh"'.format(part.name),
-                        'level' : self.edgeRefinementLevel}
+                        'level' : refinement['edge']}
             feature_list.append(file_dict)
             
             """surface refinement levels""" 
             refinement_surface = {part.name : {
-                                 'level' : [self.refinementSurfaceMin, self.refinementSurfaceMax]}}
+                                 'level' : list(refinement['surface'])}}
             refinement_surface_dict.update(refinement_surface)
 
-            layer = {part.name : {'nSurfaceLayers' : self.nSurfaceLayers}}
+            layer = {part.name : {'nSurfaceLayers' : refinement['layers']}}
             layer_dict.update(layer)
 
+            """distance refinement around the surface"""
+            if refinement['distance']:
+                refinement_regions[part.name] = {
+                    'mode' : 'distance',
+                    'levels' : [[(d, l)] for d, l in refinement['distance']]}
+
+        """geometries written as regions of a shared surface, each region
+        becoming a patch named after its geometry"""
+        for surface, parts in surfaces.items():
+            refinements = [self.geometry_refinement(p) for p in parts]
+            geom_dict['{}.stl'.format(surface)] = {
+                'type' : 'triSurfaceMesh', 'name' : surface,
+                'regions' : dict((p.name, {'name' : p.name}) for p in parts)}
+
+            feature_list.append({
+                'file' : '"{}.eMesh"'.format(surface),
+                'level' : max(r['edge'] for r in refinements)})
+
+            refinement_surface_dict[surface] = {
+                'level' : [min(r['surface'][0] for r in refinements),
+                           min(r['surface'][1] for r in refinements)],
+                'regions' : dict(
+                    (p.name, {'level' : list(r['surface'])})
+                    for p, r in zip(parts, refinements))}
+
+            for p, r in zip(parts, refinements):
+                layer_dict[p.name] = {'nSurfaceLayers' : r['layers']}
+
+            # Distance refinement applies to the whole surface, using the
+            # furthest distance requested by any region for each level.
+            bands = {}
+            for r in refinements:
+                for d, l in r['distance']:
+                    bands[l] = max(bands.get(l, 0), d)
+            if bands:
+                refinement_regions[surface] = {
+                    'mode' : 'distance',
+                    'levels' : [[(bands[l], l)]
+                                for l in sorted(bands, reverse=True)]}
+
+        for shape in self.refinementShapes:
+            geom_dict[shape['name']] = shape['geometry']
+            refinement_regions[shape['name']] = {
+                'mode' : 'inside', 'levels' : [[(1e15, shape['level'])]]}
+
         snappy_dict = {
             'debug': self.debug,
             'castellatedMesh' : self.castellate,
@@ -108,11 +549,7 @@ class SnappyHexMesh(object):
                 'features' : feature_list,
                 'refinementSurfaces': refinement_surface_dict,
                 'resolveFeatureAngle' : self.resolveFeatureAngle,
-                'refinementRegions' : {self.geometries[0].name :
-                                       {'mode' : 'distance',
-                                        'levels' :([[(self.distanceRefinements[x],\
-                                                      self.distanceLevels[x])] for x in\
-                                                    range(len(self.distanceRefinements))])}},
+                'refinementRegions' : refinement_regions,
                 'locationInMesh' : self.locationToKeep,
                 'allowFreeStandingZoneFaces' : self.allowFreeStandingFaces
                 },
@@ -156,19 +593,486 @@ class SnappyHexMesh(object):
         with self.case.mutable_data_file(FileName.SNAPPY_HEX_MESH) as d:
             d.update(snappy_dict)
 
-    def generate_mesh(self):
+    def generate_mesh(self, n_procs=1, progress=None, cache=None):
         """Generates the mesh
 
         .. note::
 
-            This extracts surface features, writes the main SHM dict, a mesh quality dict and then
-            runs SHM.
+            This writes the main SHM dict and a mesh quality dict and then
+            runs SHM with the "-overwrite" flag so that the final mesh is
+            written to ``constant/polyMesh``.
             We assume that an underlying block mesh has already been produced
+
+        If *n_procs* is greater than one, the background mesh is decomposed
+        with decomposePar, SHM is run over *n_procs* MPI processes and the
+        mesh is reassembled with reconstructParMesh. The decomposeParDict's
+        numberOfSubdomains is set to *n_procs* and, if no decomposition method
+        has been set, the scotch method is used. The processor directories are
+        removed once the mesh has been reconstructed.
+
+        The SHM log is parsed as it runs by a :py:class:`SnappyLogParser`
+        which is kept as the *meshLog* attribute.
+
+        If a *cache* is given and it holds a mesh generated from identical
+        surfaces and dicts, that mesh is restored instead of running SHM.
+        Otherwise the generated mesh is added to the cache.
+
+        Args:
+            n_procs (int): number of processes to run SHM over
+            progress (callable): if not None, called with the name and
+                duration in seconds of each stage as soon as it completes
+            cache (firefish.meshcache.MeshCache): cache of generated meshes
+
+        Returns:
+            An ordered dict mapping stage names to durations in seconds.
         """
         self.geometries[0].meshSettings.write_settings(self.case)
         self.write_snappy_dict()
-        #self.case.run_tool('snappyHexMesh')
+
+        timings = collections.OrderedDict()
+        def record(stage, seconds):
+            timings[stage] = seconds
+            if progress is not None:
+                progress(stage, seconds)
+
+        self.meshLog = SnappyLogParser(timing_callback=record)
+        on_line = self.meshLog.parse_line
+
+        def run_timed(tool_name, flags='', procs=1, line_callback=None):
+            start = time.time()
+            self.case.run_tool(tool_name, flags, n_procs=procs,
+                               line_callback=line_callback)
+            record(tool_name, time.time() - start)
+
+        if cache is not None:
+            start = time.time()
+            key = cache.key(self.case)
+            if cache.restore(self.case, key):
+                record('meshCache', time.time() - start)
+                return timings
+
+        if n_procs > 1:
+            with self.case.mutable_data_file(FileName.DECOMPOSE) as d:
+                d['numberOfSubdomains'] = n_procs
+                if 'method' not in d:
+                    d['method'] = 'scotch'
+            run_timed('decomposePar', '-force')
+            run_timed('snappyHexMesh', '-overwrite', n_procs, on_line)
+            run_timed('reconstructParMesh', '-constant')
+            for entry in os.listdir(self.case.root_dir_path):
+                if entry.startswith('processor'):
+                    shutil.rmtree(os.path.join(self.case.root_dir_path, entry))
+        else:
+            run_timed('snappyHexMesh', '-overwrite', line_callback=on_line)
+
+        if cache is not None:
+            cache.store(self.case, key)
+
+        return timings
+
+    def estimate_mesh(self, background=None, n_procs=None,
+                      cells_per_process=250000, bytes_per_cell=2000,
+                      memory_limit=None):
+        """Predict the size of the mesh before running snappyHexMesh.
+
+        The estimate treats the region refined to at least each level as a
+        shell around the geometry whose volume follows Steiner's formula for
+        a convex body with the geometry's surface area. The shell thickness for
+        a level is the larger of the *nCellsBetweenLevels* buffers needed to
+        grade down from the geometry's surface refinement level and any
+        distance refinement band at that level or above. Refinement boxes and
+        cylinders contribute their whole volume at their level. The remaining
+        domain is filled with background cells. The estimate is intended to catch order of
+        magnitude problems and not to be exact.
+
+        Peak memory is estimated as *bytes_per_cell* per cell plus a copy of
+        every surface on each process.
+
+        A :py:class:`MeshSizeWarning` is issued if the predicted cell count
+        exceeds *maxGlobalCells*, if the cells per process exceed
+        *maxLocalCells* or if the memory exceeds *memory_limit*.
+
+        Args:
+            background (BackgroundMesh): the background mesh. If None, it is
+                read from the case's blockMeshDict.
+            n_procs (int): number of processes which will be used. If None,
+                the recommended number is assumed.
+            cells_per_process (int): target number of cells per process used
+                to recommend a process count
+            bytes_per_cell (int): estimated peak memory per cell in bytes
+            memory_limit (int): memory available in bytes, if known
+
+        Returns:
+            A :py:class:`MeshEstimate`.
+
+        """
+        if background is None:
+            background = read_background_mesh(self.case)
+
+        h0 = background.cell_size
+        cell_volumes = (h0 / 2.0 ** np.arange(64)) ** 3
+
+        # For each geometry, find the distance from the surface within which
+        # cells are refined to at least each level.
+        levels_volume = {}
+        for part in self.geometries:
+            refinement = self.geometry_refinement(part)
+            area = stl_area(part.geom)
+            surface_level = refinement['surface'][1]
+            bands = refinement['distance']
+            max_level = max([surface_level] + [l for _, l in bands])
+
+            thicknesses = np.zeros(max_level + 2)
+            for level in range(max_level, 0, -1):
+                buffer_width = self.nCellsBetweenLevels * h0 / 2.0 ** level
+                band = max([d for d, l in bands if l >= level] + [0])
+                thicknesses[level] = max(
+                    thicknesses[level + 1] + buffer_width,
+                    band + buffer_width if band > 0 else 0
+                )
+            for level in range(1, max_level + 1):
+                volume = (_shell_volume(area, thicknesses[level]) -
+                          _shell_volume(area, thicknesses[level + 1]))
+                levels_volume[level] = levels_volume.get(level, 0) + volume
+
+        # Refinement shapes are assumed not to overlap anything else.
+        for shape in self.refinementShapes:
+            geometry = shape['geometry']
+            if geometry['type'] == 'searchableBox':
+                volume = np.prod(np.subtract(geometry['max'], geometry['min']))
+            else:
+                volume = math.pi * geometry['radius'] ** 2 * np.linalg.norm(
+                    np.subtract(geometry['point2'], geometry['point1']))
+            levels_volume[shape['level']] = \
+                levels_volume.get(shape['level'], 0) + float(volume)
+
+        refined_volume = sum(levels_volume.values())
+        domain_volume = float(np.prod(background.max_ - background.min_))
+        cells = max(domain_volume - refined_volume, 0) / cell_volumes[0]
+        for level, volume in levels_volume.items():
+            cells += volume / cell_volumes[level]
+        cells = int(math.ceil(cells))
+
+        recommended_procs = int(max(
+            math.ceil(cells / float(cells_per_process)),
+            math.ceil(cells / float(self.maxLocalCells)), 1
+        ))
+        if n_procs is None:
+            n_procs = recommended_procs
+
+        # Each triangle of each surface is held in memory on every process
+        # along with its search tree.
+        n_triangles = sum(len(part.geom.data) for part in self.geometries)
+        memory = cells * bytes_per_cell + n_procs * n_triangles * 250
+
+        if cells > self.maxGlobalCells:
+            warnings.warn(
+                'Estimated {} cells exceeds maxGlobalCells ({})'.format(
+                    cells, self.maxGlobalCells), MeshSizeWarning
+            )
+        if cells / float(n_procs) > self.maxLocalCells:
+            warnings.warn(
+                'Estimated {} cells per process exceeds maxLocalCells '
+                '({})'.format(cells // n_procs, self.maxLocalCells),
+                MeshSizeWarning
+            )
+        if memory_limit is not None and memory > memory_limit:
+            warnings.warn(
+                'Estimated peak memory of {:.1f} GB exceeds limit of '
+                '{:.1f} GB'.format(memory / 1e9, memory_limit / 1e9),
+                MeshSizeWarning
+            )
+
+        return MeshEstimate(cells, memory, recommended_procs)
 
     def add_mesh_features(self, file_list):
         """test function which runs add_features in order to write the surfaceFeatureExtractDict"""
         self.geom.add_features(file_list)
+
+class SnappyLogParser(object):
+    """Incrementally parses a snappyHexMesh log.
+
+    Each time the log reports the size of the mesh (e.g. after a refinement
+    iteration, after snapping and after adding layers) a
+    :py:class:`SnappyLogRecord` is added to *records*. The record's time is
+    the sum of the times reported since the previous record. Phase timings
+    such as "Mesh refined in = 12.5 s." are collected in *phaseTimings*.
+
+    The parser may be fed whole lines via :py:meth:`parse_line` (e.g. as the
+    *line_callback* of :py:meth:`firefish.case.Case.run_tool`), arbitrary
+    chunks of text via :py:meth:`feed` or may follow a log file which is still
+    being written via :py:meth:`update_from_file`.
+
+    >>> parser = SnappyLogParser()
+    >>> parser.feed('Refinement phase\\nSurface refinement iteration 0\\n'
+    ...             'Refined mesh in = 0.5 s.\\n'
+    ...             'After refinement surface refinement iteration 0 : '
+    ...             'cells:1200  faces:3900  points:1500\\n'
+    ...             'Mesh refined in = 0.75 s.\\n')
+    >>> parser.records[0].stage
+    'Surface refinement iteration 0'
+    >>> parser.records[0].cells, parser.records[0].seconds
+    (1200, 0.5)
+    >>> dict(parser.phaseTimings)
+    {'Mesh refined': 0.75}
+
+    Attributes:
+        records: list of :py:class:`SnappyLogRecord`
+        phaseTimings: ordered dict mapping phase timing names to seconds
+    """
+
+    def __init__(self, record_callback=None, timing_callback=None):
+        """Creates an empty parser
+
+        Args:
+            record_callback: if not None, called with each new record
+            timing_callback: if not None, called with the name and duration
+                in seconds of each phase as soon as it is reported
+        """
+        self.records = []
+        self.phaseTimings = collections.OrderedDict()
+        self.record_callback = record_callback
+        self.timing_callback = timing_callback
+        self._phase = None
+        self._stage = None
+        self._seconds = 0.0
+        self._memory = None
+        self._partial = ''
+        self._file_offset = 0
+
+    @classmethod
+    def parse_file(cls, path):
+        """Parses a complete log file
+
+        Args:
+            path: path to the log file
+
+        Returns:
+            A new :py:class:`SnappyLogParser`.
+        """
+        parser = cls()
+        parser.update_from_file(path)
+        parser.flush()
+        return parser
+
+    def feed(self, text):
+        """Parses a chunk of log text which need not end on a line boundary"""
+        lines = (self._partial + text).split('\n')
+        self._partial = lines.pop()
+        for line in lines:
+            self.parse_line(line)
+
+    def flush(self):
+        """Parses any incomplete final line passed to :py:meth:`feed`"""
+        if self._partial:
+            self.parse_line(self._partial)
+            self._partial = ''
+
+    def update_from_file(self, path):
+        """Parses any text appended to a log file since the last call
+
+        Args:
+            path: path to the log file
+        """
+        with open(path, 'rb') as log_file:
+            log_file.seek(self._file_offset)
+            data = log_file.read()
+        self._file_offset += len(data)
+        self.feed(data.decode('utf-8', 'replace'))
+
+    def parse_line(self, line):
+        """Parses a single line of the log"""
+        line = line.rstrip()
+        stripped = line.strip()
+
+        if stripped in _PHASE_HEADERS:
+            self._phase = _PHASE_HEADERS[stripped]
+            self._stage = None
+            return
+
+        match = _ITERATION_RE.match(line)
+        if match:
+            self._stage = match.group(1)
+            return
+
+        match = _TIMING_RE.match(line)
+        if match:
+            name, seconds = match.group(1), float(match.group(2))
+            if name in _PHASE_TIMINGS:
+                self.phaseTimings[name] = seconds
+                if self.timing_callback is not None:
+                    self.timing_callback(name, seconds)
+            else:
+                self._seconds += seconds
+            return
+
+        match = _MESH_SIZE_RE.match(line)
+        if match:
+            stage = self._stage or match.group(1) or self._phase
+            record = SnappyLogRecord(
+                self._phase, stage, int(match.group(2)), int(match.group(3)),
+                int(match.group(4)), self._seconds, self._memory
+            )
+            self.records.append(record)
+            self._seconds = 0.0
+            self._stage = None
+            if self.record_callback is not None:
+                self.record_callback(record)
+            return
+
+        match = _MEMORY_RE.search(line)
+        if match:
+            unit = match.group(1) or match.group(3)
+            if unit is not None:
+                unit = unit.upper()
+            self._memory = int(float(match.group(2)) * _MEMORY_UNITS[unit])
+
+    def table(self):
+        """The records as a :py:class:`pandas.DataFrame`"""
+        return pandas.DataFrame.from_records(
+            self.records, columns=SnappyLogRecord._fields
+        )
+
+def read_background_mesh(case):
+    """Read the extent and resolution of a case's background mesh.
+
+    The blockMeshDict is assumed to contain a single uniformly graded hex
+    block as written by :py:func:`write_background_mesh`. If the cells are not
+    cubic, the returned cell size is that of a cube of equal volume.
+
+    Args:
+        case (firefish.case.Case): the case to read blockMeshDict from
+
+    Returns:
+        A :py:class:`BackgroundMesh`.
+
+    """
+    block_mesh_dict = case.read_data_file(FileName.BLOCK_MESH)
+    scale = float(block_mesh_dict.get(
+        'convertToMeters', block_mesh_dict.get('scale', 1)
+    ))
+    vertices = scale * np.array(
+        [[float(x) for x in v] for v in block_mesh_dict['vertices']]
+    )
+    cells = np.array([int(n) for n in block_mesh_dict['blocks'][2]])
+    min_, max_ = vertices.min(axis=0), vertices.max(axis=0)
+    cell_size = float(np.prod((max_ - min_) / cells)) ** (1.0 / 3.0)
+    return BackgroundMesh(min_, max_, cells, cell_size)
+
+def write_background_mesh(case, geometries, cell_size=None, upstream=1.0,
+                          downstream=3.0, lateral=1.0,
+                          flow_direction=(1, 0, 0), snappy=None,
+                          surface_cell_size=None):
+    """Write a blockMeshDict for a background mesh sized to some geometry.
+
+    The domain is the bounding box of *geometries* extended by *upstream*
+    against the flow, *downstream* along the flow and *lateral* in the other
+    directions. Cells are cubes of side *cell_size*; the domain is grown
+    symmetrically along each axis to a whole number of cells.
+
+    Rather than specifying *cell_size* directly, a *snappy* object and the
+    wanted *surface_cell_size* may be given. The background cell size is then
+    chosen so that *snappy*'s maximum surface refinement level produces cells
+    of *surface_cell_size* at the surface.
+
+    The upstream face is written as a patch named ``inlet``, the downstream
+    face as ``outlet`` and the remaining faces as a wall named
+    ``fixedWalls``. blockMesh must be run separately.
+
+    Args:
+        case (firefish.case.Case): the case to write blockMeshDict in
+        geometries [(firefish.geometry.Geometry)]: geometries to enclose
+        cell_size (float): background cell size
+        upstream (float): distance from the geometry to the inlet
+        downstream (float): distance from the geometry to the outlet
+        lateral (float): distance from the geometry to the other faces
+        flow_direction (array like): axis-aligned free stream direction,
+            e.g. ``(0, -1, 0)`` for flow along -Y
+        snappy (firefish.meshsnappy.SnappyHexMesh): refinement settings
+        surface_cell_size (float): wanted cell size at the surface
+
+    Returns:
+        A :py:class:`BackgroundMesh` describing the written mesh.
+
+    Raises:
+        ValueError: if the flow direction is not along an axis or neither a
+            cell size nor a surface cell size and snappy object were given.
+
+    """
+    if cell_size is None:
+        if snappy is None or surface_cell_size is None:
+            raise ValueError(
+                'Specify cell_size or both snappy and surface_cell_size'
+            )
+        cell_size = surface_cell_size * 2 ** snappy.refinementSurfaceMax
+
+    flow_direction = np.asarray(flow_direction, dtype=float)
+    if np.count_nonzero(flow_direction) != 1:
+        raise ValueError('Flow direction must be along an axis')
+    flow_axis = int(np.argmax(np.abs(flow_direction)))
+    inlet_side = 0 if flow_direction[flow_axis] > 0 else 1
+
+    margin_min = np.ones(3) * lateral
+    margin_max = np.ones(3) * lateral
+    if inlet_side == 0:
+        margin_min[flow_axis], margin_max[flow_axis] = upstream, downstream
+    else:
+        margin_min[flow_axis], margin_max[flow_axis] = downstream, upstream
+
+    bounds = [g.bounds() for g in geometries]
+    min_ = np.min([b[0] for b in bounds], axis=0).astype(float) - margin_min
+    max_ = np.max([b[1] for b in bounds], axis=0).astype(float) + margin_max
+
+    cells = np.ceil((max_ - min_) / cell_size - 1e-9).astype(int)
+    padding = 0.5 * (cells * cell_size - (max_ - min_))
+    min_, max_ = min_ - padding, max_ + padding
+
+    vertices = [
+        [float(x), float(y), float(z)] for z in (min_[2], max_[2])
+        for x, y in ((min_[0], min_[1]), (max_[0], min_[1]),
+                     (max_[0], max_[1]), (min_[0], max_[1]))
+    ]
+
+    walls = [_BLOCK_FACES[axis][side] for axis in range(3) for side in (0, 1)
+             if axis != flow_axis]
+    block_mesh_dict = {
+        'convertToMeters': 1,
+        'vertices': vertices,
+        'blocks': [
+            (
+                'hex', [0, 1, 2, 3, 4, 5, 6, 7], [int(n) for n in cells],
+                'simpleGrading', [1, 1, 1],
+            )
+        ],
+        'edges': [],
+        'boundary': [
+            ('inlet', {
+                'type': 'patch',
+                'faces': [_BLOCK_FACES[flow_axis][inlet_side]],
+            }),
+            ('outlet', {
+                'type': 'patch',
+                'faces': [_BLOCK_FACES[flow_axis][1 - inlet_side]],
+            }),
+            ('fixedWalls', {
+                'type': 'wall',
+                'faces': walls,
+            }),
+        ],
+        'mergePatchPairs': [],
+    }
+
+    with case.mutable_data_file(FileName.BLOCK_MESH) as d:
+        d.update(block_mesh_dict)
+
+    return BackgroundMesh(min_, max_, cells, cell_size)
+
+def _shell_volume(area, thickness):
+    """Volume within *thickness* of a convex surface of the given area.
+
+    This is Steiner's formula with the mean curvature term of a sphere of
+    equal area.
+
+    """
+    return (area * thickness + math.sqrt(4 * math.pi * area) * thickness ** 2 +
+            4.0 / 3.0 * math.pi * thickness ** 3)
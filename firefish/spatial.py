@@ -0,0 +1,566 @@
+"""
+This module provides spatial queries against triangulated surfaces.
+
+A :py:class:`TriangleBVH` is a bounding volume hierarchy over the triangles of
+one or more geometries. It answers batched queries for many points at once:
+the distance to the surface, whether points are inside the solid bounded by
+the surface and the signed distance which combines the two.
+
+The hierarchy is stored in flat numpy arrays rather than as a tree of Python
+objects. It is a complete binary tree: the triangles are sorted so that each
+node covers a contiguous range of them, node *i* has children *2i + 1* and
+*2i + 2* and all leaves are at the same depth. Queries walk the tree for all
+points together, one level at a time, discarding nodes which cannot affect
+the result.
+
+:py:func:`signed_distance_grid` samples the signed distance to some
+geometries at the points of a regular grid.
+
+"""
+import multiprocessing
+
+import numpy as np
+
+from firefish.geometry import Geometry, IndexedMesh
+
+# Directions of the rays cast by TriangleBVH.contains. They are chosen to be
+# unlikely to run exactly along an edge or through a vertex of a surface
+# built on a regular grid.
+_RAY_DIRECTIONS = np.array([
+    [0.5773, 0.5775, 0.5771],
+    [-0.7071, 0.0103, 0.7070],
+    [0.0211, -0.8944, -0.4468],
+])
+
+def _triangles(geom):
+    """The (F, 3, 3) float64 triangle vertices of a geometry."""
+    if isinstance(geom, Geometry):
+        geom = geom.geom
+    if isinstance(geom, IndexedMesh):
+        return np.asarray(geom.vertices, dtype=np.float64)[geom.faces]
+    return np.asarray(geom.vectors, dtype=np.float64)
+
+def _dot(a, b):
+    return np.einsum('...i,...i->...', a, b)
+
+def _closest_points_on_triangles(p, a, b, c):
+    """The closest point to each point *p* on the triangle (a, b, c).
+
+    This is a vectorised form of the region tests in Ericson, "Real-Time
+    Collision Detection", section 5.1.5. All arguments are arrays of the same
+    shape (..., 3).
+
+    """
+    ab, ac = b - a, c - a
+    ap, bp, cp = p - a, p - b, p - c
+    d1, d2 = _dot(ab, ap), _dot(ac, ap)
+    d3, d4 = _dot(ab, bp), _dot(ac, bp)
+    d5, d6 = _dot(ab, cp), _dot(ac, cp)
+    va = d3 * d6 - d5 * d4
+    vb = d5 * d2 - d1 * d6
+    vc = d1 * d4 - d3 * d2
+
+    def ratio(num, den):
+        safe = np.where(den == 0, 1, den)
+        return np.where(den == 0, 0, num / safe)[..., np.newaxis]
+
+    # Later assignments take precedence, so regions are applied in the
+    # reverse of the order in which Ericson tests them.
+    denom = va + vb + vc
+    result = a + ab * ratio(vb, denom) + ac * ratio(vc, denom)
+    regions = [
+        ((va <= 0) & (d4 - d3 >= 0) & (d5 - d6 >= 0),
+         lambda: b + (c - b) * ratio(d4 - d3, (d4 - d3) + (d5 - d6))),
+        ((vb <= 0) & (d2 >= 0) & (d6 <= 0), lambda: a + ac * ratio(d2, d2 - d6)),
+        ((d6 >= 0) & (d5 <= d6), lambda: c),
+        ((vc <= 0) & (d1 >= 0) & (d3 <= 0), lambda: a + ab * ratio(d1, d1 - d3)),
+        ((d3 >= 0) & (d4 <= d3), lambda: b),
+        ((d1 <= 0) & (d2 <= 0), lambda: a),
+    ]
+    for mask, point in regions:
+        result = np.where(mask[..., np.newaxis], point(), result)
+    return result
+
+def _box_distance_sq(points, box_min, box_max):
+    """Squared distance from each point to the corresponding box."""
+    gap = np.maximum(np.maximum(box_min - points, points - box_max), 0)
+    return _dot(gap, gap)
+
+def _box_minmax_distance_sq(points, box_min, box_max):
+    """Squared upper bound on the distance from each point to the nearest
+    triangle in the corresponding box.
+
+    Every face of a box which tightly bounds some triangles touches one of
+    them, so the nearest triangle is no further away than the far corners of
+    the nearest face (Roussopoulos et al., "Nearest Neighbor Queries", 1995).
+
+    """
+    mid = 0.5 * (box_min + box_max)
+    near_sq = (points - np.where(points <= mid, box_min, box_max)) ** 2
+    far_sq = (points - np.where(points >= mid, box_min, box_max)) ** 2
+    return (far_sq.sum(axis=1)[:, np.newaxis] - far_sq + near_sq).min(axis=1)
+
+class TriangleBVH(object):
+    """A bounding volume hierarchy over the triangles of some geometries.
+
+    >>> tetrahedron = IndexedMesh(
+    ...     np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1]]),
+    ...     np.array([[0, 2, 1], [0, 1, 3], [0, 3, 2], [1, 2, 3]]))
+    >>> bvh = TriangleBVH(tetrahedron)
+    >>> bvh.contains([[0.1, 0.1, 0.1], [2, 0, 0]])
+    array([ True, False])
+    >>> bvh.signed_distance([[0.1, 0.1, 0.1], [2, 0, 0]])
+    array([-0.1,  1. ])
+
+    Attributes:
+        triangles: (F, 3, 3) array of the triangles in tree order
+        face_ids: index of each triangle of *triangles* in the concatenated
+            triangles of the geometries
+        part_ids: index of the geometry each triangle of *triangles* came from
+        depth (int): depth of the leaves. The root is at depth zero.
+        leaf_faces: (L, M) array giving the indices into *triangles* of the
+            triangles in each leaf, padded with -1
+        node_min: (N, 3) array of the minimum corner of each node's bounds
+        node_max: (N, 3) array of the maximum corner of each node's bounds
+
+    """
+
+    def __init__(self, geoms, leaf_size=8):
+        """Builds the hierarchy.
+
+        Args:
+            geoms: a :py:class:`stl.mesh.Mesh`,
+                :py:class:`firefish.geometry.IndexedMesh` or
+                :py:class:`firefish.geometry.Geometry` or a list of them
+            leaf_size (int): maximum number of triangles in each leaf
+
+        """
+        if isinstance(geoms, IndexedMesh) or \
+                not isinstance(geoms, (list, tuple)):
+            geoms = [geoms]
+        parts = [_triangles(g) for g in geoms]
+        triangles = np.concatenate(parts) if parts else np.zeros((0, 3, 3))
+        part_ids = np.repeat(np.arange(len(parts)), [len(p) for p in parts])
+        n = len(triangles)
+        if n == 0:
+            raise ValueError('Cannot build a hierarchy without triangles')
+
+        leaf_size = max(int(leaf_size), 1)
+        depth = 0
+        while n > leaf_size * 2 ** depth:
+            depth += 1
+
+        # Sort the triangles level by level. At each level every node's range
+        # is sorted along the longest axis of its triangles' centroids so
+        # that its children take the lower and upper halves.
+        centroids = triangles.mean(axis=1)
+        order = np.arange(n)
+        for level in range(depth):
+            bounds = _level_bounds(n, level)
+            segments = np.repeat(np.arange(2 ** level), np.diff(bounds))
+            starts = bounds[:-1][np.diff(bounds) > 0]
+            c = centroids[order]
+            extent = np.maximum.reduceat(c, starts) - \
+                np.minimum.reduceat(c, starts)
+            axes = np.zeros(2 ** level, dtype=int)
+            axes[segments[starts]] = np.argmax(extent, axis=1)
+            keys = c[np.arange(n), axes[segments]]
+            order = order[np.lexsort((keys, segments))]
+
+        self.triangles = triangles[order]
+        self.face_ids = order
+        self.part_ids = part_ids[order]
+        self.depth = depth
+
+        bounds = _level_bounds(n, depth)
+        sizes = np.diff(bounds)
+        slots = np.arange(sizes.max())
+        self.leaf_faces = np.where(slots < sizes[:, np.newaxis],
+                                   bounds[:-1, np.newaxis] + slots, -1)
+
+        # Per-triangle data for the distance tests: the edges, the inverse of
+        # their squared lengths, in-plane normals to the edges pointing into
+        # the triangle and the unit normal. The edge normals of degenerate
+        # triangles are NaN so that no point is ever found inside them.
+        verts = self.triangles
+        edges = np.roll(verts, -1, axis=1) - verts
+        lengths_sq = _dot(edges, edges)
+        self._edges = edges
+        self._edge_scale = np.where(lengths_sq > 0, 1 / np.where(
+            lengths_sq > 0, lengths_sq, 1), 0)
+        normals = np.cross(edges[:, 0], -edges[:, 2])
+        norms = np.sqrt(_dot(normals, normals))
+        degenerate = norms == 0
+        self._normals = normals / np.where(degenerate, 1, norms)[:, np.newaxis]
+        self._edge_normals = np.cross(self._normals[:, np.newaxis], edges)
+        self._edge_normals[degenerate] = np.nan
+
+        # Bounds of the leaves and then of each level above them.
+        tri_min = self.triangles.min(axis=1)
+        tri_max = self.triangles.max(axis=1)
+        valid = (self.leaf_faces >= 0)[..., np.newaxis]
+        leaf_min = np.where(valid, tri_min[self.leaf_faces], np.inf).min(axis=1)
+        leaf_max = np.where(valid, tri_max[self.leaf_faces], -np.inf).max(axis=1)
+
+        n_nodes = 2 ** (depth + 1) - 1
+        self.node_min = np.empty((n_nodes, 3))
+        self.node_max = np.empty((n_nodes, 3))
+        first_leaf = 2 ** depth - 1
+        self.node_min[first_leaf:] = leaf_min
+        self.node_max[first_leaf:] = leaf_max
+        for level in range(depth - 1, -1, -1):
+            nodes = np.arange(2 ** level - 1, 2 ** (level + 1) - 1)
+            self.node_min[nodes] = np.minimum(self.node_min[2 * nodes + 1],
+                                              self.node_min[2 * nodes + 2])
+            self.node_max[nodes] = np.maximum(self.node_max[2 * nodes + 1],
+                                              self.node_max[2 * nodes + 2])
+
+    def distance(self, points, return_closest=False, chunk_size=65536):
+        """Computes the distance from each point to the nearest triangle.
+
+        Args:
+            points: (P, 3) array of points
+            return_closest (bool): also return the closest points and faces
+            chunk_size (int): number of points to query at once. This bounds
+                the memory used.
+
+        Returns:
+            A (P,) array of distances. If *return_closest* is True, a triple
+            of the distances, the (P, 3) closest points on the surface and
+            the index of the closest face in the concatenated triangles of
+            the geometries.
+
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        distances = np.empty(len(points))
+        closest = np.empty((len(points), 3))
+        faces = np.empty(len(points), dtype=np.int64)
+        for start in range(0, len(points), chunk_size):
+            chunk = slice(start, start + chunk_size)
+            distances[chunk], closest[chunk], faces[chunk] = \
+                self._nearest(points[chunk])
+        if return_closest:
+            return distances, closest, self.face_ids[faces]
+        return distances
+
+    def ray_crossings(self, points, direction, chunk_size=65536):
+        """Counts the triangles crossed by a ray from each point.
+
+        Args:
+            points: (P, 3) array of ray origins
+            direction: direction of the rays. No component may be zero.
+            chunk_size (int): number of points to query at once
+
+        Returns:
+            A (P,) integer array of the number of crossings of each ray.
+
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        direction = np.asarray(direction, dtype=np.float64)
+        counts = np.empty(len(points), dtype=np.int64)
+        for start in range(0, len(points), chunk_size):
+            chunk = slice(start, start + chunk_size)
+            counts[chunk] = self._crossings(points[chunk], direction)
+        return counts
+
+    def contains(self, points, n_rays=3, chunk_size=65536):
+        """Tests whether points are inside the surface.
+
+        A point is inside a closed surface if a ray from it crosses the
+        surface an odd number of times. Rays which graze an edge or vertex
+        may be miscounted so, by default, the majority verdict of three rays
+        in different directions is taken.
+
+        Args:
+            points: (P, 3) array of points
+            n_rays (int): number of rays to cast from each point, at most 3
+            chunk_size (int): number of points to query at once
+
+        Returns:
+            A (P,) boolean array.
+
+        """
+        votes = sum(self.ray_crossings(points, d, chunk_size) % 2
+                    for d in _RAY_DIRECTIONS[:n_rays])
+        return 2 * votes > n_rays
+
+    def signed_distance(self, points, n_rays=3, chunk_size=65536):
+        """Computes the signed distance from each point to the surface.
+
+        The distance is negative inside the surface as determined by
+        :py:meth:`contains`.
+
+        Args:
+            points: (P, 3) array of points
+            n_rays (int): number of rays used to decide inside or outside
+            chunk_size (int): number of points to query at once
+
+        Returns:
+            A (P,) array of signed distances.
+
+        """
+        distances = self.distance(points, chunk_size=chunk_size)
+        inside = self.contains(points, n_rays, chunk_size)
+        return np.where(inside, -distances, distances)
+
+    def _leaf_nearest(self, points, leaves):
+        """Squared distance to and index of the nearest triangle in each leaf
+        to the corresponding point."""
+        faces = self.leaf_faces[leaves]
+        valid = np.maximum(faces, 0)
+        offsets = points[:, np.newaxis, np.newaxis, :] - self.triangles[valid]
+
+        # The nearest point is either the projection onto the plane, if that
+        # falls inside the triangle, or else the nearest point on an edge.
+        inside = (_dot(offsets, self._edge_normals[valid]) >= 0).all(axis=2)
+        plane = _dot(offsets[:, :, 0], self._normals[valid]) ** 2
+        edges = self._edges[valid]
+        t = np.clip(_dot(offsets, edges) * self._edge_scale[valid], 0, 1)
+        along = offsets - t[..., np.newaxis] * edges
+        d2 = np.where(inside, plane, _dot(along, along).min(axis=2))
+        d2[faces < 0] = np.inf
+
+        best = np.argmin(d2, axis=1)
+        rows = np.arange(len(points))
+        return d2[rows, best], faces[rows, best]
+
+    def _nearest(self, points):
+        """Find the nearest triangle to each point."""
+        first_leaf = 2 ** self.depth - 1
+
+        # Descend greedily to a leaf to find an upper bound on the distance.
+        nodes = np.zeros(len(points), dtype=np.int64)
+        for _ in range(self.depth):
+            left, right = 2 * nodes + 1, 2 * nodes + 2
+            go_right = _box_distance_sq(points, self.node_min[right],
+                                        self.node_max[right]) < \
+                _box_distance_sq(points, self.node_min[left],
+                                 self.node_max[left])
+            nodes = np.where(go_right, right, left)
+        best_d2, best_face = self._leaf_nearest(points, nodes - first_leaf)
+
+        # Find every leaf which could hold a nearer triangle, tightening the
+        # bound with each node passed on the way. The candidates stay sorted
+        # by point.
+        pts = np.arange(len(points))
+        nodes = np.zeros(len(points), dtype=np.int64)
+        bound = best_d2.copy()
+        for level in range(self.depth + 1):
+            box_min, box_max = self.node_min[nodes], self.node_max[nodes]
+            d2 = _box_distance_sq(points[pts], box_min, box_max)
+            upper = _box_minmax_distance_sq(points[pts], box_min, box_max)
+            starts = np.flatnonzero(np.diff(pts, prepend=-1))
+            np.minimum.at(bound, pts[starts],
+                          np.minimum.reduceat(upper, starts))
+            keep = d2 <= bound[pts]
+            pts, nodes, d2 = pts[keep], nodes[keep], d2[keep]
+            if level < self.depth:
+                pts = np.repeat(pts, 2)
+                nodes = np.repeat(2 * nodes, 2) + np.tile([1, 2], len(nodes))
+
+        # Visit each point's candidate leaves nearest first, in rounds, so
+        # that the improving bound discards most of the later candidates.
+        order = np.lexsort((d2, pts))
+        pts, nodes, d2 = pts[order], nodes[order], d2[order]
+        starts = np.flatnonzero(np.diff(pts, prepend=-1))
+        rank = np.arange(len(pts)) - np.repeat(starts, np.diff(
+            np.append(starts, len(pts))))
+        order = np.argsort(rank, kind='stable')
+        pts, nodes, d2 = pts[order], nodes[order], d2[order]
+        rounds = np.append(0, np.cumsum(np.bincount(rank)))
+        for start, stop in zip(rounds[:-1], rounds[1:]):
+            selected = start + np.flatnonzero(
+                d2[start:stop] < best_d2[pts[start:stop]])
+            if len(selected) == 0:
+                break
+            round_pts = pts[selected]
+            leaf_d2, faces = self._leaf_nearest(
+                points[round_pts], nodes[selected] - first_leaf)
+            better = leaf_d2 < best_d2[round_pts]
+            round_pts = round_pts[better]
+            best_d2[round_pts] = leaf_d2[better]
+            best_face[round_pts] = faces[better]
+
+        tris = self.triangles[best_face]
+        best_point = _closest_points_on_triangles(
+            points, tris[:, 0], tris[:, 1], tris[:, 2])
+        return np.sqrt(best_d2), best_point, best_face
+
+    def _crossings(self, points, direction):
+        """Count the triangles crossed by a ray from each point."""
+        inv_dir = 1.0 / direction
+        pts = np.arange(len(points))
+        nodes = np.zeros(len(points), dtype=np.int64)
+        for level in range(self.depth + 1):
+            origins = points[pts]
+            t1 = (self.node_min[nodes] - origins) * inv_dir
+            t2 = (self.node_max[nodes] - origins) * inv_dir
+            t_near = np.minimum(t1, t2).max(axis=1)
+            t_far = np.maximum(t1, t2).min(axis=1)
+            keep = t_far >= np.maximum(t_near, 0)
+            pts, nodes = pts[keep], nodes[keep]
+            if level < self.depth:
+                pts = np.repeat(pts, 2)
+                nodes = np.repeat(2 * nodes, 2) + np.tile([1, 2], len(nodes))
+
+        # Moller-Trumbore intersection against each triangle in the leaves.
+        faces = self.leaf_faces[nodes - (2 ** self.depth - 1)]
+        tris = self.triangles[np.maximum(faces, 0)]
+        origins = points[pts][:, np.newaxis, :]
+        e1 = tris[..., 1, :] - tris[..., 0, :]
+        e2 = tris[..., 2, :] - tris[..., 0, :]
+        pvec = np.cross(direction, e2)
+        det = _dot(e1, pvec)
+        valid = (faces >= 0) & (np.abs(det) > 1e-300)
+        inv_det = np.where(valid, 1.0 / np.where(valid, det, 1), 0)
+        tvec = origins - tris[..., 0, :]
+        u = _dot(tvec, pvec) * inv_det
+        qvec = np.cross(tvec, e1)
+        v = _dot(direction, qvec) * inv_det
+        t = _dot(e2, qvec) * inv_det
+        hits = valid & (u >= 0) & (v >= 0) & (u + v <= 1) & (t > 0)
+        return np.bincount(pts, hits.sum(axis=1), len(points)).astype(np.int64)
+
+def _level_bounds(n, level):
+    """Boundaries of the ranges of triangles covered by the nodes of a level.
+
+    Node *k* of the level covers ``bounds[k]:bounds[k + 1]``. Each level's
+    boundaries include those of the level above.
+
+    """
+    return (np.arange(2 ** level + 1) * n) // 2 ** level
+
+# State of a signed_distance_grid worker process. The hierarchy is sent to
+# each worker once by the pool initialiser rather than with every slab.
+_worker_state = {}
+
+def _init_grid_worker(bvh):
+    _worker_state['bvh'] = bvh
+
+def _slab_signed_distance(bvh, x, y, z, n_rays):
+    """Signed distance at the points of a grid with the given axes."""
+    points = np.stack(np.meshgrid(x, y, z, indexing='ij'), axis=-1)
+    return bvh.signed_distance(points.reshape(-1, 3), n_rays).reshape(
+        points.shape[:3])
+
+def _slab_ranges(shape, slab_points):
+    """Split a grid of *shape* into blocks of at most *slab_points* points.
+
+    Blocks are whole planes of constant X where these fit and are otherwise
+    split along Y and then Z.
+
+    Returns:
+        A list of (X, Y, Z) triples of slices.
+
+    """
+    nz = max(1, min(shape[2], slab_points))
+    ny = max(1, min(shape[1], slab_points // nz))
+    nx = max(1, slab_points // (ny * nz))
+    return [(slice(i, i + nx), slice(j, j + ny), slice(k, k + nz))
+            for i in range(0, shape[0], nx)
+            for j in range(0, shape[1], ny)
+            for k in range(0, shape[2], nz)]
+
+def _worker_slab(args):
+    return _slab_signed_distance(_worker_state['bvh'], *args)
+
+def grid_axes(min_, max_, shape):
+    """The co-ordinates of the points of a regular grid along each axis.
+
+    Args:
+        min_: (3,) minimum corner of the grid
+        max_: (3,) maximum corner of the grid
+        shape: number of points along each axis
+
+    Returns:
+        A list of three 1-d arrays of X, Y and Z co-ordinates. The first and
+        last points along each axis are at the corners of the grid.
+
+    """
+    return [np.linspace(lo, hi, n) for lo, hi, n in zip(min_, max_, shape)]
+
+def signed_distance_grid(geoms, min_, max_, shape, out=None,
+                         dtype=np.float32, slab_points=2**18, processes=None,
+                         n_rays=3):
+    """Sample the signed distance to some geometries on a regular grid.
+
+    The distance is negative inside the geometries. Element ``[i, j, k]`` of
+    the result is the signed distance at the point with co-ordinates
+    ``axes[0][i]``, ``axes[1][j]`` and ``axes[2][k]`` where *axes* is given
+    by :py:func:`grid_axes`.
+
+    The grid is processed in slabs of at most *slab_points* points so that
+    memory use other than the result is bounded. Slabs are whole planes of
+    constant X unless a plane is larger than this. If *processes* is given, slabs are
+    sampled by a pool of that many processes. Passing a file name as *out*
+    writes the result to a ``.npy`` file which is memory mapped so grids
+    larger than memory may be sampled.
+
+    >>> from firefish.geometry import IndexedMesh
+    >>> tetrahedron = IndexedMesh(
+    ...     np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1]]),
+    ...     np.array([[0, 2, 1], [0, 1, 3], [0, 3, 2], [1, 2, 3]]))
+    >>> sdf = signed_distance_grid(tetrahedron, [0.1, 0.1, 0.1], [2.1, 0.1, 0.1],
+    ...                            [3, 1, 1])
+    >>> sdf.shape
+    (3, 1, 1)
+    >>> np.round(sdf.ravel(), 2)
+    array([-0.1 ,  0.17,  1.11], dtype=float32)
+
+    Args:
+        geoms: geometries as taken by :py:class:`TriangleBVH` or a
+            :py:class:`TriangleBVH` of them
+        min_: (3,) minimum corner of the grid
+        max_: (3,) maximum corner of the grid
+        shape: number of points along each axis
+        out: array of *shape* to write the result to or the path of a
+            ``.npy`` file to create. If None, a new array is returned.
+        dtype: type of a new result
+        slab_points: greatest number of points in a slab
+        processes: number of processes to sample slabs with. If None, the
+            slabs are sampled in this process.
+        n_rays: number of rays cast to test whether points are inside as
+            for :py:meth:`TriangleBVH.contains`
+
+    Returns:
+        The array of signed distances, or a :py:class:`numpy.memmap` of
+        the file if *out* was a path.
+
+    Raises:
+        ValueError: if *out* is an array of the wrong shape
+
+    """
+    bvh = geoms if isinstance(geoms, TriangleBVH) else TriangleBVH(geoms)
+    shape = tuple(int(n) for n in shape)
+    if out is None:
+        out = np.empty(shape, dtype=dtype)
+    elif not isinstance(out, np.ndarray):
+        out = np.lib.format.open_memmap(out, mode='w+', dtype=dtype,
+                                        shape=shape)
+    elif out.shape != shape:
+        raise ValueError('Output shape {} does not match grid shape '
+                         '{}'.format(out.shape, shape))
+
+    x, y, z = grid_axes(min_, max_, shape)
+    ranges = _slab_ranges(shape, slab_points)
+    slabs = [(x[sx], y[sy], z[sz], n_rays) for sx, sy, sz in ranges]
+
+    if processes:
+        pool = multiprocessing.Pool(processes, _init_grid_worker, (bvh,))
+        try:
+            for r, values in zip(ranges, pool.imap(_worker_slab, slabs)):
+                out[r] = values
+        except:
+            # Don't wait for the remaining slabs.
+            pool.terminate()
+            pool.join()
+            raise
+        pool.close()
+        pool.join()
+    else:
+        for r, slab in zip(ranges, slabs):
+            out[r] = _slab_signed_distance(bvh, *slab)
+
+    if isinstance(out, np.memmap):
+        out.flush()
+    return out
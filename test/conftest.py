@@ -15,3 +15,8 @@ def geomdir(datadir):
 def iodir(datadir):
     """IO data directory."""
     return os.path.join(datadir, 'io')
+
+@pytest.fixture
+def meshingdir(datadir):
+    """Meshing data directory."""
+    return os.path.join(datadir, 'meshing')
@@ -12,6 +12,12 @@ def test_case_import():
 def test_geometry_import():
     import firefish.geometry
 
+def test_meshcache_import():
+    import firefish.meshcache
+
+def test_spatial_import():
+    import firefish.spatial
+
 def test_io_import():
 	import firefish.io
 
@@ -4,12 +4,13 @@ Test OpenFOAM case handling.
 """
 import os
 
+import numpy as np
 import pytest
 
 import firefish.geometry
 from firefish.case import (
     Case, CaseDoesNotExist, Dimension, FileName, FileName, read_data_file,
-    CaseToolRunFailed, CaseAlreadyExists, StandardFluid,
+    CaseToolRunFailed, CaseAlreadyExists, CaseArchiveError, StandardFluid,
     write_standard_thermophysical_properties
 )
 
@@ -87,6 +88,15 @@ def test_run_tool_needs_tool_to_succeed(tmpcase):
     with pytest.raises(CaseToolRunFailed):
         tmpcase.run_tool('blockMesh')
 
+def test_run_tool_streams_output(tmpcase):
+    """Output is passed line by line to the callback and logged."""
+    lines = []
+    log_path = tmpcase.run_tool('echo', '-x "two words"',
+                                line_callback=lines.append)
+    assert lines == ['-case {} -x two words\n'.format(tmpcase.root_dir_path)]
+    with open(log_path) as f:
+        assert f.read() == lines[0]
+
 def test_add_tri_surface(tmpcase, unit_sphere_geometry):
     assert not os.path.isfile(os.path.join(
         tmpcase.root_dir_path, 'constant', 'triSurface', 'surface.stl'
@@ -106,6 +116,36 @@ def test_add_tri_surface_will_clobber_if_asked(tmpcase, unit_sphere_geometry):
     tmpcase.add_tri_surface('surface', unit_sphere_geometry,
                             clobber_existing=True)
 
+def test_add_tri_surface_accepts_geometry(tmpcase, geomdir):
+    from firefish.geometry import Geometry, GeometryFormat, stl_load
+    geometry = Geometry(GeometryFormat.STL,
+                        os.path.join(geomdir, 'unit_sphere.stl'), 'sphere',
+                        tmpcase)
+    geometry.translate([1, 0, 0])
+    tmpcase.add_tri_surface('sphere', geometry)
+    saved = stl_load(os.path.join(
+        tmpcase.root_dir_path, 'constant', 'triSurface', 'sphere.stl'
+    ))
+    assert np.allclose(saved.vectors, geometry.geom.vectors)
+
+def test_add_tri_surfaces(tmpcase, unit_sphere_geometry):
+    names = ['surface{}'.format(i) for i in range(4)]
+    tmpcase.add_tri_surfaces([(n, unit_sphere_geometry) for n in names])
+    for name in names:
+        assert os.path.isfile(os.path.join(
+            tmpcase.root_dir_path, 'constant', 'triSurface',
+            '{}.stl'.format(name)
+        ))
+
+def test_add_tri_surfaces_does_not_clobber(tmpcase, unit_sphere_geometry):
+    tmpcase.add_tri_surface('surface1', unit_sphere_geometry)
+    with pytest.raises(CaseAlreadyExists):
+        tmpcase.add_tri_surfaces([('surface0', unit_sphere_geometry),
+                                  ('surface1', unit_sphere_geometry)])
+    assert not os.path.exists(os.path.join(
+        tmpcase.root_dir_path, 'constant', 'triSurface', 'surface0.stl'
+    ))
+
 def test_dimensionless_air(tmpcase):
     """Tests dimensionless air writes to a file"""
     write_standard_thermophysical_properties(tmpcase, StandardFluid.DIMENSIONLESS_AIR)
@@ -118,3 +158,110 @@ def test_dimensionless_air(tmpcase):
     write_standard_thermophysical_properties(tmpcase, StandardFluid.AIR)
     dict_path = os.path.join(tmpcase.root_dir_path, 'constant', 'thermophysicalProperties')
     assert os.path.isfile(dict_path)
+
+def _write_time_dirs(root, times, size=1000):
+    for t in times:
+        os.makedirs(os.path.join(root, t))
+        with open(os.path.join(root, t, 'U'), 'w') as f:
+            f.write('0' * size)
+
+def test_retention_keeps_latest_and_checkpoints(tmpcase):
+    _write_time_dirs(tmpcase.root_dir_path,
+                     ['0', '0.001', '0.002', '0.003', '0.004', '0.005'])
+    retention = tmpcase.retention(keep_latest=2, checkpoints=[0.002])
+    assert retention.purge() == 2000
+    assert tmpcase.time_directories() == [0.0, 0.002, 0.004, 0.005]
+    assert retention.bytes_reclaimed == 2000
+
+def test_retention_compresses(tmpcase):
+    _write_time_dirs(tmpcase.root_dir_path, ['0', '0.001', '0.002'])
+    retention = tmpcase.retention(keep_latest=1, compress=True)
+    assert retention.purge() > 0
+    assert tmpcase.time_directories() == [0.0, 0.001, 0.002]
+    assert os.path.isfile(os.path.join(tmpcase.root_dir_path, '0.001', 'U.gz'))
+    assert not os.path.isfile(os.path.join(tmpcase.root_dir_path, '0.001', 'U'))
+    assert retention.purge() == 0
+
+def test_retention_processor_directories(tmpcase):
+    proc_dir = os.path.join(tmpcase.root_dir_path, 'processor0')
+    _write_time_dirs(proc_dir, ['0', '0.001', '0.002'])
+    tmpcase.retention(keep_latest=1).purge()
+    assert sorted(os.listdir(proc_dir)) == ['0', '0.002']
+
+def test_retention_background(tmpcase):
+    _write_time_dirs(tmpcase.root_dir_path, ['0', '0.001', '0.002', '0.003'])
+    with tmpcase.retention(keep_latest=1, interval=0.01) as retention:
+        _write_time_dirs(tmpcase.root_dir_path, ['0.004'])
+    assert tmpcase.time_directories() == [0.0, 0.004]
+    assert retention.bytes_reclaimed == 3000
+
+def test_retention_needs_latest(tmpcase):
+    with pytest.raises(ValueError):
+        tmpcase.retention(keep_latest=0)
+
+@pytest.fixture
+def archivable_case(tmpcase):
+    """A case with a mesh, function object output and time directories."""
+    root = tmpcase.root_dir_path
+    _write_time_dirs(root, ['0', '0.001', '0.002'])
+    for rel_path in ['constant/polyMesh/points', 'postProcessing/forces/0/forces.dat']:
+        path = os.path.join(root, *rel_path.split('/'))
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(rel_path * 100)
+    with tmpcase.mutable_data_file(FileName.CONTROL) as d:
+        d['application'] = 'rhoCentralFoam'
+    return tmpcase
+
+def test_archive_is_tarball(archivable_case, tmpdir):
+    import tarfile
+    archive_path = tmpdir.join('case.tar.xz').strpath
+    archivable_case.archive(archive_path, chunk_size=1000)
+    with tarfile.open(archive_path, 'r:xz') as tf:
+        names = sorted(tf.getnames())
+        points = tf.extractfile('constant/polyMesh/points').read()
+    assert names == [
+        '0.001/U', '0.002/U', '0/U', 'constant/polyMesh/points',
+        'postProcessing/forces/0/forces.dat', 'system/controlDict',
+    ]
+    assert points == b'constant/polyMesh/points' * 100
+
+def test_archive_selected_times(archivable_case, tmpdir):
+    archive_path = tmpdir.join('case.tar.gz').strpath
+    archivable_case.archive(archive_path, times=[0.002], compression='gz')
+    with archivable_case.open_archive(archive_path) as archive:
+        assert archive.time_directories() == [0.002]
+
+def test_open_archive_lazy(archivable_case, tmpdir):
+    archive_path = tmpdir.join('case.tar.xz').strpath
+    archivable_case.retention(keep_latest=1, compress=True).purge()
+    archivable_case.archive(archive_path, chunk_size=1000)
+    with archivable_case.open_archive(archive_path) as archive:
+        assert archive.read_member('0.001/U') == b'0' * 1000
+        assert archive.open('postProcessing/forces/0/forces.dat').read(5) == b'postP'
+        assert archive.read_data_file(FileName.CONTROL)['application'] == \
+            'rhoCentralFoam'
+        with pytest.raises(KeyError):
+            archive.read_member('0.005/U')
+
+def test_open_archive_without_index(archivable_case, tmpdir):
+    archive_path = tmpdir.join('case.tar.xz').strpath
+    archivable_case.archive(archive_path)
+    os.remove(archive_path + '.index')
+    with archivable_case.open_archive(archive_path) as archive:
+        assert archive.time_directories() == [0.0, 0.001, 0.002]
+        assert archive.read_member('0/U') == b'0' * 1000
+
+def test_archive_extract(archivable_case, tmpdir):
+    archive_path = tmpdir.join('case.tar.xz').strpath
+    archivable_case.archive(archive_path)
+    with archivable_case.open_archive(archive_path) as archive:
+        restored = archive.extract(tmpdir.join('restored').strpath)
+    assert restored.time_directories() == [0.0, 0.001, 0.002]
+    assert restored.read_data_file(FileName.CONTROL)['application'] == \
+        'rhoCentralFoam'
+
+def test_archive_unknown_compression(archivable_case, tmpdir):
+    with pytest.raises(CaseArchiveError):
+        archivable_case.archive(tmpdir.join('case.tar').strpath,
+                                compression='rar')
@@ -39,21 +39,136 @@ def off_centre_unit_sphere(geomdir, tmpdir):
     g.save(tmp_stl)
     return geom.stl_load(tmp_stl)
 
+@pytest.fixture
+def binary_unit_sphere_path(unit_sphere, tmpdir):
+    """Path to a binary STL file of the unit sphere."""
+    from stl import Mode
+    stl_path = tmpdir.join('binary_sphere.stl').strpath
+    unit_sphere.save(stl_path, mode=Mode.BINARY)
+    return stl_path
+
 def test_load_stl(geomdir):
     stl_path = os.path.join(geomdir, 'unit_sphere.stl')
     assert os.path.isfile(stl_path)
     g = geom.stl_load(stl_path)
     assert g is not None
 
+def test_load_binary_stl_is_mapped(unit_sphere, binary_unit_sphere_path):
+    g = geom.stl_load(binary_unit_sphere_path)
+    assert isinstance(g.data, np.memmap)
+    assert not g.data.flags.writeable
+    assert np.all(g.vectors == unit_sphere.vectors)
+    assert np.all(geom.stl_bounds(g)[0] == geom.stl_bounds(unit_sphere)[0])
+    assert abs(geom.stl_area(g) - geom.stl_area(unit_sphere)) < 1e-6
+
+    g = geom.stl_load(binary_unit_sphere_path, memory_map=False)
+    assert not isinstance(g.data, np.memmap)
+
+def test_load_binary_rejects_ascii(geomdir):
+    with pytest.raises(ValueError):
+        geom.stl_load_binary(os.path.join(geomdir, 'unit_sphere.stl'))
+
+def test_mapped_geometry_copied_on_write(binary_unit_sphere_path):
+    g = geom.stl_load(binary_unit_sphere_path)
+    c = geom.stl_copy(g)
+    assert c.data is g.data
+
+    geom.stl_translate(c, (1, 0, 0))
+    assert c.data.flags.writeable
+    assert isinstance(g.data, np.memmap)
+    assert np.all(c.x == g.x + 1)
+
+    # The file itself is unchanged
+    assert np.all(geom.stl_load(binary_unit_sphere_path).x == g.x)
+
+def test_load_ascii_matches_numpy_stl(geomdir):
+    from stl.mesh import Mesh
+    stl_path = os.path.join(geomdir, 'unit_sphere.stl')
+    g = geom.stl_load_ascii(stl_path)
+    expected = Mesh.from_file(stl_path, calculate_normals=False)
+    assert g.name == expected.name
+    assert np.allclose(g.vectors, expected.vectors)
+    assert np.allclose(g.normals, expected.normals)
+
+def test_load_ascii_multiple_solids(unit_sphere, tmpdir):
+    from stl import Mode
+    solids = []
+    for name in ['first', 'second']:
+        stl_path = tmpdir.join('{}.stl'.format(name)).strpath
+        unit_sphere.save(stl_path, mode=Mode.ASCII)
+        with open(stl_path, 'rb') as f:
+            solids.append(f.read().replace(b'OpenSCAD_Model', name.encode()))
+    stl_path = tmpdir.join('both.stl').strpath
+    with open(stl_path, 'wb') as f:
+        # Mix line endings to check both are accepted
+        f.write(solids[0] + solids[1].replace(b'\n', b'\r\n'))
+
+    g, extents = geom.stl_load_ascii(stl_path, return_solids=True)
+    n = len(unit_sphere)
+    assert extents == [(b'first', 0, n), (b'second', n, 2*n)]
+    assert np.allclose(g.vectors[:n], unit_sphere.vectors)
+    assert np.allclose(g.vectors[n:], unit_sphere.vectors)
+
+def test_load_ascii_rejects_malformed(tmpdir):
+    stl_path = tmpdir.join('bad.stl').strpath
+    with open(stl_path, 'w') as f:
+        f.write('solid bad\nfacet normal 0 0 1\nouter loop\nvertex 0 0 0\n'
+                'endloop\nendfacet\nendsolid bad\n')
+    with pytest.raises(ValueError):
+        geom.stl_load_ascii(stl_path)
+
+@pytest.mark.parametrize('ascii', [False, True])
+def test_save_round_trip(unit_sphere, tmpdir, ascii):
+    stl_path = tmpdir.join('saved.stl').strpath
+    geom.stl_save(unit_sphere, stl_path, ascii=ascii, name='sphere')
+    g = geom.stl_load(stl_path)
+    assert g.name == b'sphere'
+    assert np.allclose(g.vectors, unit_sphere.vectors)
+    assert np.allclose(g.normals, unit_sphere.normals, atol=1e-6)
+
+def test_save_mapped_geometry(binary_unit_sphere_path, tmpdir):
+    g = geom.stl_load(binary_unit_sphere_path)
+    stl_path = tmpdir.join('saved.stl').strpath
+    geom.stl_save(g, stl_path)
+    with open(stl_path, 'rb') as f, open(binary_unit_sphere_path, 'rb') as g:
+        assert f.read()[80:] == g.read()[80:]
+
+@pytest.mark.parametrize('ascii', [False, True])
+def test_save_over_mapped_source(binary_unit_sphere_path, ascii):
+    with open(binary_unit_sphere_path, 'rb') as f:
+        original = f.read()
+    g = geom.stl_load(binary_unit_sphere_path)
+    geom.stl_save(g, binary_unit_sphere_path, ascii=ascii)
+    saved = geom.stl_load(binary_unit_sphere_path, memory_map=False)
+    assert len(saved) == (len(original) - 84) // 50
+    assert np.allclose(saved.vectors, g.vectors)
+    assert os.listdir(os.path.dirname(binary_unit_sphere_path)) == \
+        [os.path.basename(binary_unit_sphere_path)]
+
+def test_geometry_save_over_source(binary_unit_sphere_path, tmpcase):
+    g = geom.Geometry(geom.GeometryFormat.STL, binary_unit_sphere_path,
+                      'sphere', tmpcase)
+    g.save(binary_unit_sphere_path)
+    assert np.allclose(geom.stl_load(binary_unit_sphere_path).vectors,
+                       g.geom.vectors)
+
 def test_bounds(unit_sphere):
     min_, max_ = geom.stl_bounds(unit_sphere)
     assert np.all(np.abs(min_ - np.array([-1, -1, -1])) < TOLERANCE)
     assert np.all(np.abs(max_ - np.array([1, 1, 1])) < TOLERANCE)
 
+def test_area(unit_sphere):
+    assert abs(geom.stl_area(unit_sphere) - 4*np.pi) < 4*np.pi*2*TOLERANCE
+
 def test_geometric_center(unit_sphere):
     c = geom.stl_geometric_centre(unit_sphere)
     assert np.all(np.abs(c) < TOLERANCE)
 
+def test_copy_is_deep(unit_sphere):
+    c = geom.stl_copy(unit_sphere)
+    c.x += 1
+    assert np.all(c.x == unit_sphere.x + 1)
+
 def test_copy(unit_sphere):
     sphere_copy = geom.stl_copy(unit_sphere)
     assert sphere_copy is not unit_sphere
@@ -83,6 +198,76 @@ def test_non_uniform_scale(unit_sphere):
     assert np.all(np.abs(min_ - np.array([-0.5, -2, -3])) < 3*TOLERANCE)
     assert np.all(np.abs(max_ - np.array([0.5, 2, 3])) < 3*TOLERANCE)
 
+@pytest.fixture
+def sphere_geometry(geomdir, tmpcase):
+    """A Geometry instance of the unit sphere."""
+    stl_path = os.path.join(geomdir, 'unit_sphere.stl')
+    return geom.Geometry(geom.GeometryFormat.STL, stl_path, 'sphere', tmpcase)
+
+def test_geometry_transforms_are_lazy(sphere_geometry, unit_sphere):
+    loaded = sphere_geometry.geom
+    sphere_geometry.scale([2, 1, 1])
+    sphere_geometry.translate([1, 0, 0])
+    assert np.all(loaded.vectors == unit_sphere.vectors)
+
+    expected = np.eye(4)
+    expected[0, 0], expected[0, 3] = 2, 1
+    assert np.allclose(sphere_geometry.transform, expected)
+    assert np.allclose(sphere_geometry.geom.x, 2 * unit_sphere.x + 1)
+    assert sphere_geometry.geom is sphere_geometry.geom
+
+def test_geometry_bounds(sphere_geometry):
+    sphere_geometry.scale([2, -1, 1])
+    sphere_geometry.translate([1, 0, 0])
+    min_, max_ = sphere_geometry.bounds()
+    assert np.allclose(min_, [-1, -1, -1], atol=TOLERANCE)
+    assert np.allclose(max_, [3, 1, 1], atol=TOLERANCE)
+
+    sphere_geometry.rotate([0, 0, 1], np.pi / 2)
+    min_, max_ = sphere_geometry.bounds()
+    data_min, data_max = geom.stl_bounds(sphere_geometry.geom)
+    assert np.allclose(min_, data_min) and np.allclose(max_, data_max)
+    assert np.allclose(min_, [-1, -1, -1], atol=TOLERANCE)
+    assert np.allclose(max_, [1, 3, 1], atol=TOLERANCE)
+
+def test_geometry_rotate_about_point(sphere_geometry, unit_sphere):
+    sphere_geometry.rotate([0, 0, 1], np.pi, point=[1, 0, 0])
+    g = sphere_geometry.geom
+    assert np.allclose(g.x, 2 - unit_sphere.x, atol=1e-5)
+    assert np.allclose(g.y, -unit_sphere.y, atol=1e-5)
+    assert np.allclose(g.z, unit_sphere.z)
+
+def test_geometry_recentre(sphere_geometry):
+    sphere_geometry.translate([0.1, 0.2, -0.3])
+    sphere_geometry.recentre()
+    min_, max_ = sphere_geometry.bounds()
+    assert np.allclose(min_ + max_, 0, atol=1e-6)
+
+def test_geometry_save_is_transformed(sphere_geometry, tmpdir):
+    sphere_geometry.scale(2)
+    stl_path = tmpdir.join('saved.stl').strpath
+    sphere_geometry.save(stl_path)
+    min_, max_ = geom.stl_bounds(geom.stl_load(stl_path))
+    assert np.allclose(max_, [2, 2, 2], atol=2*TOLERANCE)
+
+def test_geometry_assignment_clears_transform(sphere_geometry, unit_sphere):
+    sphere_geometry.translate([1, 0, 0])
+    sphere_geometry.geom = unit_sphere
+    assert np.all(sphere_geometry.transform == np.eye(4))
+    assert sphere_geometry.geom is unit_sphere
+
+def test_transform_normals(unit_sphere):
+    matrix = np.eye(4)
+    matrix[:3, :3] = [[0, -3, 0], [1, 0, 0], [0, 0, -0.5]]
+    g = geom.stl_transform(unit_sphere, matrix)
+    # Normals stay perpendicular to the faces and agree with their winding,
+    # which this reflection turns inside out.
+    winding = np.cross(g.v1 - g.v0, g.v2 - g.v0)
+    cosines = np.sum(winding * g.normals, axis=1) / (
+        np.linalg.norm(winding, axis=1) * np.linalg.norm(g.normals, axis=1))
+    assert np.all(cosines > 0.999)
+    assert np.all(np.sum(g.normals * g.vectors.mean(axis=1), axis=1) < 0)
+
 def test_mesh_quality_settings(tmpcase, tmpdir):
     meshQuality = geom.MeshQualitySettings()
     meshQuality.write_settings(tmpcase)
@@ -122,3 +307,386 @@ def test_surface_extract(tmpcase,geomdir):
     assert os.path.isfile(os.path.join(
         tmpcase.root_dir_path, 'constant', 'triSurface','sphere.eMesh'
     ))
+
+def test_weld(unit_sphere):
+    indexed = geom.stl_weld(unit_sphere)
+    assert indexed.faces.dtype == np.int32
+    assert indexed.faces.shape == (len(unit_sphere), 3)
+    # Euler's formula for a closed genus 0 surface: V - E + F = 2
+    assert len(indexed.vertices) - 3 * len(unit_sphere) // 2 + \
+        len(unit_sphere) == 2
+
+    round_trip = geom.stl_from_indexed(indexed)
+    assert np.all(round_trip.vectors == unit_sphere.vectors)
+
+def test_weld_tolerance(unit_sphere):
+    jittered = geom.stl_copy(unit_sphere)
+    rng = np.random.RandomState(0)
+    jittered.vectors += rng.uniform(-1e-6, 1e-6, jittered.vectors.shape)
+    n_vertices = len(geom.stl_weld(unit_sphere).vertices)
+    assert len(geom.stl_weld(jittered).vertices) > n_vertices
+    assert len(geom.stl_weld(jittered, 1e-4).vertices) == n_vertices
+
+def test_weld_across_cells():
+    from stl.mesh import Mesh
+    data = np.zeros(2, dtype=Mesh.dtype)
+    data['vectors'][0] = [[0.99999, 0, 0], [0, 1, 0], [0, 0, 1]]
+    data['vectors'][1] = [[1.00001, 0, 0], [0, 0, 1], [0, -1, 0]]
+    indexed = geom.stl_weld(Mesh(data), tolerance=1e-3)
+    assert len(indexed.vertices) == 4
+    assert indexed.faces[0, 0] == indexed.faces[1, 0]
+
+def test_weld_across_cells_far_from_first_points():
+    from stl.mesh import Mesh
+    # 0.95 and 1.02 are in neighbouring cells and within tolerance, but the
+    # other point in each cell is not.
+    data = np.zeros(2, dtype=Mesh.dtype)
+    data['vectors'][0] = [[0.05, 0, 0], [0.95, 0, 0], [0, 5, 0]]
+    data['vectors'][1] = [[1.9, 0, 0], [1.02, 0, 0], [0, 0, 5]]
+    indexed = geom.stl_weld(Mesh(data), tolerance=1)
+    assert indexed.faces[0, 1] == indexed.faces[1, 1]
+    assert len(indexed.vertices) == 3
+
+def test_weld_pair_batches(unit_sphere):
+    points = np.asarray(unit_sphere.vectors, dtype=np.float64).reshape(-1, 3)
+    points = points + np.random.RandomState(0).uniform(-1e-3, 1e-3,
+                                                       points.shape)
+    assert np.array_equal(geom._weld_clusters(points, 0.05, pair_budget=1),
+                          geom._weld_clusters(points, 0.05))
+
+def test_geometry_indexed_is_cached(sphere_geometry):
+    indexed = sphere_geometry.indexed()
+    assert sphere_geometry.indexed() is indexed
+    sphere_geometry.translate([1, 0, 0])
+    moved = sphere_geometry.indexed()
+    assert moved is not indexed
+    assert np.allclose(moved.vertices[:, 0].min(), 0, atol=TOLERANCE)
+
+def test_check_closed(sphere_geometry):
+    check = sphere_geometry.check()
+    assert check.closed
+    assert len(check.degenerate_faces) == 0
+
+def _mesh(data):
+    from stl.mesh import Mesh
+    return Mesh(data, calculate_normals=False)
+
+def test_check_open(unit_sphere):
+    check = geom.stl_check(_mesh(unit_sphere.data[1:]))
+    assert not check.closed
+    assert len(check.open_edges) == 3
+    assert len(check.non_manifold_edges) == 0
+
+def test_check_non_manifold(unit_sphere):
+    data = np.concatenate((unit_sphere.data, unit_sphere.data[:1]))
+    check = geom.stl_check(_mesh(data))
+    assert len(check.non_manifold_edges) == 3
+    assert len(check.open_edges) == 0
+
+def test_check_inconsistent_winding(unit_sphere):
+    data = unit_sphere.data.copy()
+    data['vectors'][0] = data['vectors'][0][::-1]
+    check = geom.stl_check(_mesh(data))
+    assert len(check.inconsistent_edges) == 3
+    assert len(check.open_edges) == 0
+
+def test_check_degenerate(unit_sphere):
+    data = unit_sphere.data.copy()
+    data['vectors'][0][2] = data['vectors'][0][1]
+    check = geom.stl_check(_mesh(data))
+    assert list(check.degenerate_faces) == [0]
+
+def test_mass_properties(sphere_geometry):
+    props = sphere_geometry.mass_properties(density=2.0)
+    assert abs(props.volume - 4*np.pi/3) < 4*np.pi/3*2*TOLERANCE
+    assert abs(props.mass - 2*props.volume) < 1e-9
+    assert np.all(np.abs(props.centre_of_mass) < 1e-6)
+    # A solid sphere has I = 2/5 m r^2 about any axis
+    expected = 0.4 * props.mass * np.eye(3)
+    assert np.allclose(props.inertia, expected, atol=4*TOLERANCE)
+
+def test_mass_properties_inside_out(unit_sphere):
+    data = unit_sphere.data.copy()
+    data['vectors'] = data['vectors'][:, ::-1]
+    props = geom.stl_mass_properties(_mesh(data))
+    assert np.allclose(props.volume,
+                       geom.stl_mass_properties(unit_sphere).volume)
+
+def test_mass_properties_of_parts(unit_sphere):
+    moved = geom.stl_translate(geom.stl_copy(unit_sphere), [3, 0, 0])
+    total, (first, second) = geom.mass_properties([unit_sphere, moved],
+                                                  [1.0, 3.0])
+    assert np.allclose(second.mass, 3 * first.mass)
+    assert np.allclose(total.mass, first.mass + second.mass)
+    assert np.allclose(total.centre_of_mass, [2.25, 0, 0])
+
+    # Parallel axis theorem
+    offsets = [-2.25, 0.75]
+    iyy = sum(p.inertia[1, 1] + p.mass * d**2
+              for p, d in zip([first, second], offsets))
+    assert np.allclose(total.inertia[1, 1], iyy)
+    assert np.allclose(total.inertia[0, 0],
+                       first.inertia[0, 0] + second.inertia[0, 0])
+
+    moments, axes = total.principal()
+    assert np.all(np.diff(moments) >= 0)
+
+def test_decimate_to_target(unit_sphere):
+    decimated, deviation = geom.stl_decimate(unit_sphere, target_faces=400)
+    assert len(decimated) == 400
+    assert geom.stl_check(decimated).closed
+    assert 0 < deviation < 0.1
+    assert np.isclose(geom.stl_mass_properties(decimated).volume,
+                      geom.stl_mass_properties(unit_sphere).volume, rtol=0.05)
+
+def test_decimate_to_tolerance(unit_sphere):
+    decimated, deviation = geom.stl_decimate(unit_sphere, tolerance=0)
+    assert len(decimated) == len(unit_sphere)
+    assert deviation == 0
+    decimated, deviation = geom.stl_decimate(unit_sphere, tolerance=0.05)
+    assert len(decimated) < len(unit_sphere)
+    assert deviation <= 0.05
+
+def test_decimate_keeps_open_edges(unit_sphere):
+    open_sphere = _mesh(unit_sphere.data[8:])
+    decimated, _ = geom.stl_decimate(open_sphere, target_faces=300)
+    assert len(decimated) == 300
+    check = geom.stl_check(decimated)
+    assert len(check.open_edges) == len(geom.stl_check(open_sphere).open_edges)
+    assert len(check.non_manifold_edges) == 0
+
+@pytest.mark.parametrize('tolerance', [0.01, 0.05])
+def test_decimate_keeps_non_manifold_edges(unit_sphere, tolerance):
+    # An open sphere with some faces doubled has open and non-manifold
+    # edges. The rocket's fins meet its body tube with many neighbouring
+    # edges which are never candidates for collapse.
+    surfaces = [_mesh(np.concatenate([unit_sphere.data[8:],
+                                      unit_sphere.data[100:110]])),
+                _rocket()[0]]
+    for surface in surfaces:
+        before = geom.stl_check(surface)
+        decimated, deviation = geom.stl_decimate(surface, tolerance=tolerance)
+        after = geom.stl_check(decimated)
+        assert len(decimated) < len(surface)
+        assert deviation <= tolerance
+        assert len(after.non_manifold_edges) <= len(before.non_manifold_edges)
+        assert len(after.open_edges) == len(before.open_edges)
+
+def test_decimate_needs_limit(unit_sphere):
+    with pytest.raises(ValueError):
+        geom.stl_decimate(unit_sphere)
+
+def test_geometry_decimate(sphere_geometry):
+    decimated, deviation = sphere_geometry.decimate(target_faces=500)
+    assert len(decimated.geom) == 500
+    assert decimated.name == sphere_geometry.name
+    assert len(sphere_geometry.geom) == 896
+
+def _rocket(**kwargs):
+    design = dict(radius=0.05, nose_length=0.3, body_length=1, fin_count=4,
+                  fin_root_chord=0.2, fin_tip_chord=0.1, fin_span=0.08,
+                  fin_sweep=0.05, fin_thickness=0.005, boat_tail_length=0.1,
+                  boat_tail_radius=0.04)
+    design.update(kwargs)
+    return geom.rocket_surface(**design)
+
+def test_rocket_surface_regions():
+    rocket, regions = _rocket()
+    assert [r[0] for r in regions] == ['nose', 'body', 'boatTail', 'base',
+                                       'fin1', 'fin2', 'fin3', 'fin4']
+    assert regions[0][1] == 0 and regions[-1][2] == len(rocket)
+    assert all(a[2] == b[1] for a, b in zip(regions, regions[1:]))
+
+    parts = dict(geom.stl_split(rocket, regions))
+    assert geom.stl_check(parts['fin3']).closed
+    body = geom.stl_concatenate([parts[n] for n in
+                                 ('nose', 'body', 'boatTail', 'base')])
+    assert geom.stl_check(body).closed
+
+    min_, max_ = geom.stl_bounds(rocket)
+    assert np.allclose(min_, [0, -0.13, -0.13], atol=1e-6)
+    assert np.allclose(max_, [1.4, 0.13, 0.13], atol=1e-6)
+
+def test_rocket_surface_volumes():
+    rocket, regions = _rocket(nose_shape=geom.NoseShape.CONIC, n_around=256,
+                              boat_tail_length=0)
+    parts = dict(geom.stl_split(rocket, regions))
+    fin = geom.stl_mass_properties(parts['fin1']).volume
+    assert np.isclose(fin, (0.15 * 0.08 + 0.2 * 0.025) * 0.005)
+    body = geom.stl_concatenate([parts[n] for n in ('nose', 'body', 'base')])
+    expected = np.pi * 0.05 ** 2 * (1 + 0.3 / 3)
+    assert np.isclose(geom.stl_mass_properties(body).volume, expected,
+                      rtol=1e-3)
+
+def test_rocket_surface_nose_shapes():
+    volumes = {}
+    for shape in geom.NoseShape:
+        rocket, regions = _rocket(nose_shape=shape, fin_count=0)
+        assert geom.stl_check(rocket).closed
+        nose = geom.stl_split(rocket, regions)[0][1]
+        volumes[shape] = geom.stl_mass_properties(rocket).volume
+        assert np.isclose(geom.stl_bounds(nose)[1][1], 0.05)
+    assert volumes[geom.NoseShape.CONIC] < \
+        volumes[geom.NoseShape.VON_KARMAN] < volumes[geom.NoseShape.OGIVE]
+
+def test_rocket_surface_invalid():
+    with pytest.raises(ValueError):
+        _rocket(fin_thickness=0)
+    with pytest.raises(ValueError):
+        _rocket(nose_length=0.01)
+    with pytest.raises(ValueError):
+        _rocket(radius=-1)
+
+def test_rocket_surface_regions_round_trip(tmpdir):
+    rocket, regions = _rocket()
+    path = tmpdir.join('rocket.stl').strpath
+    geom.stl_save_regions(path, geom.stl_split(rocket, regions))
+    loaded, solids = geom.stl_load_ascii(path, return_solids=True)
+    assert [(n.decode(), a, b) for n, a, b in solids] == regions
+    assert np.allclose(loaded.vectors, rocket.vectors)
+
+def test_reference_values_sphere(sphere_geometry, unit_sphere):
+    values = sphere_geometry.reference_values(axis=(0, 0, 1), resolution=256)
+    assert np.isclose(values.wetted_area, geom.stl_area(unit_sphere))
+    assert np.isclose(values.frontal_area, np.pi, rtol=TOLERANCE)
+    assert np.isclose(values.length, 2, rtol=TOLERANCE)
+    assert np.isclose(geom.frontal_area([unit_sphere], (1, 1, 1), 256),
+                      np.pi, rtol=TOLERANCE)
+
+def test_reference_values_rocket():
+    # Keep the fins clear of the base so that no faces coincide.
+    rocket, regions = _rocket(n_around=128, n_body=10, fin_sweep=0,
+                              fin_offset=0.1, boat_tail_length=0)
+    parts = dict(geom.stl_split(rocket, regions))
+    body = geom.stl_concatenate([parts[n] for n in ('nose', 'body', 'base')])
+    fins = [parts['fin{}'.format(i + 1)] for i in range(4)]
+
+    # The fins' roots are inside the body and cover some of its surface.
+    hidden = 4 * (2 * 0.2 * 0.025 + 2 * 0.2 * 0.005 + 2 * 0.025 * 0.005)
+    assert np.isclose(geom.wetted_area([body] + fins, subdivisions=8),
+                      geom.stl_area(rocket) - hidden, rtol=1e-3)
+
+    frontal = geom.frontal_area([body] + fins)
+    assert np.isclose(frontal, np.pi * 0.05 ** 2 + 4 * 0.005 * 0.08, rtol=0.01)
+    assert np.isclose(geom.frontal_area([body] + fins, pixel_budget=100),
+                      frontal)
+    assert np.isclose(geom.reference_length([body] + fins), 1.3)
+
+def test_wetted_area_of_unsplit_rocket():
+    rocket, regions = _rocket(n_around=64, fin_count=3)
+    parts = dict(geom.stl_split(rocket, regions))
+    body = geom.stl_concatenate([parts[n] for n in
+                                 ('nose', 'body', 'boatTail', 'base')])
+    fins = [parts['fin{}'.format(i + 1)] for i in range(3)]
+    wetted = geom.wetted_area([rocket])
+    assert wetted < 0.95 * geom.stl_area(rocket)
+    assert np.isclose(wetted, geom.wetted_area([body] + fins))
+    assert np.isclose(geom.reference_values([rocket]).wetted_area, wetted)
+
+def test_force_coeffs_dict(tmpcase, sphere_geometry):
+    from firefish.case import FileName
+    coeffs = geom.force_coeffs_dict([sphere_geometry], 20, resolution=256)
+    assert coeffs['patches'] == [sphere_geometry.name]
+    assert np.isclose(coeffs['Aref'], np.pi, rtol=TOLERANCE)
+    assert np.isclose(coeffs['lRef'], 2, rtol=TOLERANCE)
+    assert coeffs['pitchAxis'] == [0, 0, 1]
+
+    geom.write_force_coeffs(tmpcase, coeffs)
+    coeffs['magUInf'] = 30
+    geom.write_force_coeffs(tmpcase, coeffs, name='fast')
+    functions = tmpcase.read_data_file(FileName.CONTROL)['functions']
+    assert functions['forceCoefficients']['magUInf'] == 20
+    assert functions['fast']['magUInf'] == 30
+    assert np.isclose(functions['fast']['Aref'], coeffs['Aref'])
+
+def test_dihedral_angles(unit_sphere):
+    face_a, face_b, angles = geom.stl_dihedral_angles(unit_sphere)
+    # Every edge of a closed surface is shared by two faces.
+    assert len(angles) == 3 * len(unit_sphere.vectors) // 2
+    assert np.all(face_a != face_b)
+    assert np.all(angles < 45)
+
+def test_curvature(unit_sphere):
+    curvature = geom.stl_curvature(unit_sphere)
+    assert curvature.shape == (len(unit_sphere.vectors),)
+    assert abs(np.median(curvature) - 1) < 0.2
+
+def test_refinement_levels(unit_sphere):
+    coarse = geom.stl_refinement_levels(unit_sphere, 0.5, angular_resolution=20)
+    fine = geom.stl_refinement_levels(unit_sphere, 0.5, angular_resolution=5)
+    assert fine[0] == coarse[0] + 2
+    assert coarse[0] <= coarse[1]
+    assert geom.stl_refinement_levels(unit_sphere, 0.5, 5, max_level=1) == \
+        (1, 1, 1)
+
+def test_feature_edges(unit_sphere):
+    points, edges = geom.stl_feature_edges(unit_sphere, included_angle=180)
+    # Almost every edge of a faceted sphere is a feature at 180 degrees...
+    assert len(edges) > len(unit_sphere.vectors)
+    assert edges.max() == len(points) - 1
+    # ...and none are at 90 degrees.
+    points, edges = geom.stl_feature_edges(unit_sphere, included_angle=90)
+    assert len(edges) == 0 and len(points) == 0
+
+def test_feature_edges_open_surface(unit_sphere):
+    import stl.mesh
+    half = stl.mesh.Mesh(unit_sphere.data[unit_sphere.centroids[:, 2] > 0])
+    _, edges = geom.stl_feature_edges(half, included_angle=0)
+    assert len(edges) > 0
+
+def test_write_feature_edge_mesh(tmpdir):
+    path = tmpdir.join('triSurface', 'box.eMesh').strpath
+    geom.write_feature_edge_mesh(path, [[0, 0, 0], [1, 0, 0], [1, 1, 0]],
+                                 [[0, 1], [1, 2]])
+    with open(path) as f:
+        content = f.read()
+    assert 'class       featureEdgeMesh;' in content
+    assert '\n3\n(\n(0 0 0)\n(1 0 0)\n(1 1 0)\n)\n' in content
+    assert '\n2\n(\n(0 1)\n(1 2)\n)\n' in content
+
+def test_load_multiple_geometries(tmpcase, geomdir):
+    stl_path = os.path.join(geomdir, 'unit_sphere.stl')
+    names = ['nose', 'tail']
+    geometries = geom.load_multiple_geometries(
+        geom.GeometryFormat.STL, [stl_path] * 2, names, tmpcase)
+    assert [g.name for g in geometries] == names
+    for name in names:
+        assert os.path.isfile(os.path.join(
+            tmpcase.root_dir_path, 'constant', 'triSurface',
+            '{}.eMesh'.format(name)))
+
+def test_load_multiple_geometries_timings(tmpcase, geomdir):
+    stl_path = os.path.join(geomdir, 'unit_sphere.stl')
+    geometries = geom.load_multiple_geometries(
+        geom.GeometryFormat.STL, [stl_path] * 2, ['nose', 'tail'], tmpcase,
+        processes=1)
+    for g in geometries:
+        assert list(g.loadTimings) == ['load', 'write', 'features']
+        assert all(t >= 0 for t in g.loadTimings.values())
+
+def test_load_multiple_geometries_parse_processes(tmpcase, geomdir,
+                                                  unit_sphere):
+    stl_path = os.path.join(geomdir, 'unit_sphere.stl')
+    names = ['a', 'b', 'c']
+    geometries = geom.load_multiple_geometries(
+        geom.GeometryFormat.STL, [stl_path] * 3, names, tmpcase,
+        parse_processes=2)
+    assert [g.name for g in geometries] == names
+    for g in geometries:
+        assert np.all(g.geom.vectors == unit_sphere.vectors)
+        assert g.loadTimings['load'] > 0
+
+def test_load_multiple_geometries_as_one_surface(tmpcase, geomdir):
+    stl_path = os.path.join(geomdir, 'unit_sphere.stl')
+    names = ['nose', 'tail']
+    geometries = geom.load_multiple_geometries(
+        geom.GeometryFormat.STL, [stl_path] * 2, names, tmpcase,
+        surface_name='rocket')
+    assert all(g.surfaceName == 'rocket' and g.saved for g in geometries)
+
+    surface_dir = os.path.join(tmpcase.root_dir_path, 'constant', 'triSurface')
+    assert sorted(os.listdir(surface_dir)) == ['rocket.eMesh', 'rocket.stl']
+    surface, solids = geom.stl_load_ascii(
+        os.path.join(surface_dir, 'rocket.stl'), return_solids=True)
+    n = len(geometries[0].geom)
+    assert solids == [(b'nose', 0, n), (b'tail', n, 2*n)]
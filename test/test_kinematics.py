@@ -1,4 +1,5 @@
 import firefish.kinematics as kine
+import numpy as np
 import pytest
 
 @pytest.fixture
@@ -27,3 +28,10 @@ def test_kinematics_mass():
     sim.time_step([0,0,0],[0,0,0],1)
     massTol = 0.01
     assert(abs(sim.body.mass-(1.0-1.0*dt))<massTol)
+
+def test_body_from_mass_properties():
+    from firefish.geometry import MassProperties
+    properties = MassProperties(2.0, 1.0, np.zeros(3), np.diag([1.0, 2.0, 3.0]))
+    body = kine.KinematicBody.from_mass_properties(properties)
+    assert body.mass == 2.0
+    assert body.MoI == [1.0, 2.0, 3.0]
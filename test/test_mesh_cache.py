@@ -0,0 +1,91 @@
+import os
+
+import pytest
+
+from firefish.case import FileName
+from firefish.meshcache import MeshCache
+
+@pytest.fixture
+def tmpcase(tmpdir):
+    """An empty Case instance which has been created in a temporary directory.
+
+    """
+    from firefish.case import Case
+    case_dir = tmpdir.join('temp_case')
+    return Case(case_dir.strpath)
+
+@pytest.fixture
+def cache(tmpdir):
+    return MeshCache(tmpdir.join('cache').strpath)
+
+def _write_inputs(case, level=4):
+    with case.mutable_data_file(FileName.SNAPPY_HEX_MESH) as d:
+        d['level'] = level
+    surface_dir = os.path.join(case.root_dir_path, 'constant', 'triSurface')
+    if not os.path.isdir(surface_dir):
+        os.makedirs(surface_dir)
+    with open(os.path.join(surface_dir, 'rocket.stl'), 'w') as f:
+        f.write('solid rocket\nendsolid rocket\n')
+
+def _write_mesh(case, content='points'):
+    mesh_dir = os.path.join(case.root_dir_path, 'constant', 'polyMesh')
+    if not os.path.isdir(mesh_dir):
+        os.makedirs(mesh_dir)
+    with open(os.path.join(mesh_dir, 'points'), 'w') as f:
+        f.write(content)
+
+def _read_points(case):
+    with open(os.path.join(case.root_dir_path, 'constant', 'polyMesh',
+                           'points')) as f:
+        return f.read()
+
+def test_key_depends_on_inputs(tmpcase, cache):
+    _write_inputs(tmpcase)
+    key = cache.key(tmpcase)
+    _write_mesh(tmpcase)
+    with tmpcase.mutable_data_file(FileName.CONTROL) as d:
+        d['endTime'] = 1
+    assert cache.key(tmpcase) == key
+    _write_inputs(tmpcase, level=5)
+    assert cache.key(tmpcase) != key
+
+def test_store_and_restore(tmpcase, cache, tmpdir):
+    from firefish.case import Case
+    _write_inputs(tmpcase)
+    _write_mesh(tmpcase, 'cached mesh')
+    key = cache.store(tmpcase)
+    assert cache.contains(key)
+
+    other = Case(tmpdir.join('other').strpath)
+    _write_inputs(other)
+    _write_mesh(other, 'background mesh')
+    assert cache.restore(other)
+    assert _read_points(other) == 'cached mesh'
+
+def test_restore_by_copy(tmpcase, tmpdir):
+    cache = MeshCache(tmpdir.join('cache').strpath, link=False)
+    _write_inputs(tmpcase)
+    _write_mesh(tmpcase)
+    cache.store(tmpcase)
+    assert cache.restore(tmpcase)
+    points = os.path.join(tmpcase.root_dir_path, 'constant', 'polyMesh',
+                          'points')
+    assert os.stat(points).st_nlink == 1
+
+def test_store_needs_mesh(tmpcase, cache):
+    _write_inputs(tmpcase)
+    with pytest.raises(IOError):
+        cache.store(tmpcase)
+
+def test_eviction(tmpcase, tmpdir):
+    cache = MeshCache(tmpdir.join('cache').strpath, max_bytes=1500)
+    _write_mesh(tmpcase, 'x' * 1000)
+    keys = []
+    for level in range(3):
+        _write_inputs(tmpcase, level)
+        keys.append(cache.store(tmpcase))
+        # Make sure modification times differ.
+        os.utime(os.path.join(cache.cache_dir, keys[-1]), (level, level))
+    cache.evict()
+    assert [cache.contains(k) for k in keys] == [False, False, True]
+    assert cache.size() <= 1500
@@ -5,6 +5,7 @@ import pytest
 
 import firefish.geometry as geom
 import firefish.meshsnappy as snappy
+from firefish.case import FileName
 
 @pytest.fixture
 def tmpcase(tmpdir):
@@ -23,3 +24,331 @@ def test_snappy_dict(tmpcase,tmpdir,geomdir):
     assert os.path.isfile(os.path.join(
         tmpcase.root_dir_path, 'system','snappyHexMeshDict'
     ))
+
+@pytest.fixture
+def sphere(tmpcase, geomdir):
+    stl_path = os.path.join(geomdir, 'unit_sphere.stl')
+    return geom.Geometry(geom.GeometryFormat.STL, stl_path, 'sphere', tmpcase)
+
+def test_background_mesh(tmpcase, sphere):
+    bg = snappy.write_background_mesh(tmpcase, [sphere], cell_size=0.5,
+                                      upstream=2, downstream=4, lateral=1,
+                                      flow_direction=(0, -1, 0))
+    extent = bg.max_ - bg.min_
+    assert np.allclose(extent, bg.cells * 0.5)
+    assert bg.max_[1] >= 3 - 1e-3 and bg.min_[1] <= -5 + 1e-3
+    assert bg.max_[0] >= 2 - 1e-3 and bg.min_[0] <= -2 + 1e-3
+    assert np.all(bg.cells * 0.5 - np.array([4, 9, 4]) < 0.5)
+
+    d = tmpcase.read_data_file(FileName.BLOCK_MESH)
+    assert list(d['blocks'][2]) == list(bg.cells)
+    boundary = dict(zip(d['boundary'][::2], d['boundary'][1::2]))
+    # Flow is along -Y so the inlet is the maximum Y face.
+    assert list(boundary['inlet']['faces'][0]) == [3, 7, 6, 2]
+    assert len(boundary['fixedWalls']['faces']) == 4
+
+def test_background_mesh_from_surface_cell_size(tmpcase, sphere):
+    snap = snappy.SnappyHexMesh([sphere], 4, tmpcase)
+    snap.refinementSurfaceMax = 3
+    bg = snappy.write_background_mesh(tmpcase, [sphere], snappy=snap,
+                                      surface_cell_size=0.05)
+    assert bg.cell_size == pytest.approx(0.4)
+
+def test_background_mesh_needs_axis_flow(tmpcase, sphere):
+    with pytest.raises(ValueError):
+        snappy.write_background_mesh(tmpcase, [sphere], cell_size=0.5,
+                                     flow_direction=(1, 1, 0))
+
+def test_read_background_mesh(tmpcase, sphere):
+    written = snappy.write_background_mesh(tmpcase, [sphere], cell_size=0.25)
+    read = snappy.read_background_mesh(tmpcase)
+    assert np.allclose(read.min_, written.min_)
+    assert np.allclose(read.max_, written.max_)
+    assert list(read.cells) == list(written.cells)
+    assert read.cell_size == pytest.approx(0.25)
+
+def test_estimate_mesh_grows_with_refinement(tmpcase, sphere):
+    snappy.write_background_mesh(tmpcase, [sphere], cell_size=0.25)
+    snap = snappy.SnappyHexMesh([sphere], 4, tmpcase)
+    snap.maxGlobalCells = 10**9
+    snap.refinementSurfaceMin = snap.refinementSurfaceMax = 2
+    snap.distanceLevels = [1, 1]
+    coarse = snap.estimate_mesh()
+    snap.refinementSurfaceMin = snap.refinementSurfaceMax = 4
+    fine = snap.estimate_mesh()
+    # The background alone has 24 x 16 x 16 cells.
+    assert coarse.cells > 24 * 16 * 16
+    assert fine.cells > 4 * coarse.cells
+    assert fine.memory > coarse.memory
+    assert coarse.n_procs >= 1
+
+def test_estimate_mesh_warns(tmpcase, sphere):
+    background = snappy.write_background_mesh(tmpcase, [sphere], cell_size=0.25)
+    snap = snappy.SnappyHexMesh([sphere], 4, tmpcase)
+    snap.maxGlobalCells = 1000
+    with pytest.warns(snappy.MeshSizeWarning):
+        estimate = snap.estimate_mesh(background)
+    assert estimate.cells > 1000
+    snap.maxGlobalCells = 10**9
+    with pytest.warns(snappy.MeshSizeWarning):
+        snap.estimate_mesh(background, n_procs=1, memory_limit=1000)
+
+_FAKE_SNAPPY_LOG = """Refinement phase
+Mesh refined in = 1.5 s.
+Morphing phase
+Mesh snapped in = 2.25 s.
+Finished meshing in = 4 s.
+"""
+
+@pytest.fixture
+def fake_openfoam(tmpdir, monkeypatch):
+    """Fake OpenFOAM meshing tools which record how they were invoked."""
+    bin_dir = tmpdir.mkdir('bin')
+    calls = tmpdir.join('calls.txt')
+    scripts = {
+        'mpirun': 'shift 2\nexec "$@"\n',
+        'decomposePar': 'mkdir -p "$2/processor0"\n',
+        'snappyHexMesh': 'cat <<EOF\n' + _FAKE_SNAPPY_LOG + 'EOF\n',
+        'reconstructParMesh': '',
+    }
+    for name, body in scripts.items():
+        script = bin_dir.join(name)
+        script.write('#!/bin/sh\necho {} "$@" >> {}\n{}'.format(
+            name, calls.strpath, body))
+        script.chmod(0o755)
+    monkeypatch.setenv('PATH', bin_dir.strpath + os.pathsep + os.environ['PATH'])
+    return calls
+
+def test_generate_mesh_serial(tmpcase, sphere, fake_openfoam):
+    snap = snappy.SnappyHexMesh([sphere], 4, tmpcase)
+    stages = []
+    timings = snap.generate_mesh(progress=lambda *a: stages.append(a))
+    assert stages[:3] == [('Mesh refined', 1.5), ('Mesh snapped', 2.25),
+                          ('Finished meshing', 4.0)]
+    assert list(timings) == ['Mesh refined', 'Mesh snapped',
+                             'Finished meshing', 'snappyHexMesh']
+    calls = fake_openfoam.read().splitlines()
+    assert calls == ['snappyHexMesh -case {} -overwrite'.format(
+        tmpcase.root_dir_path)]
+
+def test_generate_mesh_parallel(tmpcase, sphere, fake_openfoam):
+    snap = snappy.SnappyHexMesh([sphere], 4, tmpcase)
+    timings = snap.generate_mesh(n_procs=4)
+    assert timings['Mesh refined'] == 1.5
+    tools = [c.split()[0] for c in fake_openfoam.read().splitlines()]
+    assert tools == ['decomposePar', 'mpirun', 'snappyHexMesh',
+                     'reconstructParMesh']
+    assert 'mpirun -np 4 snappyHexMesh' in fake_openfoam.read()
+    assert '-parallel -overwrite' in fake_openfoam.read()
+    decompose = tmpcase.read_data_file(FileName.DECOMPOSE)
+    assert decompose['numberOfSubdomains'] == 4
+    assert decompose['method'] == 'scotch'
+    assert not os.path.exists(os.path.join(tmpcase.root_dir_path, 'processor0'))
+
+def test_generate_mesh_cached(tmpcase, sphere, fake_openfoam, tmpdir):
+    from firefish.meshcache import MeshCache
+    cache = MeshCache(tmpdir.join('cache').strpath)
+    mesh_dir = os.path.join(tmpcase.root_dir_path, 'constant', 'polyMesh')
+    os.makedirs(mesh_dir)
+    with open(os.path.join(mesh_dir, 'points'), 'w') as f:
+        f.write('()')
+    snap = snappy.SnappyHexMesh([sphere], 4, tmpcase)
+    assert 'snappyHexMesh' in snap.generate_mesh(cache=cache)
+    timings = snap.generate_mesh(cache=cache)
+    assert list(timings) == ['meshCache']
+    assert len(fake_openfoam.read().splitlines()) == 1
+
+def _snappy_dict(case):
+    return case.read_data_file(FileName.SNAPPY_HEX_MESH)
+
+@pytest.fixture
+def two_spheres(tmpcase, geomdir):
+    stl_path = os.path.join(geomdir, 'unit_sphere.stl')
+    return [geom.Geometry(geom.GeometryFormat.STL, stl_path, name, tmpcase)
+            for name in ('body', 'fin')]
+
+def test_geometry_refinement_defaults(tmpcase, two_spheres):
+    snap = snappy.SnappyHexMesh(two_spheres, 4, tmpcase)
+    body, fin = [snap.geometry_refinement(g) for g in two_spheres]
+    assert body['surface'] == (5, 6)
+    assert body['distance'] == [(0.1, 4), (0.2, 3)]
+    assert fin['distance'] == []
+
+def test_geometry_refinement_overrides(tmpcase, two_spheres):
+    snap = snappy.SnappyHexMesh(two_spheres, 4, tmpcase)
+    snap.set_geometry_refinement('body', surface=(3, 4), distance=[])
+    snap.set_geometry_refinement('fin', surface=(7, 8), edge=8, layers=3,
+                                 distance=[(0.01, 7)])
+    snap.write_snappy_dict()
+    d = _snappy_dict(tmpcase)
+    controls = d['castellatedMeshControls']
+    assert list(controls['refinementSurfaces']['body']['level']) == [3, 4]
+    assert list(controls['refinementSurfaces']['fin']['level']) == [7, 8]
+    assert [f['level'] for f in controls['features']] == [6, 8]
+    assert d['addLayersControls']['layers']['fin']['nSurfaceLayers'] == 3
+    assert list(controls['refinementRegions']) == ['fin']
+    assert controls['refinementRegions']['fin']['mode'] == 'distance'
+
+def test_combined_surface(tmpcase, two_spheres):
+    snap = snappy.SnappyHexMesh(two_spheres, 4, tmpcase)
+    snap.set_geometry_refinement('fin', surface=(7, 8), edge=8, layers=3)
+    snap.combine_surfaces('rocket')
+    snap.write_snappy_dict()
+    assert os.path.isfile(os.path.join(
+        tmpcase.root_dir_path, 'constant', 'triSurface', 'rocket.stl'))
+
+    d = _snappy_dict(tmpcase)
+    assert list(d['geometry']) == ['rocket.stl']
+    assert d['geometry']['rocket.stl']['regions']['fin']['name'] == 'fin'
+    controls = d['castellatedMeshControls']
+    assert [f['level'] for f in controls['features']] == [8]
+    surface = controls['refinementSurfaces']['rocket']
+    assert list(surface['level']) == [5, 6]
+    assert list(surface['regions']['fin']['level']) == [7, 8]
+    assert list(surface['regions']['body']['level']) == [5, 6]
+    assert d['addLayersControls']['layers']['fin']['nSurfaceLayers'] == 3
+    assert list(controls['refinementRegions']) == ['rocket']
+
+def test_refinement_shapes(tmpcase, two_spheres):
+    snap = snappy.SnappyHexMesh(two_spheres, 4, tmpcase)
+    snap.add_refinement_box('nose', [-1, -1, -1], [1, 1, 1], 5)
+    snap.add_refinement_cylinder('wake', [0, 0, 0], [0, 5, 0], 0.5, 3)
+    snap.write_snappy_dict()
+    d = _snappy_dict(tmpcase)
+    assert d['geometry']['nose']['type'] == 'searchableBox'
+    assert d['geometry']['wake']['type'] == 'searchableCylinder'
+    regions = d['castellatedMeshControls']['refinementRegions']
+    assert regions['nose']['mode'] == 'inside'
+    assert regions['wake']['mode'] == 'inside'
+
+def test_estimate_mesh_uses_overrides(tmpcase, two_spheres):
+    background = snappy.write_background_mesh(tmpcase, two_spheres,
+                                              cell_size=0.25)
+    snap = snappy.SnappyHexMesh(two_spheres, 4, tmpcase)
+    snap.maxGlobalCells = 10**9
+    snap.set_geometry_refinement('fin', surface=(2, 2))
+    snap.set_geometry_refinement('body', surface=(2, 2), distance=[])
+    coarse = snap.estimate_mesh(background)
+    snap.add_refinement_cylinder('wake', [0, 0, 0], [0, 5, 0], 0.5, 3)
+    assert snap.estimate_mesh(background).cells > coarse.cells
+
+def test_auto_refinement(tmpcase, sphere):
+    snappy.write_background_mesh(tmpcase, [sphere], cell_size=0.5)
+    snap = snappy.SnappyHexMesh([sphere], 4, tmpcase)
+    levels = snap.auto_refinement(angular_resolution=10)
+    assert levels == {'sphere': (2, 2, 2)}
+    assert snap.geometry_refinement(sphere)['surface'] == (2, 2)
+
+def test_auto_refinement_feature_angle(tmpcase):
+    # The fins meet the body and each other at right angles. These edges
+    # are features and should not count as highly curved surface.
+    rocket, _ = geom.rocket_surface(
+        0.05, 0.3, 1, fin_count=4, fin_root_chord=0.2, fin_tip_chord=0.1,
+        fin_span=0.08, fin_thickness=0.005)
+    part = geom.Geometry(geom.GeometryFormat.STL, None, 'rocket', tmpcase,
+                         geom=rocket)
+    snappy.write_background_mesh(tmpcase, [part], cell_size=0.1)
+    snap = snappy.SnappyHexMesh([part], 4, tmpcase)
+    levels = snap.auto_refinement()['rocket']
+    assert levels == geom.stl_refinement_levels(rocket, 0.1)
+    assert levels[1] < snap.auto_refinement(feature_angle=100)['rocket'][1]
+
+def test_choose_location_in_mesh(tmpcase, sphere):
+    background = snappy.write_background_mesh(tmpcase, [sphere], cell_size=0.5)
+    snap = snappy.SnappyHexMesh([sphere], 4, tmpcase)
+    snap.refinementSurfaceMin, snap.refinementSurfaceMax = 2, 2
+    snap.edgeRefinementLevel = 3
+    snap.distanceLevels = [2, 1]
+    point = snap.choose_location_in_mesh()
+    assert snap.locationToKeep == point
+    assert np.linalg.norm(point) > 1.2
+    assert np.all(np.array(point) > background.min_)
+    assert np.all(np.array(point) < background.max_)
+    snap.check_location_in_mesh()
+
+def test_check_location_in_mesh(tmpcase, sphere):
+    snappy.write_background_mesh(tmpcase, [sphere], cell_size=0.5)
+    snap = snappy.SnappyHexMesh([sphere], 4, tmpcase)
+    snap.refinementSurfaceMin, snap.refinementSurfaceMax = 2, 2
+    snap.edgeRefinementLevel = 3
+    snap.distanceLevels = [2, 1]
+    # Centres of cells at the finest level, which is 3, are clear of faces.
+    spacing = 0.5 / 2 ** 3
+    centre = lambda x, y, z: [spacing * (n + 0.5) for n in (x, y, z)]
+    snap.check_location_in_mesh(centre(20, 20, 0))
+    for point, reason in ((centre(0, 0, 0), 'inside'),
+                          (centre(16, 0, 0), 'from a surface'),
+                          (centre(100, 0, 0), 'outside'),
+                          ([1.25, 1.3, 0.03], 'face')):
+        with pytest.raises(ValueError, match=reason):
+            snap.check_location_in_mesh(point)
+
+def test_write_snappy_dict_checks_location(tmpcase, sphere):
+    snappy.write_background_mesh(tmpcase, [sphere], cell_size=0.5)
+    snap = snappy.SnappyHexMesh([sphere], 4, tmpcase)
+    with pytest.raises(ValueError):
+        snap.write_snappy_dict()
+    assert not os.path.isfile(os.path.join(
+        tmpcase.root_dir_path, 'system', 'snappyHexMeshDict'))
+
+    snap.locationToKeep = None
+    snap.write_snappy_dict()
+    location = _snappy_dict(tmpcase)['castellatedMeshControls'][
+        'locationInMesh']
+    assert np.allclose(location, snap.locationToKeep)
+
+def test_decimate_geometries(tmpcase, sphere):
+    background = snappy.write_background_mesh(tmpcase, [sphere], cell_size=0.5)
+    snap = snappy.SnappyHexMesh([sphere], 4, tmpcase)
+    snap.refinementSurfaceMin, snap.refinementSurfaceMax = 1, 1
+    faces = len(sphere.geom)
+    sphere.saved = True
+    deviations = snap.decimate_geometries(cell_fraction=0.2)
+    assert 0 < deviations['sphere'] <= 0.2 * background.cell_size / 2
+    assert len(sphere.geom) < faces
+    assert not sphere.saved
+
+def test_log_parser(meshingdir):
+    parser = snappy.SnappyLogParser.parse_file(
+        os.path.join(meshingdir, 'log.snappyHexMesh'))
+    table = parser.table()
+    assert list(table['stage']) == [
+        'Feature refinement iteration 0', 'Surface refinement iteration 0',
+        'After refinement', 'Snapped mesh',
+    ]
+    assert list(table['phase']) == ['refinement'] * 3 + ['snapping']
+    assert list(table['cells']) == [8672, 9470, 9102, 9102]
+    assert table['seconds'][0] == pytest.approx(0.07)
+    assert table['seconds'][2] == pytest.approx(0.06)
+    assert table['memory'][0] is None or np.isnan(table['memory'][0])
+    assert table['memory'][2] == 312 * 1024**2
+    assert list(parser.phaseTimings) == [
+        'Read mesh', 'Mesh refined', 'Mesh snapped', 'Finished meshing']
+
+@pytest.mark.parametrize('line,memory', [
+    ('Memory usage (mb) : 312', 312 * 1024**2),
+    ('mem = 2 gb', 2 * 1024**3),
+    ('Memory usage (kB) : 5', 5 * 1024),
+])
+def test_log_parser_memory_units(line, memory):
+    parser = snappy.SnappyLogParser()
+    parser.feed('{}\nAfter refinement : cells:10  faces:60  points:20\n'
+                .format(line))
+    assert parser.records[0].memory == memory
+
+def test_log_parser_incremental(meshingdir, tmpdir):
+    with open(os.path.join(meshingdir, 'log.snappyHexMesh')) as f:
+        log = f.read()
+    log_path = tmpdir.join('log').strpath
+    records = []
+    parser = snappy.SnappyLogParser(record_callback=records.append)
+    # Split the log part way through a line.
+    split = log.index('After refinement :') + 5
+    with open(log_path, 'w') as f:
+        f.write(log[:split])
+    parser.update_from_file(log_path)
+    assert [r.cells for r in records] == [8672, 9470]
+    with open(log_path, 'a') as f:
+        f.write(log[split:])
+    parser.update_from_file(log_path)
+    assert [r.cells for r in records] == [8672, 9470, 9102, 9102]
@@ -0,0 +1,148 @@
+import os
+
+import numpy as np
+import pytest
+
+import firefish.geometry as geom
+import firefish.spatial as spatial
+
+# Set this to be comparable to the tolerance at which we generate surfaces in
+# the test geometry.
+TOLERANCE=2e-2
+
+@pytest.fixture
+def unit_sphere(geomdir):
+    """An stl.mesh.Mesh representing the unit sphere."""
+    stl_path = os.path.join(geomdir, 'unit_sphere.stl')
+    return geom.stl_load(stl_path)
+
+@pytest.fixture
+def points():
+    """Random points in and around the unit sphere."""
+    return np.random.RandomState(0).uniform(-1.5, 1.5, (500, 3))
+
+def brute_force_distance(triangles, points):
+    """Distance from each point to the nearest of all the triangles."""
+    distances = []
+    for p in points:
+        closest = spatial._closest_points_on_triangles(
+            np.broadcast_to(p, triangles[:, 0].shape),
+            triangles[:, 0], triangles[:, 1], triangles[:, 2])
+        distances.append(np.sqrt(((closest - p) ** 2).sum(axis=1)).min())
+    return np.array(distances)
+
+def test_distance_matches_brute_force(unit_sphere, points):
+    bvh = spatial.TriangleBVH(unit_sphere, leaf_size=4)
+    expected = brute_force_distance(unit_sphere.vectors.astype(float), points)
+    assert np.allclose(bvh.distance(points), expected, atol=1e-12)
+
+def test_distance_to_sphere(unit_sphere, points):
+    bvh = spatial.TriangleBVH(unit_sphere)
+    radii = np.sqrt((points ** 2).sum(axis=1))
+    assert np.allclose(bvh.distance(points), np.abs(radii - 1), atol=TOLERANCE)
+
+def test_closest_points(unit_sphere, points):
+    bvh = spatial.TriangleBVH(unit_sphere)
+    distances, closest, faces = bvh.distance(points, return_closest=True)
+    assert np.allclose(np.sqrt(((closest - points) ** 2).sum(axis=1)),
+                       distances)
+
+    # The closest point lies on the reported face.
+    triangles = unit_sphere.vectors.astype(float)[faces]
+    on_face = spatial._closest_points_on_triangles(
+        closest, triangles[:, 0], triangles[:, 1], triangles[:, 2])
+    assert np.allclose(on_face, closest)
+
+def test_chunked_queries(unit_sphere, points):
+    bvh = spatial.TriangleBVH(unit_sphere)
+    assert np.array_equal(bvh.distance(points, chunk_size=7),
+                          bvh.distance(points))
+    assert np.array_equal(bvh.contains(points, chunk_size=7),
+                          bvh.contains(points))
+
+def test_contains(unit_sphere, points):
+    bvh = spatial.TriangleBVH(unit_sphere)
+    radii = np.sqrt((points ** 2).sum(axis=1))
+    clear = np.abs(radii - 1) > TOLERANCE
+    assert np.array_equal(bvh.contains(points)[clear], radii[clear] < 1)
+    assert np.array_equal(bvh.contains(points, n_rays=1)[clear],
+                          radii[clear] < 1)
+
+def test_signed_distance(unit_sphere, points):
+    bvh = spatial.TriangleBVH(unit_sphere)
+    radii = np.sqrt((points ** 2).sum(axis=1))
+    clear = np.abs(radii - 1) > TOLERANCE
+    assert np.allclose(bvh.signed_distance(points)[clear],
+                       radii[clear] - 1, atol=TOLERANCE)
+
+def test_multiple_geometries(unit_sphere):
+    moved = geom.stl_translate(geom.stl_copy(unit_sphere), [5, 0, 0])
+    bvh = spatial.TriangleBVH([unit_sphere, moved])
+    points = np.array([[0, 0, 0], [5, 0, 0], [2.5, 0, 0]])
+    _, _, faces = bvh.distance(points[:2], return_closest=True)
+    assert np.array_equal(faces // len(unit_sphere), [0, 1])
+    assert np.array_equal(bvh.contains(points), [True, True, False])
+    assert np.isclose(bvh.distance(points[2:])[0], 1.5, atol=TOLERANCE)
+
+def test_geometry_and_indexed_inputs(unit_sphere, points):
+    indexed = geom.stl_weld(unit_sphere)
+    expected = spatial.TriangleBVH(unit_sphere).distance(points)
+    assert np.allclose(spatial.TriangleBVH(indexed).distance(points),
+                       expected)
+
+def test_no_triangles():
+    with pytest.raises(ValueError):
+        spatial.TriangleBVH([])
+
+def test_signed_distance_grid(unit_sphere):
+    shape = (9, 7, 5)
+    sdf = spatial.signed_distance_grid(unit_sphere, [-1.5] * 3, [1.5] * 3,
+                                       shape)
+    assert sdf.shape == shape
+    assert sdf.dtype == np.float32
+    x, y, z = np.meshgrid(*spatial.grid_axes([-1.5] * 3, [1.5] * 3, shape),
+                          indexing='ij')
+    radii = np.sqrt(x ** 2 + y ** 2 + z ** 2)
+    assert np.allclose(sdf, radii - 1, atol=TOLERANCE)
+
+def test_signed_distance_grid_slabs(unit_sphere):
+    bvh = spatial.TriangleBVH(unit_sphere)
+    args = (bvh, [-1.5] * 3, [1.5] * 3, (9, 7, 5))
+    whole = spatial.signed_distance_grid(*args)
+    assert np.array_equal(spatial.signed_distance_grid(*args, slab_points=1),
+                          whole)
+    assert np.array_equal(spatial.signed_distance_grid(*args, slab_points=12),
+                          whole)
+    assert np.array_equal(spatial.signed_distance_grid(*args, slab_points=70,
+                                                       processes=2),
+                          whole)
+
+@pytest.mark.parametrize('slab_points', [1, 3, 12, 35, 70, 10**6])
+def test_slab_ranges(slab_points):
+    shape = (9, 7, 5)
+    covered = np.zeros(shape, dtype=int)
+    for r in spatial._slab_ranges(shape, slab_points):
+        assert covered[r].size <= slab_points
+        covered[r] += 1
+    assert np.all(covered == 1)
+
+def test_signed_distance_grid_output(unit_sphere, tmpdir):
+    args = (unit_sphere, [-1.5] * 3, [1.5] * 3, (6, 5, 4))
+    expected = spatial.signed_distance_grid(*args, dtype=np.float64)
+
+    out = np.zeros((6, 5, 4))
+    assert spatial.signed_distance_grid(*args, out=out) is out
+    assert np.array_equal(out, expected)
+
+    path = tmpdir.join('sdf.npy').strpath
+    mapped = spatial.signed_distance_grid(*args, out=path)
+    assert isinstance(mapped, np.memmap)
+    assert np.array_equal(np.load(path), expected.astype(np.float32))
+
+    # Paths need not be str, e.g. unicode on Python 2.
+    other = u'{}'.format(tmpdir.join('other.npy').strpath)
+    spatial.signed_distance_grid(*args, out=other)
+    assert np.array_equal(np.load(other), expected.astype(np.float32))
+
+    with pytest.raises(ValueError):
+        spatial.signed_distance_grid(*args, out=np.zeros((6, 5)))